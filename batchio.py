@@ -0,0 +1,187 @@
+"""
+Batched datagram I/O shared by sender.py and receiver.py.
+
+Outgoing packets are queued as (header, payload) pairs and written by flush(): each
+packet goes out with one scatter/gather sendmsg, so header and payload are never
+concatenated, and on Linux runs of equally sized packets are handed to the kernel in
+a single sendmsg with UDP generic segmentation offload (GSO). Incoming datagrams are
+drained per wakeup into a ring of preallocated buffers with recvmsg_into, optionally
+with UDP generic receive offload (GRO) coalescing several datagrams per call. When the
+platform refuses GSO or GRO the layer falls back to one datagram per syscall.
+"""
+import socket
+import struct
+import sys
+
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)   #Linux >= 4.18
+UDP_GRO = getattr(socket, "UDP_GRO", 104)           #Linux >= 5.0
+GSO_SIZE = struct.Struct("=H")
+GRO_SIZE = struct.Struct("=i")
+
+MAX_GSO_SEGMENTS = 64       #Kernel limit of datagrams per GSO send
+MAX_GSO_BYTES = 65000       #Stay below the 64 KiB UDP length limit of the super datagram
+RECV_BUFFER = 65536         #Size of each preallocated receive buffer
+RECV_RING = 64              #Number of receive buffers, i.e. datagram reads per recv_batch()
+
+
+class BatchSocket:
+    """
+    Batching wrapper around a non-blocking UDP socket, either connected or (for a server)
+    sending to and receiving from any address.
+    """
+
+    def __init__(self, sock, batch=False):
+        self.sock = sock
+        self.batch = batch              #Queue packets until flush(), otherwise send immediately
+        self.pending = []               #Queued (header, payload, address) tuples, address None if connected
+        self.gso = batch and sys.platform.startswith("linux") and self._probe(UDP_SEGMENT)
+        self.gro = False
+        self.ring = [bytearray(RECV_BUFFER) for _ in range(RECV_RING if batch else 1)]
+        self.views = [memoryview(buf) for buf in self.ring]
+        self.ancbufsize = socket.CMSG_SPACE(GRO_SIZE.size)
+        self.packetsSent = 0            #Counters for the stats
+        self.sendCalls = 0              # " "
+        self.packetsReceived = 0        # " "
+        self.recvCalls = 0              # " "
+        self.sendBlocked = 0            # " " (packets dropped because the socket buffer was full)
+
+    def _probe(self, option):
+        """Return True if the UDP socket option is supported by this kernel."""
+        try:
+            self.sock.getsockopt(SOL_UDP, option)
+            return True
+        except OSError:
+            return False
+
+    def enable_gro(self):
+        """
+        Ask the kernel to coalesce received datagrams (GRO). Only enabled in batch mode,
+        silently left off when unsupported.
+
+        Returns:
+            bool (True if GRO is on)
+        """
+        if self.batch and sys.platform.startswith("linux"):
+            try:
+                self.sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+                self.gro = True
+            except OSError:
+                self.gro = False
+        return self.gro
+
+    def send(self, header, payload=b'', address=None):
+        """
+        Queue a packet, or send it straight away when not batching.
+
+        Args:
+            header: bytes
+            payload: bytes-like
+            address: destination (None on a connected socket)
+
+        Returns:
+
+        """
+        self.pending.append((header, payload, address))
+        if not self.batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Send every queued packet, grouping runs of equally sized packets to the same
+        address into GSO sends.
+
+        Returns:
+
+        """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+
+        i = 0
+        while i < len(pending):
+            header, payload, address = pending[i]
+            size = len(header) + len(payload)
+            target = () if address is None else (address,)
+            j = i + 1
+            if self.gso:
+                #Every datagram of a GSO send has the same size, only the last may be shorter
+                limit = min(MAX_GSO_SEGMENTS, MAX_GSO_BYTES // size)
+                while j < len(pending) and j - i < limit:
+                    nextSize = len(pending[j][0]) + len(pending[j][1])
+                    if nextSize > size or pending[j][2] != address:
+                        break
+                    j += 1
+                    if nextSize < size:
+                        break
+
+            if j - i > 1:
+                buffers = [part for packet in pending[i:j] for part in packet[:2]]
+                try:
+                    self.sock.sendmsg(buffers, [(SOL_UDP, UDP_SEGMENT, GSO_SIZE.pack(size))], 0, *target)
+                except BlockingIOError:
+                    self.sendBlocked += j - i
+                except OSError:
+                    #GSO refused (e.g. no checksum offload): fall back for good and resend singly
+                    self.gso = False
+                    self.pending = pending[i:] + self.pending
+                    self.flush()
+                    return
+                self.sendCalls += 1
+                self.packetsSent += j - i
+            else:
+                try:
+                    self.sock.sendmsg([header, payload], [], 0, *target)
+                except BlockingIOError:
+                    self.sendBlocked += 1
+                self.sendCalls += 1
+                self.packetsSent += 1
+            i = j
+
+    def recv_batch(self):
+        """
+        Drain the datagrams currently queued on the socket, up to one read per ring buffer.
+        The returned packets are views into the preallocated buffers: they stay valid only
+        until the next call, so anything kept longer must be copied.
+
+        Returns:
+            list of memoryview packets
+        """
+        return [packet for packet, address in self.recv_batch_from()]
+
+    def recv_batch_from(self):
+        """
+        recv_batch() with the address each packet came from.
+
+        Returns:
+            list of (memoryview packet, address)
+        """
+        packets = []
+        for view in self.views:
+            try:
+                nbytes, ancdata, flags, address = self.sock.recvmsg_into([view], self.ancbufsize)
+            except BlockingIOError:
+                break
+            self.recvCalls += 1
+
+            segment = nbytes
+            for level, ctype, data in ancdata:
+                if level == SOL_UDP and ctype == UDP_GRO:
+                    segment = GRO_SIZE.unpack(data[:GRO_SIZE.size])[0]
+            for start in range(0, nbytes, segment or nbytes or 1):
+                packets.append((view[start:min(start + segment, nbytes)], address))
+        self.packetsReceived += len(packets)
+        return packets
+
+    def stats(self):
+        """
+        Return the syscall batching counters as log lines.
+
+        Returns:
+            str
+        """
+        sent = self.packetsSent / self.sendCalls if self.sendCalls else 0
+        received = self.packetsReceived / self.recvCalls if self.recvCalls else 0
+        return (f"Packets sent per syscall: {round(sent, 2)} ({self.packetsSent} in {self.sendCalls}, GSO {'on' if self.gso else 'off'})\n"
+                f"Packets received per syscall: {round(received, 2)} ({self.packetsReceived} in {self.recvCalls}, GRO {'on' if self.gro else 'off'})\n")
@@ -0,0 +1,317 @@
+"""
+End-to-end benchmark of STP on loopback.
+
+Runs receiver.py and sender.py as separate processes over every combination of the
+file sizes, max_win, rto, flp and rlp given, and records for each run
+
+    time_s          SYN sent to FIN ACKed, from the sender log
+    goodput_MBps    file bytes / time_s
+    retrans_ratio   retransmitted segments / original segments sent
+    cpu_s_per_MB    user + system CPU time of both programs per MB of file
+    *_rss_kb        peak resident set size of each program
+    identical       output byte-identical to the input
+
+Results are written as JSON to --output. Two result files are compared with
+
+    python3 bench.py compare <baseline.json> <new.json> [--threshold=0.1]
+
+which prints the median of each configuration side by side and exits with status 1 if
+goodput dropped or CPU per MB rose by more than the threshold (a fraction).
+
+Usage:
+    python3 bench.py [--sizes=10000,1000000] [--win=5000] [--rto=200] [--flp=0,0.1] [--rlp=0]
+                     [--repeat=3] [--sender-opts="--cc=reno"] [--receiver-opts=""] [--output=bench.json]
+"""
+import filecmp
+import itertools
+import json
+import os
+import platform
+import random
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from stp import parse_options
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+OPTIONS = {
+    "sizes": "10000,1000000",   #--sizes=bytes,...: file sizes (random content)
+    "win": "5000",              #--win=bytes,...: max_win values
+    "rto": "200",               #--rto=ms,...: rto values
+    "flp": "0",                 #--flp=p,...: forward loss probabilities
+    "rlp": "0",                 #--rlp=p,...: reverse loss probabilities
+    "repeat": 3,                #--repeat=N: runs per configuration (the loss simulation is seeded with the run number)
+    "sender_opts": "",          #--sender-opts="...": extra sender options
+    "receiver_opts": "",        #--receiver-opts="...": extra receiver options
+    "sendport": 56007,          #--sendport=N: sender port
+    "recvport": 59607,          #--recvport=N: receiver port
+    "timeout": 120,             #--timeout=seconds: a run taking longer is killed and marked failed
+    "output": "bench.json",     #--output=path: results file
+}
+
+COMPARE_OPTIONS = {
+    "threshold": 0.1,           #--threshold=fraction: change counted as a regression
+}
+
+CONFIG = ("size", "max_win", "rto", "flp", "rlp")   #Keys identifying a configuration
+
+
+def parse_list(value, kind):
+    """
+    Parse a comma separated list of numbers.
+
+    Args:
+        value: str
+        kind: int or float
+
+    Returns:
+        list
+    """
+    try:
+        return [kind(item) for item in value.split(",") if item]
+    except ValueError:
+        sys.exit(f"Invalid list, must be numerical: {value}")
+
+def read_stats(path):
+    """
+    Read the statistics at the end of a log, and the time of its last event.
+
+    Args:
+        path: str
+
+    Returns:
+        dict of statistic name -> value, with "last_event_ms"
+    """
+    stats = {"last_event_ms": 0.0}
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if fields and fields[0] in ("snd", "rcv", "drp"):
+                stats["last_event_ms"] = float(fields[1])
+                continue
+            name, sep, value = line.partition(":")
+            try:
+                stats[name.strip()] = float(value.split()[0])
+            except (ValueError, IndexError):
+                pass
+    return stats
+
+def udp_bound(port):
+    """
+    Check whether a UDP socket on this host is bound to port, from the kernel's socket table.
+
+    Args:
+        port: int
+
+    Returns:
+        bool, None if the socket table cannot be read (not Linux)
+    """
+    try:
+        with open("/proc/net/udp") as table:
+            next(table)     #header
+            return any(int(line.split()[1].rsplit(":", 1)[1], 16) == port for line in table)
+    except OSError:
+        return None
+
+def wait_bound(process, port, deadline):
+    """
+    Wait until a child process has bound its UDP port, so that nothing is sent to it before
+    it listens. Probing with a bind of our own could steal the port from the child, so the
+    socket table is read instead; where it cannot be, wait a fixed 0.2 s.
+
+    Args:
+        process: subprocess.Popen
+        port: int
+        deadline: float (monotonic time)
+
+    Returns:
+
+    """
+    while process.poll() is None and time.monotonic() < deadline:
+        bound = udp_bound(port)
+        if bound is None:
+            time.sleep(0.2)
+            return
+        if bound:
+            return
+        time.sleep(0.005)
+
+def wait_child(process, deadline):
+    """
+    Wait for a child process, killing it at deadline, and return its resource usage.
+
+    Args:
+        process: subprocess.Popen
+        deadline: float (monotonic time)
+
+    Returns:
+        (exit status or None if killed, resource usage)
+    """
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return process.returncode, usage
+        if time.monotonic() > deadline:
+            process.kill()
+            pid, status, usage = os.wait4(process.pid, 0)
+            process.returncode = -9
+            return None, usage
+        time.sleep(0.01)
+
+def run_once(workdir, infile, size, max_win, rto, flp, rlp, seed, options):
+    """
+    Transfer infile once and measure it.
+
+    Args:
+        workdir: str (directory for the output and the logs)
+        infile: str
+        size, max_win, rto, flp, rlp: configuration
+        seed: int (seed of the loss simulation)
+        options: dict (parsed options)
+
+    Returns:
+        dict (one result)
+    """
+    outfile = os.path.join(workdir, "out.bin")
+    if os.path.exists(outfile):
+        os.remove(outfile)
+    sendport, recvport = str(options["sendport"]), str(options["recvport"])
+    receiver = subprocess.Popen([sys.executable, os.path.join(HERE, "receiver.py"), recvport, sendport, outfile, str(max_win)]
+                                + shlex.split(options["receiver_opts"]), cwd=workdir, stderr=subprocess.DEVNULL)
+    wait_bound(receiver, options["recvport"], time.monotonic() + options["timeout"])
+    started = time.monotonic()
+    deadline = started + options["timeout"]
+    sender = subprocess.Popen([sys.executable, os.path.join(HERE, "sender.py"), sendport, recvport, infile, str(max_win),
+                               str(rto), str(flp), str(rlp), f"--seed={seed}"] + shlex.split(options["sender_opts"]),
+                              cwd=workdir, stderr=subprocess.DEVNULL)
+    senderStatus, senderUsage = wait_child(sender, deadline)
+    wall = time.monotonic() - started
+    receiverStatus, receiverUsage = wait_child(receiver, deadline)
+
+    result = {"size": size, "max_win": max_win, "rto": rto, "flp": flp, "rlp": rlp, "seed": seed,
+              "ok": senderStatus == 0 and receiverStatus == 0}
+    result["identical"] = os.path.exists(outfile) and filecmp.cmp(infile, outfile, shallow=False)
+    stats = read_stats(os.path.join(workdir, "Sender_log.txt")) if result["ok"] else {}
+    elapsed = stats.get("last_event_ms", 0) / 1000 or wall
+    sent = stats.get("Original segments sent", 0)
+    cpu = (senderUsage.ru_utime + senderUsage.ru_stime + receiverUsage.ru_utime + receiverUsage.ru_stime)
+    result.update({
+        "time_s": round(elapsed, 4),
+        "goodput_MBps": round(size / elapsed / 1e6, 4) if result["identical"] else 0.0,
+        "retrans_ratio": round(stats.get("Retransmitted segments", 0) / sent, 4) if sent else 0.0,
+        "sender_cpu_s": round(senderUsage.ru_utime + senderUsage.ru_stime, 4),
+        "receiver_cpu_s": round(receiverUsage.ru_utime + receiverUsage.ru_stime, 4),
+        "cpu_s_per_MB": round(cpu / max(size, 1) * 1e6, 4),
+        "sender_rss_kb": senderUsage.ru_maxrss,
+        "receiver_rss_kb": receiverUsage.ru_maxrss,
+    })
+    return result
+
+def run_matrix(options):
+    """
+    Run every configuration of the matrix options["repeat"] times and write the results.
+
+    Args:
+        options: dict (parsed options)
+
+    Returns:
+        list of results
+    """
+    matrix = list(itertools.product(parse_list(options["sizes"], int), parse_list(options["win"], int),
+                                    parse_list(options["rto"], int), parse_list(options["flp"], float),
+                                    parse_list(options["rlp"], float)))
+    results = []
+    with tempfile.TemporaryDirectory(prefix="stp-bench-") as workdir:
+        for size, max_win, rto, flp, rlp in matrix:
+            infile = os.path.join(workdir, f"in-{size}.bin")
+            if not os.path.exists(infile):
+                with open(infile, "wb") as file:
+                    file.write(random.Random(size).randbytes(size))
+            for seed in range(options["repeat"]):
+                result = run_once(workdir, infile, size, max_win, rto, flp, rlp, seed, options)
+                results.append(result)
+                print(f"size={size} win={max_win} rto={rto} flp={flp} rlp={rlp} seed={seed}: "
+                      f"{'ok' if result['ok'] and result['identical'] else 'FAILED'} {result['time_s']}s "
+                      f"{result['goodput_MBps']} MB/s retrans {result['retrans_ratio']} "
+                      f"cpu {result['cpu_s_per_MB']} s/MB rss {result['sender_rss_kb']}/{result['receiver_rss_kb']} KB",
+                      flush=True)
+
+    meta = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "sender_opts": options["sender_opts"], "receiver_opts": options["receiver_opts"]}
+    with open(options["output"], "w") as file:
+        json.dump({"meta": meta, "runs": results}, file, indent=1)
+    return results
+
+def summarise(runs):
+    """
+    Median goodput and CPU per MB of each configuration, failed runs counted separately.
+
+    Args:
+        runs: list of results
+
+    Returns:
+        dict of configuration tuple -> (goodput, cpu per MB, failed runs)
+    """
+    groups = {}
+    for run in runs:
+        groups.setdefault(tuple(run[key] for key in CONFIG), []).append(run)
+    summary = {}
+    for config, group in groups.items():
+        good = [run for run in group if run["ok"] and run["identical"]]
+        summary[config] = (statistics.median(run["goodput_MBps"] for run in good) if good else 0.0,
+                           statistics.median(run["cpu_s_per_MB"] for run in good) if good else 0.0,
+                           len(group) - len(good))
+    return summary
+
+def compare(baseline, new, threshold):
+    """
+    Print the configurations of two result files side by side.
+
+    Args:
+        baseline: str (path)
+        new: str (path)
+        threshold: float (relative change counted as a regression)
+
+    Returns:
+        int (number of regressions)
+    """
+    with open(baseline) as file:
+        before = summarise(json.load(file)["runs"])
+    with open(new) as file:
+        after = summarise(json.load(file)["runs"])
+
+    regressions = 0
+    print(f"{'size':>10} {'win':>7} {'rto':>5} {'flp':>5} {'rlp':>5}  {'MB/s before':>11} {'after':>8} {'change':>7}"
+          f"  {'cpu s/MB before':>15} {'after':>8} {'change':>7}")
+    for config in sorted(before.keys() & after.keys()):
+        goodputBefore, cpuBefore, failedBefore = before[config]
+        goodputAfter, cpuAfter, failedAfter = after[config]
+        goodputChange = goodputAfter / goodputBefore - 1 if goodputBefore else 0.0
+        cpuChange = cpuAfter / cpuBefore - 1 if cpuBefore else 0.0
+        regressed = goodputChange < -threshold or cpuChange > threshold or failedAfter > failedBefore
+        regressions += regressed
+        print(f"{config[0]:>10} {config[1]:>7} {config[2]:>5} {config[3]:>5} {config[4]:>5}  {goodputBefore:>11.3f}"
+              f" {goodputAfter:>8.3f} {goodputChange:>+7.1%}  {cpuBefore:>15.3f} {cpuAfter:>8.3f} {cpuChange:>+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}{f'  ({failedAfter} failed)' if failedAfter else ''}")
+    for config in sorted(before.keys() ^ after.keys()):
+        print(f"{' '.join(map(str, config))}: only in {'baseline' if config in before else 'new'}")
+    return regressions
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["compare"]:
+        if len(sys.argv) < 4:
+            sys.exit("Usage: python3 bench.py compare <baseline.json> <new.json> [--threshold=0.1]")
+        options = parse_options(sys.argv[4:], COMPARE_OPTIONS)
+        sys.exit(1 if compare(sys.argv[2], sys.argv[3], options["threshold"]) else 0)
+
+    options = parse_options(sys.argv[1:], OPTIONS)
+    results = run_matrix(options)
+    sys.exit(0 if all(result["ok"] and result["identical"] for result in results) else 1)
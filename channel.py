@@ -0,0 +1,267 @@
+"""
+Channel emulator: loss, delay, reordering, duplication, corruption and a bandwidth limit for one
+direction of an STP link, driven by its own seeded random generator so that the same
+seed gives the same decisions for the same sequence of packets, run after run.
+
+A channel is configured by a spec of comma separated settings, e.g.
+
+    seed=7,loss=0.02,ge=0.01/0.3/0.9,delay=20,jitter=5,reorder=0.05,duplicate=0.01,corrupt=0.001,rate=8,queue=65536
+
+    seed=N          seed of the random generator (unseeded if omitted)
+    loss=P          probability that a packet is lost (in the good state of the burst model)
+    ge=P/R[/H]      Gilbert-Elliott burst loss: P good->bad and R bad->good transition
+                    probabilities per packet, H loss probability in the bad state (default 1)
+    delay=MS        fixed one way delay in milliseconds
+    jitter=MS       delay varies uniformly by up to +-jitter milliseconds
+    reorder=P       probability that a packet skips the delay and overtakes those queued
+    duplicate=P     probability that a packet is delivered twice
+    corrupt=P       probability that a packet is delivered with one bit flipped
+    rate=MBIT       bandwidth limit in Mbit/s, packets are serialised one after the other
+    queue=BYTES     tail drop once this many bytes wait for the rate limit (0 = unlimited)
+
+It is used in-process by sender.py (--channel / --reverse-channel, replacing the i.i.d.
+flp/rlp drops), or standalone as a local UDP proxy between the two programs:
+
+    python3 channel.py <proxy_port> <sender_port> <receiver_port> [--forward=spec] [--reverse=spec]
+
+with the sender started as sender.py <sender_port> <proxy_port> ... and the receiver as
+receiver.py <receiver_port> <proxy_port> .... Datagrams from receiver_port travel the
+reverse channel to sender_port, everything else the forward channel to receiver_port.
+"""
+import random
+import selectors
+import socket
+import sys
+import time
+
+from stp import localhost, parse_options
+from timers import TimerQueue
+
+NOW = (0.0,)    #Delivered once, without delay
+LOST = ()       #Not delivered
+
+
+class Channel:
+    """One direction of an emulated link."""
+
+    def __init__(self, loss=0.0, seed=None, ge=None, delay=0.0, jitter=0.0, reorder=0.0,
+                 duplicate=0.0, corrupt=0.0, rate=0.0, queue=0):
+        self.random = random.Random(seed)
+        self.loss = loss
+        self.ge = ge                    #(P, R, H) of the Gilbert-Elliott model, None for i.i.d. loss
+        self.bad = False                #Gilbert-Elliott state
+        self.delay = delay / 1000
+        self.jitter = jitter / 1000
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.corrupt = corrupt          #checked by the caller, see damage()
+        self.rate = rate * 1e6 / 8      #bytes per second, 0 = unlimited
+        self.queue = queue
+        self.busy_until = 0.0           #monotonic time the rate limited link becomes idle
+        self.idle = not (ge or delay or jitter or reorder or duplicate or rate)
+        self.packets = 0                #Counters for the stats
+        self.lost = 0                   # " "
+        self.queueDrops = 0             # " "
+        self.duplicated = 0             # " "
+        self.reordered = 0              # " "
+        self.corrupted = 0              # " "
+
+    def transmit(self, size, now=None):
+        """
+        Decide the fate of a packet entering the channel.
+
+        Args:
+            size: int (bytes on the wire)
+            now: float (monotonic time the packet enters, default now)
+
+        Returns:
+            tuple of delays in seconds, one per copy delivered (empty if the packet is lost)
+        """
+        self.packets += 1
+        rand = self.random.random
+        if self.idle:
+            #Plain i.i.d. loss, the only model of the original simulation
+            if rand() < self.loss:
+                self.lost += 1
+                return LOST
+            return NOW
+
+        loss = self.loss
+        if self.ge is not None:
+            p, r, h = self.ge
+            self.bad = (rand() >= r) if self.bad else (rand() < p)
+            if self.bad:
+                loss = h
+        if rand() < loss:
+            self.lost += 1
+            return LOST
+
+        if now is None:
+            now = time.monotonic()
+        wait = 0.0
+        if self.rate:
+            start = max(now, self.busy_until)
+            if self.queue and (start - now) * self.rate > self.queue:
+                self.queueDrops += 1
+                return LOST
+            self.busy_until = start + size / self.rate
+            wait = self.busy_until - now
+
+        copies = 2 if rand() < self.duplicate else 1
+        self.duplicated += copies - 1
+        delays = []
+        for copy in range(copies):
+            if rand() < self.reorder:
+                self.reordered += 1
+                delays.append(wait)
+            else:
+                delays.append(wait + max(0.0, self.delay + self.jitter * (2 * rand() - 1)))
+        return delays
+
+    def damage(self, *buffers):
+        """
+        Decide whether a packet delivered by the channel arrives damaged. Only called when
+        corrupt is set, so the random decisions of other settings stay the same.
+
+        Args:
+            buffers: bytes-like pieces of the packet
+
+        Returns:
+            the buffers unchanged, or a one-tuple holding a copy of the packet with a bit flipped
+        """
+        rand = self.random.random
+        if rand() >= self.corrupt:
+            return buffers
+        packet = bytearray(b''.join(buffers))
+        bit = int(rand() * len(packet) * 8)
+        packet[bit // 8] ^= 1 << (bit % 8)
+        self.corrupted += 1
+        return (bytes(packet),)
+
+    def stats(self, name):
+        """
+        Return the channel counters as log lines.
+
+        Args:
+            name: str (direction, e.g. Forward)
+
+        Returns:
+            str
+        """
+        return (f"{name} channel packets: {self.packets}\n"
+                f"{name} channel lost: {self.lost}\n"
+                f"{name} channel queue drops: {self.queueDrops}\n"
+                f"{name} channel duplicated: {self.duplicated}\n"
+                f"{name} channel reordered: {self.reordered}\n"
+                f"{name} channel corrupted: {self.corrupted}\n")
+
+
+def parse_channel(spec, loss=0.0, seed=None):
+    """
+    Create a Channel from a spec (see the module docstring).
+
+    Args:
+        spec: str
+        loss: float (loss probability unless the spec sets one, e.g. flp)
+        seed: seed of the random generator unless the spec sets one
+
+    Returns:
+        Channel
+    """
+    settings = {"loss": loss, "seed": seed}
+    for item in spec.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not name:
+            continue
+        if name not in ("seed", "loss", "ge", "delay", "jitter", "reorder", "duplicate", "corrupt", "rate", "queue"):
+            sys.exit(f"Unknown channel setting: {item}")
+        if not sep:
+            sys.exit(f"Missing channel setting value: {item}")
+        try:
+            if name == "ge":
+                values = [float(v) for v in value.split("/")]
+                if len(values) not in (2, 3):
+                    raise ValueError
+                settings[name] = (*values, 1.0)[:3]
+            elif name in ("seed", "queue"):
+                settings[name] = int(value)
+            else:
+                settings[name] = float(value)
+        except ValueError:
+            sys.exit(f"Invalid channel setting value, must be numerical: {item}")
+
+    for name in ("loss", "reorder", "duplicate", "corrupt"):
+        if not (0 <= settings.get(name, 0) <= 1):
+            sys.exit(f"Invalid channel setting, {name} must be between 0 and 1: {settings[name]}")
+    if "ge" in settings and not all(0 <= v <= 1 for v in settings["ge"]):
+        sys.exit(f"Invalid channel setting, ge probabilities must be between 0 and 1: {spec}")
+    return Channel(**settings)
+
+
+def run_proxy(proxyport, sendport, recvport, forward, reverse):
+    """
+    Relay datagrams between the sender and the receiver through the two channels, until
+    interrupted. Delayed datagrams are held in a timer queue.
+
+    Args:
+        proxyport: int (port both programs send to)
+        sendport: int (sender port)
+        recvport: int (receiver port)
+        forward: Channel (sender to receiver)
+        reverse: Channel (receiver to sender)
+
+    Returns:
+
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((localhost, proxyport))
+    sock.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    timers = TimerQueue()
+    receiver = (localhost, recvport)
+    sender = (localhost, sendport)
+
+    def deliver(packet, address):
+        try:
+            sock.sendto(packet, address)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass    #lost on the way, as a full or absent peer would lose it
+
+    try:
+        while True:
+            if selector.select(timers.timeout()):
+                while True:
+                    try:
+                        packet, address = sock.recvfrom(65536)
+                    except BlockingIOError:
+                        break
+                    except ConnectionRefusedError:
+                        continue
+                    channel, target = (reverse, sender) if address == receiver else (forward, receiver)
+                    for delay in channel.transmit(len(packet)):
+                        data = channel.damage(packet)[0] if channel.corrupt else packet
+                        if delay:
+                            timers.arm(timers.timer(deliver, data, target), delay)
+                        else:
+                            deliver(data, target)
+            timers.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        selector.close()
+        sock.close()
+        print(forward.stats("Forward") + reverse.stats("Reverse"), end="", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        sys.exit("Usage: python3 channel.py <proxy_port> <sender_port> <receiver_port> [--forward=spec] [--reverse=spec]")
+    ports = []
+    for arg in sys.argv[1:4]:
+        try:
+            ports.append(int(arg))
+        except ValueError:
+            sys.exit(f"Invalid port number, must be numerical: {arg}")
+    options = parse_options(sys.argv[4:], {"forward": "", "reverse": ""})
+    run_proxy(*ports, parse_channel(options["forward"]), parse_channel(options["reverse"]))
@@ -0,0 +1,144 @@
+"""
+Resumable transfers: the receiver's checkpoint of the delivered prefix of its output.
+
+With --resume the receiver keeps <output>.ckpt beside the output, a small JSON file
+
+    {"offset": bytes delivered, "sha256": digest of those bytes (hex)}
+
+saved at most every SAVE_INTERVAL seconds (after the data it covers has been written)
+and when the connection closes; it is removed once a transfer completes. A sender run
+with --resume asks for it on the SYN, checks the digest against the same prefix of its
+input and sends only the rest of the file.
+
+The digest is chained over BLOCK sized blocks, digest_n = sha256(digest_n-1 + block_n),
+so its whole state is the digest of the last complete block: a checkpoint stores it and
+hashing resumes from it without reading the prefix back. Checkpoints therefore always
+end on a block boundary, the data after it is sent again.
+"""
+import hashlib
+import json
+import os
+import time
+
+BLOCK = 1 << 20         #Bytes per digest block, the granularity of checkpoints
+SAVE_INTERVAL = 1.0     #Seconds between checkpoint saves during a transfer
+SUFFIX = ".ckpt"
+
+
+class PrefixDigest:
+    """Chained digest of a byte stream, up to its last complete block."""
+    __slots__ = ("offset", "digest", "hasher", "partial")
+
+    def __init__(self, offset=0, digest=b''):
+        self.offset = offset                    #Bytes covered by digest (a multiple of BLOCK)
+        self.digest = digest                    #Digest of the blocks before offset
+        self.hasher = hashlib.sha256(digest)    #Hashes the current block
+        self.partial = 0                        #Bytes of the current block hashed so far
+
+    def update(self, data):
+        """Hash the next bytes of the stream."""
+        if self.partial + len(data) < BLOCK:
+            self.hasher.update(data)
+            self.partial += len(data)
+            return
+        view = memoryview(data)
+        while len(view) >= BLOCK - self.partial:
+            take = BLOCK - self.partial
+            self.hasher.update(view[:take])
+            view = view[take:]
+            self.digest = self.hasher.digest()
+            self.offset += BLOCK
+            self.hasher = hashlib.sha256(self.digest)
+            self.partial = 0
+        self.hasher.update(view)
+        self.partial = len(view)
+
+
+def file_digest(path, length):
+    """
+    Digest of the first length bytes of a file.
+
+    Args:
+        path: str
+        length: int (a multiple of BLOCK)
+
+    Returns:
+        bytes, None if the file is shorter
+    """
+    prefix = PrefixDigest()
+    with open(path, "rb") as file:
+        while prefix.offset < length:
+            block = file.read(BLOCK)
+            if len(block) < BLOCK:
+                return None
+            prefix.update(block)
+    return prefix.digest
+
+
+class Checkpoint:
+    """Checkpoint of one output file (receiver side)."""
+
+    def __init__(self, output):
+        self.output = output
+        self.path = output + SUFFIX
+        self.start = (0, b'')               #offset and digest the transfer resumed from
+        self.prefix = PrefixDigest()        #Digest of the output written so far
+        self.saved = 0                      #offset of the checkpoint on disk
+        self.savedAt = time.monotonic()
+
+    def load(self):
+        """
+        Resume from the checkpoint on disk, if it is valid for the output.
+
+        Returns:
+            int (offset to resume at, 0 without a checkpoint)
+        """
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+            offset, digest = int(state["offset"]), bytes.fromhex(state["sha256"])
+            if offset % BLOCK or not 0 <= offset <= os.path.getsize(self.output):
+                raise ValueError
+        except (OSError, ValueError, KeyError, TypeError):
+            offset, digest = 0, b''
+        self.start = (offset, digest)
+        self.prefix = PrefixDigest(offset, digest)
+        self.saved = offset
+        return offset
+
+    def value(self):
+        """Value of the resume option in the SYN ACK: offset:digest."""
+        offset, digest = self.start
+        return f"{offset}:{digest.hex()}"
+
+    def save(self, file, force=False):
+        """
+        Save the checkpoint if the prefix grew, at most every SAVE_INTERVAL seconds unless forced.
+
+        Args:
+            file: file object of the output, flushed first so the checkpoint never covers unwritten data
+            force: bool
+
+        Returns:
+
+        """
+        if self.prefix.offset == self.saved:
+            return
+        now = time.monotonic()
+        if not force and now - self.savedAt < SAVE_INTERVAL:
+            return
+        file.flush()
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as state:
+            json.dump({"offset": self.prefix.offset, "sha256": self.prefix.digest.hex()}, state)
+        os.replace(temp, self.path)
+        self.saved = self.prefix.offset
+        self.savedAt = now
+
+    def remove(self):
+        """Delete the checkpoint (the transfer completed, or restarted from the beginning)."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.saved = 0
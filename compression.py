@@ -0,0 +1,198 @@
+"""
+Compression of the data of an STP connection, negotiated on the SYN (OPT_COMPRESS).
+
+The sender compresses the file in BLOCK sized blocks and sends the resulting byte
+stream in place of the file, cut into segments as usual: compression sits between the
+file and the packets, so the window, retransmission and ACKs only ever see the
+compressed bytes. Each block becomes one frame, a FRAME_HEADER (codec, body length)
+followed by the body. Blocks are compressed independently, so a frame is decoded as soon
+as its last byte arrives in order.
+
+A block that does not shrink is sent as a FRAME_RAW frame. After such a block the next
+ones are sent raw without trying, a number that doubles (up to MAX_SKIP) while the data
+stays incompressible, so compressed or random files cost little CPU to send.
+"""
+import lzma
+import time
+import zlib
+
+from stp import FRAME_HEADER
+
+BLOCK = 1 << 16     #File bytes per frame
+MAX_SKIP = 64       #Most blocks sent raw without trying after incompressible ones
+
+FRAME_RAW = 0
+FRAME_ZLIB = 1
+FRAME_LZMA = 2
+
+#Raw streams (no container headers or checksums, the frame carries the length)
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "dict_size": BLOCK}]
+
+CODECS = {
+    "zlib": FRAME_ZLIB,
+    "lzma": FRAME_LZMA,
+}
+
+
+def compress(kind, data, level):
+    """Compress one block with the codec of a frame kind."""
+    if kind == FRAME_ZLIB:
+        return zlib.compress(data, level, wbits=-15)
+    return lzma.compress(data, format=lzma.FORMAT_RAW, filters=[dict(LZMA_FILTERS[0], preset=level)])
+
+def decompress(kind, data):
+    """Decompress the body of a frame."""
+    if kind == FRAME_ZLIB:
+        return zlib.decompress(data, wbits=-15)
+    if kind == FRAME_LZMA:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    raise ValueError(f"unknown frame codec: {kind}")
+
+
+class Compressor:
+    """Sender side: reads the file being sent as a stream of frames."""
+
+    def __init__(self, file, codec, level):
+        """
+        Args:
+            file: file to compress (anything with read())
+            codec: str (a name in CODECS)
+            level: int (compression level, 0-9)
+        """
+        self.file = file
+        self.codec = codec
+        self.kind = CODECS[codec]   #None if the receiver declined: read() passes the file through
+        self.level = level
+        self.frame = b''            #Frame being read
+        self.position = 0           #Position of the next read in it
+        self.skip = 0               #Blocks still to send raw without trying
+        self.backoff = 0            #Blocks skipped after the latest incompressible one
+        self.rawBytes = 0           #Variables for the stats
+        self.compressedBytes = 0    # " " (frames, headers included)
+        self.bypassed = 0           # " " (blocks sent raw)
+        self.cpu = 0.0              # " " (process time spent compressing)
+
+    def next_frame(self):
+        """
+        Read and frame the next block of the file.
+
+        Returns:
+            bool (False at the end of the file)
+        """
+        data = self.file.read(BLOCK)
+        if not data:
+            return False
+        body = None
+        if self.skip:
+            self.skip -= 1
+        else:
+            started = time.process_time()
+            body = compress(self.kind, data, self.level)
+            self.cpu += time.process_time() - started
+            if len(body) >= len(data):
+                body = None
+                self.backoff = min(self.backoff * 2 or 1, MAX_SKIP)
+                self.skip = self.backoff
+            else:
+                self.backoff = 0
+
+        if body is None:
+            self.bypassed += 1
+            self.frame = FRAME_HEADER.pack(FRAME_RAW, len(data)) + data
+        else:
+            self.frame = FRAME_HEADER.pack(self.kind, len(body)) + body
+        self.position = 0
+        self.rawBytes += len(data)
+        self.compressedBytes += len(self.frame)
+        return True
+
+    def read(self, size):
+        """
+        Return the next size bytes of the framed stream (fewer at the end, empty at EOF).
+
+        Args:
+            size: int
+
+        Returns:
+            bytes
+        """
+        if self.kind is None:
+            return self.file.read(size)
+        pieces = []
+        while size:
+            if self.position == len(self.frame) and not self.next_frame():
+                break
+            piece = self.frame[self.position:self.position + size]
+            self.position += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    def stats(self):
+        """
+        Return the compression counters as log lines.
+
+        Returns:
+            str
+        """
+        ratio = self.rawBytes / self.compressedBytes if self.compressedBytes else 1.0
+        return (f"Compression: {self.codec}\n"
+                f"Compression file data read: {self.rawBytes}\n"
+                f"Compression data sent: {self.compressedBytes}\n"
+                f"Compression ratio: {ratio:.3f}\n"
+                f"Compression blocks sent raw: {self.bypassed}\n"
+                f"Compression CPU seconds: {self.cpu:.3f}\n")
+
+    def close(self):
+        self.file.close()
+
+
+class Decompressor:
+    """Receiver side: decodes the in-order framed stream back into file data."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.buffer = bytearray()   #Start of an incomplete frame
+        self.rawBytes = 0           #Variables for the stats
+        self.cpu = 0.0              # " " (process time spent decompressing)
+
+    def feed(self, data):
+        """
+        Add the next in-order bytes of the stream.
+
+        Args:
+            data: bytes-like
+
+        Returns:
+            list of the file data of the frames completed, in order
+        """
+        buffer = self.buffer
+        buffer += data
+        blocks = []
+        start = 0
+        while len(buffer) - start >= FRAME_HEADER.size:
+            kind, length = FRAME_HEADER.unpack_from(buffer, start)
+            end = start + FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[start + FRAME_HEADER.size:end])
+            if kind != FRAME_RAW:
+                started = time.process_time()
+                body = decompress(kind, body)
+                self.cpu += time.process_time() - started
+            self.rawBytes += len(body)
+            blocks.append(body)
+            start = end
+        del buffer[:start]
+        return blocks
+
+    def stats(self):
+        """
+        Return the decompression counters as log lines.
+
+        Returns:
+            str
+        """
+        return (f"Compression: {self.codec}\n"
+                f"Decompressed file data: {self.rawBytes}\n"
+                f"Decompression CPU seconds: {self.cpu:.3f}\n")
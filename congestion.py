@@ -0,0 +1,281 @@
+"""
+Congestion control for the sender.
+
+Each algorithm keeps a congestion window (cwnd, in bytes) that is capped by the sender's
+max_win and reacts to the loss events the sender detects: new ACKs, entry into fast
+recovery on the third duplicate ACK, and retransmission timeouts. The sender asks
+window() how many bytes it may have in flight.
+"""
+import time
+
+
+class FixedWindow:
+    """No congestion control: the window is always max_win."""
+    name = "none"
+
+    def __init__(self, mss, max_win):
+        self.mss = mss
+        self.max_win = max_win
+        self.cwnd = max_win
+        self.ssthresh = max_win
+
+    def window(self):
+        """Return the number of bytes the sender may have in flight."""
+        return min(self.cwnd, self.max_win)
+
+    def on_ack(self, acked, srtt):
+        """
+        New data was ACKed outside of fast recovery.
+
+        Args:
+            acked: int (bytes newly ACKed)
+            srtt: float (smoothed RTT in seconds, None if unknown)
+        """
+
+    def on_fast_retransmit(self, inflight):
+        """
+        Third duplicate ACK: a segment was lost, fast recovery starts.
+
+        Args:
+            inflight: int (bytes in flight when the loss was detected)
+        """
+
+    def on_dup_ack(self):
+        """A further duplicate ACK arrived during fast recovery."""
+
+    def on_partial_ack(self, acked):
+        """
+        An ACK during fast recovery that does not cover everything outstanding at its start.
+
+        Args:
+            acked: int (bytes newly ACKed)
+        """
+
+    def on_recovery_exit(self):
+        """Everything outstanding at the start of fast recovery has been ACKed."""
+
+    def on_timeout(self, inflight):
+        """
+        The retransmission timer expired.
+
+        Args:
+            inflight: int (bytes in flight when the timer expired)
+        """
+
+
+class Reno(FixedWindow):
+    """Slow start, congestion avoidance and NewReno fast recovery (RFC 5681 / RFC 6582)."""
+    name = "reno"
+    INITIAL_SEGMENTS = 4
+
+    def __init__(self, mss, max_win):
+        super().__init__(mss, max_win)
+        self.cwnd = min(self.INITIAL_SEGMENTS * mss, max_win)
+
+    def grow(self, acked, srtt):
+        """Congestion avoidance increase: one MSS per window of data ACKed."""
+        self.cwnd += max(1, self.mss * acked // self.cwnd)
+
+    def on_ack(self, acked, srtt):
+        if self.cwnd < self.ssthresh:
+            #Appropriate byte counting (RFC 3465, L = 2): an ACK covering two segments
+            #(delayed ACKs) grows the window as much as two ACKs would
+            self.cwnd += min(acked, 2 * self.mss)
+        else:
+            self.grow(acked, srtt)
+        self.cwnd = min(self.cwnd, self.max_win)
+
+    def reduce(self, inflight):
+        """Multiplicative decrease, returns the new ssthresh."""
+        return max(inflight // 2, 2 * self.mss)
+
+    def on_fast_retransmit(self, inflight):
+        self.ssthresh = self.reduce(inflight)
+        self.cwnd = self.ssthresh + 3 * self.mss
+
+    def on_dup_ack(self):
+        self.cwnd = min(self.cwnd + self.mss, self.max_win + 3 * self.mss)
+
+    def on_partial_ack(self, acked):
+        #Deflate by the amount ACKed, then add back one MSS for the retransmitted segment
+        self.cwnd = max(self.cwnd - acked + self.mss, self.mss)
+
+    def on_recovery_exit(self):
+        self.cwnd = min(self.ssthresh, self.max_win)
+
+    def on_timeout(self, inflight):
+        self.ssthresh = self.reduce(inflight)
+        self.cwnd = self.mss
+
+
+class Cubic(Reno):
+    """CUBIC window growth (RFC 9438) on top of the Reno loss recovery."""
+    name = "cubic"
+    C = 0.4         #Scaling constant of the cubic function
+    BETA = 0.7      #Multiplicative decrease factor
+
+    def __init__(self, mss, max_win):
+        super().__init__(mss, max_win)
+        self.w_max = 0          #Window (in segments) before the last reduction
+        self.k = 0.0            #Time (seconds) for the cubic function to get back to w_max
+        self.epoch_start = None #monotonic start of the current congestion avoidance epoch
+        self.w_est = 0.0        #Reno-friendly window estimate (segments)
+
+    def grow(self, acked, srtt):
+        now = time.monotonic()
+        segments = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = segments
+            if segments < self.w_max:
+                self.k = ((self.w_max - segments) / self.C) ** (1 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = segments
+
+        t = now - self.epoch_start + (srtt or 0)
+        target = self.C * (t - self.k) ** 3 + self.w_max
+
+        #Never grow slower than Reno would
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * (acked / self.mss) / segments
+        target = max(target, self.w_est)
+
+        if target > segments:
+            increase = (target - segments) / segments * acked
+        else:
+            increase = acked / (100 * segments)
+        self.cwnd += max(1, int(increase))
+
+    def reduce(self, inflight):
+        segments = self.cwnd / self.mss
+        if segments < self.w_max:
+            #Fast convergence: release bandwidth to newer flows
+            self.w_max = segments * (1 + self.BETA) / 2
+        else:
+            self.w_max = segments
+        self.epoch_start = None
+        return max(int(self.cwnd * self.BETA), 2 * self.mss)
+
+
+ALGORITHMS = {
+    FixedWindow.name: FixedWindow,
+    Reno.name: Reno,
+    Cubic.name: Cubic,
+}
+
+def create(name, mss, max_win):
+    """
+    Create the congestion control algorithm called name.
+
+    Args:
+        name: str (one of ALGORITHMS)
+        mss: int
+        max_win: int
+
+    Returns:
+        FixedWindow (or subclass)
+    """
+    return ALGORITHMS[name](mss, max_win)
+
+
+class Pacer:
+    """
+    Token bucket spacing the sender's new segments at a target rate instead of sending
+    the whole opening of the window back to back. The rate is PACE_GAIN * cwnd / srtt
+    (from_cwnd), capped at cap bytes/s, or just cap; 0 means not (yet) paced. Tokens are
+    accounted on the monotonic clock, so the average rate is exact even though the event
+    loop only wakes up with millisecond resolution: the bucket holds at least QUANTUM
+    seconds of tokens to cover one wakeup.
+    """
+    SLOW_START_GAIN = 2.0   #Gains over cwnd/srtt (as Linux fq pacing)
+    AVOIDANCE_GAIN = 1.2    # " "
+    QUANTUM = 0.002         #Seconds of sending the bucket can hold
+    BURST = 2               #Segments the bucket can hold at least
+
+    def __init__(self, from_cwnd, cap):
+        self.from_cwnd = from_cwnd
+        self.cap = cap
+        self.rate = 0.0             #Current target rate, bytes/s
+        self.tokens = 0.0           #Bytes that may be sent now
+        self.last = None            #monotonic time tokens were last added
+        self.first_sent = None      #monotonic time of the first and the latest paced send, for the stats
+        self.last_sent = None       # " "
+        self.bytes = 0              #Counters for the stats
+        self.ideal = 0.0            # " " (seconds the bytes take at the target rate)
+        self.waits = 0              # " "
+
+    def update(self, cc, srtt):
+        """
+        Recompute the target rate from the congestion window.
+
+        Args:
+            cc: FixedWindow (or subclass)
+            srtt: float (smoothed RTT in seconds, None if unknown)
+
+        Returns:
+
+        """
+        rate = 0.0
+        if self.from_cwnd and srtt:
+            gain = self.SLOW_START_GAIN if cc.cwnd < cc.ssthresh else self.AVOIDANCE_GAIN
+            rate = gain * cc.window() / srtt
+        if self.cap:
+            rate = min(rate, self.cap) if rate else self.cap
+        self.rate = rate
+
+    def delay(self, size):
+        """
+        Time to wait before a segment of size bytes may be sent.
+
+        Args:
+            size: int
+
+        Returns:
+            float (seconds, 0 if it may be sent now)
+        """
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        depth = max(self.BURST * size, self.rate * self.QUANTUM)
+        if self.last is None:
+            self.tokens = depth
+        else:
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, depth)
+        self.last = now
+        if self.tokens >= size:
+            return 0.0
+        self.waits += 1
+        return (size - self.tokens) / self.rate
+
+    def consume(self, size):
+        """
+        Take the tokens of a segment sent (retransmissions too, possibly going into debt).
+
+        Args:
+            size: int
+
+        Returns:
+
+        """
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens -= size
+        self.bytes += size
+        self.ideal += size / self.rate
+        self.first_sent = self.first_sent or now
+        self.last_sent = now
+
+    def stats(self):
+        """
+        Return the target and the achieved rate as log lines.
+
+        Returns:
+            str
+        """
+        target = self.bytes / self.ideal if self.ideal else 0
+        elapsed = (self.last_sent - self.first_sent) if self.bytes else 0
+        achieved = self.bytes / elapsed if elapsed else 0
+        return (f"Pacing target rate (MB/s): {round(target / 1e6, 3)}\n"
+                f"Pacing achieved rate (MB/s): {round(achieved / 1e6, 3)}\n"
+                f"Pacing waits: {self.waits}\n")
@@ -0,0 +1,254 @@
+"""
+Event log shared by sender.py and receiver.py.
+
+Logging a packet event only packs a fixed size binary record (monotonic timestamp in ns
+since the start of the log, direction, type, seq, len) into a preallocated ring buffer.
+A background thread renders the records to the usual text format
+
+    <snd|rcv|drp> <ms since start> <TYPE> <seq> <len>
+
+and writes them to the log file, so no formatting or file I/O happens on the packet path.
+A log has a thread of its own by default; a server shares one LogWriter (one thread)
+between the logs of all its connections, which then only open their file while writing
+to it, so neither threads nor file descriptors grow with the number of connections.
+The level decides which events are kept at all:
+
+    all     every event (default)
+    drops   only drp events
+    stats   no events, only the final statistics
+"""
+import heapq
+import os
+import struct
+import threading
+import time
+
+from stp import DataType
+
+SND = 0
+RCV = 1
+DRP = 2
+DIRECTIONS = ("snd", "rcv", "drp")
+
+LEVELS = {
+    "all": (True, True, True),      #Events kept, indexed by direction
+    "drops": (False, False, True),
+    "stats": (False, False, False),
+}
+
+RECORD = struct.Struct("=qBBqq") #ns since start, direction, type, seq, len
+CAPACITY = 1 << 16               #Records held by the ring buffer
+FLUSH_INTERVAL = 0.2             #Seconds between background flushes
+
+
+class LogWriter:
+    """Background thread rendering the records of one or more EventLogs to their files."""
+
+    def __init__(self, reopen=False):
+        self.reopen = reopen    #Logs open their file for each write instead of keeping it open
+        self.logs = set()
+        self.cond = threading.Condition()
+        self.wake = False       #A log asked for a flush
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, log):
+        with self.cond:
+            self.logs.add(log)
+
+    def remove(self, log):
+        with self.cond:
+            self.logs.discard(log)
+
+    def notify(self):
+        """Wake the thread for a flush (called with cond held)."""
+        self.wake = True
+        self.cond.notify_all()
+
+    def close(self):
+        """Write the remaining events of every log and stop the thread."""
+        with self.cond:
+            self.closed = True
+            self.notify()
+        self.thread.join()
+
+    def _run(self):
+        """Render the records added since the last pass, at least every FLUSH_INTERVAL."""
+        while True:
+            with self.cond:
+                if not self.closed and not self.wake:
+                    self.cond.wait(FLUSH_INTERVAL)
+                self.wake = False
+                closed = self.closed
+                logs = list(self.logs)
+            for log in logs:
+                log._flush()
+            if closed:
+                return
+
+
+class EventLog:
+    """Ring buffer of event records, rendered and written to path by a LogWriter thread."""
+
+    def __init__(self, path, level="all", capacity=CAPACITY, start=None, writer=None):
+        self.path = path
+        self.file = None        #Opened on the first write
+        self.created = False    #The file was created (truncated), later opens append
+        self.enabled = LEVELS[level]
+        self.capacity = capacity
+        self.ring = bytearray(RECORD.size * capacity)
+        self.head = 0           #Records added (only the event loop writes this)
+        self.tail = 0           #Records written to the file (only the flush thread writes this)
+        self.shared = start is not None #Clock shared with other flows (time.monotonic_ns() at start)
+        self.start = time.monotonic_ns() if start is None else start
+        self.own = writer is None       #The writer thread is this log's own
+        self.writer = LogWriter() if writer is None else writer
+        self.cond = self.writer.cond
+        self.writer.add(self)
+
+    def restart(self):
+        """Take the current time as time zero for the events that follow, unless the clock is shared."""
+        if not self.shared:
+            self.start = time.monotonic_ns()
+
+    def record(self, direction, typeNum, seqnum, length, at=None):
+        """
+        Add an event.
+
+        Args:
+            direction: int (SND, RCV or DRP)
+            typeNum: int
+            seqnum: int
+            length: int
+            at: int (ns since start, default now; ignored on a shared clock)
+
+        Returns:
+
+        """
+        if not self.enabled[direction]:
+            return
+        if self.head - self.tail == self.capacity:
+            self._wait(self.head - self.capacity + 1)
+
+        if at is None or self.shared:
+            at = time.monotonic_ns() - self.start
+        RECORD.pack_into(self.ring, (self.head % self.capacity) * RECORD.size, at, direction, typeNum, seqnum, length)
+        self.head += 1
+        if self.head - self.tail == self.capacity // 2:
+            with self.cond:
+                self.writer.notify()
+
+    def write(self, text):
+        """
+        Append text (the statistics) to the log after every event recorded so far.
+
+        Args:
+            text: str
+
+        Returns:
+
+        """
+        self._wait(self.head)
+        self._append(text)
+
+    def close(self):
+        """Write the remaining events, stop the flush thread (unless shared) and close the file."""
+        if self.own:
+            self.writer.close()
+        else:
+            self._wait(self.head)
+            self.writer.remove(self)
+        if not self.created:
+            self._append("")
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _wait(self, count):
+        """Block until at least count records have been written to the file."""
+        with self.cond:
+            while self.tail < count:
+                self.writer.notify()
+                self.cond.wait()
+
+    def _append(self, text):
+        """Write text to the file, opening it if needed (and closing it again if the writer says so)."""
+        if self.file is None:
+            self.file = open(self.path, "a" if self.created else "w")
+            self.created = True
+        self.file.write(text)
+        if self.writer.reopen:
+            self.file.close()
+            self.file = None
+
+    def _flush(self):
+        head = self.head
+        if head == self.tail:
+            return
+        lines = []
+        for index in range(self.tail, head):
+            at, direction, typeNum, seqnum, length = RECORD.unpack_from(self.ring, (index % self.capacity) * RECORD.size)
+            #The handshake is logged at time zero
+            elapsed = "0.00" if at == 0 else round(at / 1e6, 2)
+            lines.append(f"{DIRECTIONS[direction]} {elapsed} {DataType[typeNum]} {seqnum} {length}\n")
+        self._append("".join(lines))
+        with self.cond:
+            self.tail = head
+            self.cond.notify_all()
+
+
+def merge_logs(paths, path, report=""):
+    """
+    Combine the logs of the flows of a parallel transfer (written on a shared clock) into
+    one log: every event in time order, then each numeric statistic summed over the flows,
+    then report. The per-flow logs are removed.
+
+    Args:
+        paths: list of per-flow log paths
+        path: str (combined log)
+        report: str (lines appended at the end)
+
+    Returns:
+
+    """
+    events = []
+    stats = {}
+    for flow in paths:
+        lines = []
+        with open(flow) as file:
+            for line in file:
+                if line[:3] in DIRECTIONS:
+                    lines.append(line)
+                    continue
+                name, sep, value = line.partition(":")
+                try:
+                    stats[name] = stats.get(name, 0) + int(value)
+                except ValueError:
+                    pass    #blank lines and statistics that cannot be summed (ratios)
+        events.append(lines)
+        os.remove(flow)
+
+    with open(path, "w") as file:
+        file.writelines(heapq.merge(*events, key=lambda line: float(line.split()[1])))
+        file.write("\n")
+        file.writelines(f"{name}: {value}\n" for name, value in stats.items())
+        file.write(report)
+
+def parallel_report(results):
+    """
+    Throughput of a parallel transfer.
+
+    Args:
+        results: list of (bytes, first ns, last ns) per flow, times from time.monotonic_ns()
+
+    Returns:
+        str (log lines)
+    """
+    total = sum(result[0] for result in results)
+    times = [result for result in results if result[1] is not None and result[2] is not None]
+    elapsed = (max(r[2] for r in times) - min(r[1] for r in times)) / 1e9 if times else 0
+    throughput = total / elapsed / 1e6 if elapsed else 0
+    return (f"Parallel flows: {len(results)}\n"
+            f"Transfer time (s): {round(elapsed, 3)}\n"
+            f"Throughput (MB/s): {round(throughput, 2)}\n")
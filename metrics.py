@@ -0,0 +1,165 @@
+"""
+Live metrics shared by sender.py and receiver.py.
+
+While a transfer runs, the program's counters (read from its existing totals, so the
+packet path pays nothing for them) and a few histograms fed from the hot paths are
+published every interval as one JSON snapshot:
+
+    {"program": ..., "uptime_s": ..., "counters": {...}, "rates": {... per second since
+     the previous snapshot}, "gauges": {...}, "histograms": {name: {"count", "min", "max",
+     "mean", "p50", "p90", "p99", "buckets": {upper bound: count}}}}
+
+The target is either a file, replaced atomically on every snapshot, or unix:<path>, a
+UNIX socket that sends the latest snapshot to every client that connects and closes.
+Publishing is driven by the program's timer queue, so it needs no thread.
+"""
+import json
+import math
+import os
+import socket
+import time
+
+UNIX_PREFIX = "unix:"
+
+
+class Histogram:
+    """Streaming histogram with power of two buckets."""
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets = {}       #exponent e -> values in (2**(e-1), 2**e]
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """Record one value (>= 0)."""
+        mantissa, exponent = math.frexp(value)
+        if mantissa == 0.5:
+            exponent -= 1       #exact powers of two belong to the bucket they bound
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of the values."""
+        rank = fraction * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return min(2.0 ** exponent, self.max)
+        return self.max
+
+    def snapshot(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "min": self.min, "max": self.max, "mean": self.total / self.count,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99),
+                "buckets": {str(2.0 ** exponent): self.buckets[exponent] for exponent in sorted(self.buckets)}}
+
+
+class Metrics:
+    """Histograms and periodic snapshots of one program."""
+
+    def __init__(self, program, target, interval, timers, values):
+        """
+        Args:
+            program: str (name in the snapshot)
+            target: str (snapshot file, or unix:<socket path>)
+            interval: float (seconds between snapshots)
+            timers: TimerQueue (drives the snapshots)
+            values: function returning (counters dict, gauges dict) at snapshot time
+        """
+        self.program = program
+        self.target = target
+        self.interval = interval
+        self.timers = timers
+        self.values = values
+        self.histograms = {}
+        self.started = time.monotonic()
+        self.previous = ({}, self.started)  #counters and time of the previous snapshot, for the rates
+        self.server = None
+        if target.startswith(UNIX_PREFIX):
+            path = target[len(UNIX_PREFIX):]
+            if os.path.exists(path):
+                os.remove(path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(path)
+            self.server.listen()
+            self.server.setblocking(False)
+        self.timer = timers.timer(self.publish)
+        timers.arm(self.timer, interval)
+
+    def observe(self, name, value):
+        """
+        Add a value to the histogram called name.
+
+        Args:
+            name: str
+            value: float
+
+        Returns:
+
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def snapshot(self):
+        """
+        Return the current snapshot.
+
+        Returns:
+            dict
+        """
+        now = time.monotonic()
+        counters, gauges = self.values()
+        previous, then = self.previous
+        elapsed = now - then
+        rates = {name: (value - previous.get(name, 0)) / elapsed if elapsed else 0.0 for name, value in counters.items()}
+        self.previous = (counters, now)
+        return {"program": self.program, "pid": os.getpid(), "uptime_s": now - self.started, "counters": counters,
+                "rates": rates, "gauges": gauges,
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()}}
+
+    def publish(self):
+        """Timer callback: write or serve a snapshot and re-arm for the next one."""
+        self._publish()
+        self.timers.arm(self.timer, self.interval)
+
+    def _publish(self):
+        data = json.dumps(self.snapshot(), indent=1).encode()
+        if self.server is None:
+            temp = f"{self.target}.tmp"
+            with open(temp, "wb") as file:
+                file.write(data)
+            os.replace(temp, self.target)
+            return
+
+        while True:
+            try:
+                client, address = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                client.setblocking(True)
+                client.settimeout(1)
+                client.sendall(data)
+            except OSError:
+                pass    #the client went away
+            client.close()
+
+    def close(self):
+        """Publish the final snapshot and stop."""
+        self.timers.cancel(self.timer)
+        self._publish()
+        if self.server is not None:
+            self.server.close()
+            os.remove(self.target[len(UNIX_PREFIX):])
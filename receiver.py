@@ -1,30 +1,202 @@
 import socket
 import sys
-import struct
+import os
 import time
-import threading
-from dataclasses import dataclass
-from collections import Counter
+import selectors
+import multiprocessing
+import cProfile
+import hashlib
+import bisect
+from dataclasses import dataclass, field
+
+from stp import (localhost, MSS, MAX_SEQ, MAX_MSS, MAX_MSS16, DataType, DATA, ACK, SYN, FIN, RST, OPT_SACK, OPT_SEQ32, OPT_MSS, OPT_STREAMS, OPT_OFFSET, OPT_RWND, OPT_RESUME, OPT_COMPRESS, OPT_CHECKSUM, OPT_CLOSE, MAX_SACK_BLOCKS,
+                 DIGEST_SIZE, FLAG_SEQ32, FLAG_CHECKSUM, HEADER, LEGACY, PacketFormat, create_packet, decode_header, decode_packet, decode_fin, encode_options, decode_options,
+                 parse_options)
+from timers import Timer, TimerQueue
+from batchio import BatchSocket
+from eventlog import EventLog, LogWriter, LEVELS, SND, RCV, DRP, merge_logs, parallel_report
+from streams import StreamSink
+from metrics import Metrics
+from checkpoint import Checkpoint, PrefixDigest
+from compression import CODECS, Decompressor
+
+OPTIONS = {
+    "timer_stats": False,   #--timer-stats: append timer churn counters to the log
+    "batch": False,         #--batch: batch socket syscalls (GSO/GRO where available), log packets per syscall
+    "writev": False,        #--writev: write in-order data with one unbuffered os.writev per wakeup
+    "log_level": "all",     #--log-level=all|drops|stats: packet events kept in the log
+    "parallel": 1,          #--parallel=N: receive a file sent with --parallel=N, N flows in N processes
+    "server": False,        #--server: serve any number of senders on recvport, one output and log per connection
+    "idle": 10,             #--idle=seconds: server mode, close connections idle for this long
+    "metrics": "",          #--metrics=path|unix:path: publish live metrics snapshots to a file or a UNIX socket
+    "metrics_interval": 1.0,#--metrics-interval=seconds: time between snapshots
+    "profile": "",          #--profile=path: cProfile the packet handling, stats dumped to path
+    "delayed_ack": 1,       #--delayed-ack=N: ACK every Nth in-order segment (out-of-order data is ACKed at once)
+    "ack_delay": 40,        #--ack-delay=ms: longest an in-order segment waits for its delayed ACK
+    "linger": 0,            #--linger=ms: wait after ACKing the FIN in case the ACK is lost (0 = derived from the sender's RTO)
+    "resume": False,        #--resume: checkpoint the output in <txtfilename>.ckpt, a sender with --resume continues after it
+}
+
+SERVER_LOG_CAPACITY = 4096 #Event records buffered per connection in server mode
+SERVER_RCVBUF = 1 << 22    #Socket receive buffer requested in server mode, shared by all senders
+
+LINGER = 2         #Seconds to linger after ACKing the FIN of a sender that did not tell its RTO (MSL * 2)
+LINGER_RTOS = 3    #Otherwise linger for this many of its RTOs
+DIGEST_RESULTS = {True: "verified", False: "MISMATCH", None: "no FIN received"}
+
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024 #Max buffers per writev
 
-localhost = "127.0.0.1"
-wait_time = 10
-BUF_SIZE = 1004
-
-MAX_SEQ = ((2**16))
-
-DATA = 0
-ACK = 1
-SYN = 2
-FIN = 3
 
 @dataclass
 class Control:
     alive: bool = True
-    timerOn: bool = False
-    timer: threading.Timer = None
+    timer: Timer = None
+    timers: TimerQueue = field(default_factory=TimerQueue)
     sock: socket.socket= None
+    io: BatchSocket = None
+
+@dataclass
+class Reassembly:
+    """
+    Out-of-order segments waiting for a gap to fill, keyed by sequence number.
+    Only segments that start within max_win bytes ahead of the expected sequence number
+    (modulo the sequence space) are kept, so memory is bounded by the window. The
+    contiguous ranges they form are kept up to date as segments come and go, for SACK.
+    """
+    max_win: int
+    max_seq: int = MAX_SEQ                          #Size of the sequence space
+    segments: dict = field(default_factory=dict)    #seqnum -> payload
+    buffered: int = 0                               #payload bytes currently held
+    ranges: list = field(default_factory=list)      #[start, end) of the contiguous buffered data, in sequence order
+
+    def insert(self, ExpectedSeqNum, seqnum, data):
+        """
+        Buffer an out-of-order segment.
+
+        Args:
+            ExpectedSeqNum: int
+            seqnum: int
+            data: bytes-like payload
+
+        Returns:
+            bool (False if it was a duplicate, outside the window or did not fit)
+        """
+        offset = (seqnum - ExpectedSeqNum) % self.max_seq
+        if offset == 0 or offset + len(data) > self.max_win or seqnum in self.segments:
+            return False
+        if self.buffered + len(data) > self.max_win:
+            return False
+
+        self.segments[seqnum] = data
+        self.buffered += len(data)
+        if data:
+            self.add_range(ExpectedSeqNum, seqnum, (seqnum + len(data)) % self.max_seq)
+        return True
+
+    def add_range(self, ExpectedSeqNum, start, end):
+        """Record [start, end) as buffered, merging it with the ranges it touches."""
+        ranges = self.ranges
+        max_seq = self.max_seq
+        offset = (start - ExpectedSeqNum) % max_seq
+        #Buffered data is always ahead of ExpectedSeqNum, so sequence order is offset order
+        index = bisect.bisect_left(ranges, offset, key=lambda r: (r[0] - ExpectedSeqNum) % max_seq)
+        joinsNext = index < len(ranges) and ranges[index][0] == end
+        if index and ranges[index - 1][1] == start:
+            if joinsNext:
+                ranges[index - 1][1] = ranges.pop(index)[1]
+            else:
+                ranges[index - 1][1] = end
+        elif joinsNext:
+            ranges[index][0] = start
+        else:
+            ranges.insert(index, [start, end])
+
+    def drain(self, ExpectedSeqNum):
+        """
+        Remove every buffered segment that is now contiguous with ExpectedSeqNum.
+
+        Args:
+            ExpectedSeqNum: int
+
+        Returns:
+            ExpectedSeqNum: int (after the delivered data)
+            delivered: list of payloads, in order
+        """
+        delivered = []
+        while ExpectedSeqNum in self.segments:
+            data = self.segments.pop(ExpectedSeqNum)
+            self.buffered -= len(data)
+            delivered.append(data)
+            ExpectedSeqNum = (ExpectedSeqNum + len(data)) % self.max_seq
+        if delivered and self.ranges and self.ranges[0][1] == ExpectedSeqNum:
+            del self.ranges[0]  #the first range, now delivered
+        return ExpectedSeqNum, delivered
+
+    def blocks(self, limit):
+        """
+        Contiguous ranges of buffered data, in sequence order, for SACK.
+
+        Args:
+            limit: int (max number of ranges returned)
+
+        Returns:
+            list of (start, end) sequence numbers, end exclusive
+        """
+        return [(start, end) for start, end in self.ranges[:limit]]
 
 
+@dataclass
+class OutputFile:
+    """
+    Destination of the in-order data. With vectored set, payloads are collected without
+    copying (as views into the receive buffers) and written to the unbuffered file with a
+    single os.writev when flush() is called at the end of each event-loop wakeup, before
+    the receive buffers are reused. Otherwise every write goes through the file object.
+    """
+    file: object
+    vectored: bool = False
+    pending: list = field(default_factory=list)    #payloads not yet written
+    pendingBytes: int = 0                          #their total size
+    prefix: PrefixDigest = None                    #Digest of the output, for its checkpoint (--resume)
+    decoder: Decompressor = None                   #Decompresses the data first (negotiated on the SYN)
+
+    def write(self, data):
+        """Append received data to the output, decompressing it first if negotiated."""
+        if self.decoder:
+            for block in self.decoder.feed(data):
+                self.append(block)
+        else:
+            self.append(data)
+
+    def append(self, data):
+        """Append file data to the output."""
+        if self.prefix:
+            self.prefix.update(data)
+        if self.vectored:
+            self.pending.append(data)
+            self.pendingBytes += len(data)
+        else:
+            self.file.write(data)
+
+    def flush(self):
+        """Write the collected payloads, resuming after short writes."""
+        pending = self.pending
+        self.pending = []
+        self.pendingBytes = 0
+        start = 0
+        while start < len(pending):
+            chunk = pending[start:start + IOV_MAX]
+            written = os.writev(self.file.fileno(), chunk)
+            for data in chunk:
+                if written < len(data):
+                    pending[start] = memoryview(data)[written:]
+                    break
+                written -= len(data)
+                start += 1
+
+    def close(self):
+        self.flush()
+        self.file.close()
 
 
 def parse_port(port_str, min_port=49152, max_port=65535):
@@ -83,56 +255,76 @@ def setup_socket(sendport, recvport):
 
     #Binding so Sender can send packets
     sock.bind((localhost, recvport))
-    sock.settimeout(wait_time) #Initial timeout = 10s
+    sock.setblocking(False) #waits happen in the selector
 
     #Connecting to Sender to send ACK packets to.
     sock.connect((localhost, sendport))
 
     return sock
 
-def create_packet(typeNum, seqnum, data):
+def accept_options(offered, max_win):
     """
-    create packet in necessary format to send through socket.
+    Choose which of the options offered in a SYN this receiver accepts.
 
     Args:
-        typeNum: int
-        seqnum: int
-        data: str
+        offered: dict mapping option name to value
+        max_win: int (receive window, advertised with OPT_RWND)
 
     Returns:
-        packet (Bytes)
+        dict of accepted options, echoed back in the ACK for the SYN
     """
-    # Ensure typeNum and seqnum are within the valid range
-    typeNum = min(max(typeNum, 0), 4)
-    seqnum = seqnum % MAX_SEQ
-
-    # Pack the data into bytes
-    packet_data = struct.pack("!HH", typeNum, seqnum) + data.encode('utf-8')
-
-    return packet_data
-
-def decode_packet(packet_data):
+    accepted = {}
+    if OPT_SACK in offered:
+        accepted[OPT_SACK] = ''
+    if OPT_SEQ32 in offered:
+        accepted[OPT_SEQ32] = ''
+    else:
+        #16-bit sequence numbers would repeat within a larger window
+        max_win = min(max_win, MAX_SEQ // 2)
+    if OPT_MSS in offered:
+        try:
+            accepted[OPT_MSS] = str(min(max(int(offered[OPT_MSS]), 1), MAX_MSS if OPT_SEQ32 in accepted else MAX_MSS16))
+        except ValueError:
+            pass
+    if OPT_STREAMS in offered:
+        accepted[OPT_STREAMS] = ''
+    if OPT_OFFSET in offered:
+        try:
+            accepted[OPT_OFFSET] = str(max(int(offered[OPT_OFFSET]), 0))
+        except ValueError:
+            pass
+    if OPT_RWND in offered:
+        accepted[OPT_RWND] = str(max_win)
+    if offered.get(OPT_COMPRESS) in CODECS and OPT_STREAMS not in offered:
+        accepted[OPT_COMPRESS] = offered[OPT_COMPRESS]
+    if OPT_CHECKSUM in offered:
+        accepted[OPT_CHECKSUM] = ''
+    if OPT_CLOSE in offered:
+        accepted[OPT_CLOSE] = ''
+    return accepted
+
+def setup_acks(connection, options, transmit):
     """
-    decode the given packet from bytes to necessary information
+    Set up how a connection sends ACKs outside of handle(): delayed ACKs and window updates,
+    and how long it lingers after ACKing the FIN.
 
     Args:
-        packet_data: packet in Bytes
+        connection: class(Connection)
+        options: dict (parsed options)
+        transmit: function(packet) sending a packet to the connection's peer
 
     Returns:
-        typeNum: int
-        acknum: int
-        data: str
-    """
-    # Unpack the first two bytes as unsigned short integers (2 bytes each)
-    typeNum, seqnum = struct.unpack("!HH", packet_data[:4])
 
-    # Extract the data from the remaining bytes
-    data = packet_data[4:].decode('utf-8')
-    return typeNum, seqnum, data
+    """
+    connection.ackEvery = options["delayed_ack"]
+    connection.ackDelay = options["ack_delay"] / 1000
+    connection.ackTimer = connection.timers.timer(connection.send_delayed_ack)
+    connection.transmit = transmit
+    connection.linger = options["linger"] / 1000 or None
 
 def timer_thread(control):
     """
-    Function for the timer thread. This function will be called when the timer expires.
+    Callback of the FIN wait timer. This function will be called when the timer expires.
     This function will set the alive flag to False, to terminate the program.
 
     Args:
@@ -144,109 +336,650 @@ def timer_thread(control):
     control.alive = False
 
 
-if __name__ == "__main__":
+@dataclass(slots=True)
+class Connection:
+    """
+    Receive state of one association: the options negotiated on its SYN, the reassembly
+    buffer, the output and the log.
+    """
+    txtfilename: str                    #Output file (directory if the sender sends streams)
+    log: EventLog
+    buffer: Reassembly                  #out-of-order segments
+    timers: TimerQueue
+    finTimer: Timer = None              #FIN wait timer
+    idleTimer: Timer = None             #Idle eviction timer (server mode)
+    writev: bool = False                #Write the output with os.writev
+    peer: tuple = None                  #Address of the sender
+    ISN: int = None                     #Sequence number of the SYN
+    synAck: bytes = None                #ACK sent for the SYN, sent again for a duplicate
+    linger: float = None                #Seconds to linger after ACKing the FIN (None = derived from senderRto)
+    senderRto: float = None             #RTO the sender told on the SYN (seconds), it confirms the ACK for its FIN
+    lingerFrom: float = None            #monotonic time the linger was last (re)started
+    finSeq: int = None                  #Sequence number of a FIN that arrived ahead of missing data
+    finPayload: bytes = None            #and its payload
+    window: bool = False                #ACKs advertise the window (negotiated on the SYN)
+    checkpoint: Checkpoint = None       #Checkpoint of the output (--resume)
+    resumed: int = None                 #Output offset the transfer resumed at (None = not resumed)
+    digest: object = None               #SHA-256 of the in-order data, checked against the FIN (checksums negotiated)
+    digestOk: bool = None               #Digest carried by the FIN matched (None = no FIN yet)
+    lastWindow: int = None              #Window advertised in the latest ACK
+    ackEvery: int = 1                   #In-order segments per ACK (delayed ACKs when > 1)
+    ackDelay: float = 0.04              #Delayed ACK timeout (seconds)
+    ackTimer: Timer = None              #Delayed ACK timer
+    transmit: object = None             #function(packet) sending a delayed ACK to the peer
+    unacked: int = 0                    #In-order segments received since the last ACK
+    sack: bool = False                  #SACK negotiated on the SYN
+    fmt: PacketFormat = LEGACY          #Packet format negotiated on the SYN
+    ExpectedSeqNum: int = 0
+    writefile: OutputFile = None        #Output, opened on the SYN
+    sink: StreamSink = None             # " " for streams
+    OriginalDataReceived: int = 0       #Variables for the log
+    OriginalSegmentsReceived: int = 0   # " "
+    DupDataReceived: int = 0            # " " (segments received before)
+    DupAcksSent: int = 0                # " "
+    AcksCoalesced: int = 0              # " " (in-order segments ACKed by a later ACK)
+    CorruptDropped: int = 0             # " " (packets failing their checksum)
+    synTime: int = None                 #monotonic ns of the SYN and the FIN
+    finTime: int = None
+
+    def handle(self, typeNum, seqnum, data, fin=False):
+        """
+        Process one packet received from the sender.
+
+        Args:
+            typeNum: int
+            seqnum: int
+            data: memoryview of the payload (only valid until the next receive)
+            fin: bool (the DATA segment carries the FIN)
+
+        Returns:
+            ACK packet to send back (Bytes), None if the packet is ignored
+        """
+        log = self.log
+        buffer = self.buffer
+        fmt = self.fmt
+        if typeNum != SYN and self.writefile is None and self.sink is None:
+            return None    #stray packet before the handshake
+
+        if typeNum == SYN and self.ISN == seqnum:
+            #Resent by the sender, or a copy the channel delayed: the handshake is done, ACK it
+            #again with the options accepted then and leave the transfer (and the log clock) alone
+            self.DupDataReceived += 1
+            log.record(RCV, SYN, seqnum, 0)
+            log.record(SND, ACK, seqnum + 1, 0)
+            return self.synAck
+
+        if typeNum == SYN:
+            #Time zero of the log is the first SYN
+            log.restart()
+            log.record(RCV, SYN, seqnum, 0, at=0)
+            self.ISN = seqnum
+            self.synTime = self.synTime or time.monotonic_ns()
+
+            #Accept the options offered in the SYN that this receiver supports
+            offered = decode_options(data)
+            accepted = accept_options(offered, buffer.max_win)
+            if self.checkpoint and OPT_RESUME in offered and OPT_STREAMS not in accepted and OPT_OFFSET not in accepted:
+                if self.writefile is None:
+                    self.resumed = self.checkpoint.load()
+                accepted[OPT_RESUME] = self.checkpoint.value()
+            self.sack = OPT_SACK in accepted
+            if OPT_CLOSE in accepted:
+                try:
+                    self.senderRto = max(int(offered[OPT_CLOSE]), 1) / 1000
+                except ValueError:
+                    pass
+            self.window = OPT_RWND in accepted
+            self.fmt = fmt = PacketFormat(OPT_SEQ32 in accepted, int(accepted.get(OPT_MSS, MSS)), OPT_CHECKSUM in accepted)
+            if fmt.checksum and self.digest is None:
+                self.digest = hashlib.sha256()
+            buffer.max_seq = fmt.max_seq
+            buffer.max_win = min(buffer.max_win, fmt.max_win)
+            buffering = 0 if self.writev else -1
+            if OPT_STREAMS in accepted:
+                self.sink = self.sink or StreamSink(self.txtfilename)
+            elif self.writefile is None and OPT_OFFSET in accepted:
+                #One flow of a parallel transfer: write at its offset, leaving the rest of the file alone
+                self.writefile = OutputFile(os.fdopen(os.open(self.txtfilename, os.O_WRONLY | os.O_CREAT, 0o644), "wb", buffering=buffering), self.writev)
+                self.writefile.file.seek(int(accepted[OPT_OFFSET]))
+            elif self.writefile is None and OPT_RESUME in accepted:
+                #Keep the checkpointed prefix, the sender sends the rest
+                self.writefile = OutputFile(os.fdopen(os.open(self.txtfilename, os.O_WRONLY | os.O_CREAT, 0o644), "wb", buffering=buffering), self.writev)
+                self.writefile.file.truncate(self.resumed)
+                self.writefile.file.seek(self.resumed)
+                self.writefile.prefix = self.checkpoint.prefix
+            elif self.writefile is None:
+                self.writefile = OutputFile(open(self.txtfilename, "wb", buffering=buffering), self.writev)
+                if self.checkpoint:
+                    #A new transfer from the beginning, the old checkpoint no longer matches the output
+                    self.checkpoint.remove()
+                    self.writefile.prefix = self.checkpoint.prefix
+            if self.writefile and OPT_COMPRESS in accepted and self.writefile.decoder is None:
+                self.writefile.decoder = Decompressor(accepted[OPT_COMPRESS])
+            packet = self.synAck = create_packet(ACK, seqnum + 1, encode_options(accepted) if accepted else b'')
+
+            #Next Packet we receive should have the ExpectedSeqNum of:
+            self.ExpectedSeqNum = (seqnum + 1) % fmt.max_seq
+            log.record(SND, ACK, seqnum + 1, 0)
+
+        elif typeNum == DATA:
+            if fin:
+                #The last segment (fast close): take the FIN after its data, once every byte before it is in
+                payload = b' '
+                if fmt.checksum:
+                    data, payload = data[:-DIGEST_SIZE], data[-DIGEST_SIZE:]
+                if self.finTime is None:
+                    self.finSeq = (seqnum + len(data)) % fmt.max_seq
+                    self.finPayload = bytes(payload)
+            log.record(RCV, DATA, seqnum, len(data))
+            if fin:
+                log.record(RCV, FIN, (seqnum + len(data)) % fmt.max_seq, 0)
+            ExpectedSeqNum = self.ExpectedSeqNum
+
+            if seqnum != ExpectedSeqNum:
+                if self.finTime is not None:
+                    self.restart_linger()   #resent after the FIN: the sender has not seen its ACK
+                #Already delivered (behind the expected seq num) or already buffered
+                if seqnum in buffer.segments or (seqnum - ExpectedSeqNum) % fmt.max_seq >= buffer.max_win:
+                    self.DupDataReceived += 1
+                #data is a view into a reused receive buffer, keep a copy
+                if buffer.insert(ExpectedSeqNum, seqnum, bytes(data)) and self.sink:
+                    self.sink.deliver(data) #streams are written on arrival, whatever the order
+
+                packet = self.ack(ExpectedSeqNum, fmt.pack_sack(buffer.blocks(MAX_SACK_BLOCKS)) if self.sack else b'') #send duplicate ACK
+                self.DupAcksSent += 1
+                log.record(SND, ACK, ExpectedSeqNum, 0)
+            else:
+                #got the expected seq num, put into file, check buffer and add to file, send next ack
+                self.OriginalDataReceived += len(data)
+                self.OriginalSegmentsReceived += 1
+                ExpectedSeqNum = (seqnum + len(data)) % fmt.max_seq
+                if self.digest:
+                    self.digest.update(data)
+                if self.sink:
+                    self.sink.deliver(data)
+                else:
+                    self.writefile.write(data)
+
+                #write every buffered segment the new data made contiguous to file.
+                ExpectedSeqNum, delivered = buffer.drain(ExpectedSeqNum)
+                for Buffdata in delivered:
+                    self.OriginalDataReceived += len(Buffdata)
+                    self.OriginalSegmentsReceived += 1
+                    if self.digest:
+                        self.digest.update(Buffdata)
+                    if not self.sink:
+                        self.writefile.write(Buffdata)
+
+                self.ExpectedSeqNum = ExpectedSeqNum
+                if ExpectedSeqNum == self.finSeq:
+                    #The data before a FIN that arrived early is complete, take the FIN now
+                    packet = self.fin(self.finSeq, self.finPayload)
+                else:
+                    if self.ackEvery > 1 and not delivered and not buffer.segments:
+                        #Delayed ACK: nothing out of order is pending, wait for more in-order data
+                        self.unacked += 1
+                        if self.unacked < self.ackEvery:
+                            if not self.ackTimer.armed():
+                                self.timers.arm(self.ackTimer, self.ackDelay)
+                            return None
+                        self.AcksCoalesced += self.unacked - 1
+                        self.unacked = 0
+                        self.timers.cancel(self.ackTimer)
+                    packet = self.ack(ExpectedSeqNum, fmt.pack_sack(buffer.blocks(MAX_SACK_BLOCKS)) if self.sack else b'')
+                    log.record(SND, ACK, ExpectedSeqNum, 0)
+        elif typeNum == FIN:
+            log.record(RCV, FIN, seqnum, 0)
+            if self.finTime is not None or seqnum == self.finSeq:
+                self.DupDataReceived += 1
+            if self.finTime is None and seqnum != self.ExpectedSeqNum:
+                #Sent right after the last segment (fast close, no room for the digest in it), ahead of data still missing:
+                #ACK what is in order and take the FIN once the gap is filled
+                self.finSeq = seqnum
+                self.finPayload = bytes(data)
+                packet = self.ack(self.ExpectedSeqNum, fmt.pack_sack(buffer.blocks(MAX_SACK_BLOCKS)) if self.sack else b'')
+                self.DupAcksSent += 1
+                log.record(SND, ACK, self.ExpectedSeqNum, 0)
+            else:
+                packet = self.fin(seqnum, data)
+        elif typeNum == ACK and self.finTime is not None and seqnum == self.ExpectedSeqNum:
+            #The sender confirms it got the ACK for its FIN, nothing is left to wait for
+            log.record(RCV, ACK, seqnum, 0)
+            self.timers.arm(self.finTimer, 0)
+            return None
+        else:
+            return None
+
+        #Any ACK sent covers the in-order segments still waiting for a delayed ACK
+        if self.unacked:
+            self.AcksCoalesced += self.unacked
+            self.unacked = 0
+            self.timers.cancel(self.ackTimer)
+        return packet
+
+    def fin(self, seqnum, payload):
+        """
+        Take the FIN, now in order: every byte before it has been delivered. Check the digest
+        it carries, ACK it and (re)start lingering.
+
+        Args:
+            seqnum: int
+            payload: bytes-like (the digest of the data, when checksums are negotiated)
+
+        Returns:
+            ACK packet (Bytes)
+        """
+        self.finTime = self.finTime or time.monotonic_ns()
+        if self.digest and self.digestOk is None:
+            self.digestOk = bytes(payload) == self.digest.digest()
+
+        self.restart_linger()
+        packet = self.ack(seqnum + 1)
+        self.ExpectedSeqNum = (seqnum + 1) % self.fmt.max_seq
+        self.log.record(SND, ACK, seqnum + 1, 0)
+        return packet
+
+    def restart_linger(self):
+        """
+        (Re)start the wait after ACKing the FIN. Until the sender stops retransmitting, the
+        ACK may have been lost and is sent again for every retransmission; a sender that
+        negotiated fast close confirms the ACK instead, which ends the wait at once.
+        """
+        now = time.monotonic()
+        linger = self.linger or (LINGER_RTOS * self.senderRto if self.senderRto else LINGER)
+        if self.lingerFrom is not None:
+            linger = max(linger, 2 * (now - self.lingerFrom))  #the sender backs off between retransmissions
+        self.lingerFrom = now
+        self.timers.arm(self.finTimer, linger)
+
+    def corrupted(self, packet):
+        """
+        Check the checksum of a received packet (when negotiated), counting and logging a mismatch.
+
+        Args:
+            packet: packet in Bytes
+
+        Returns:
+            bool (True if the packet must be dropped)
+        """
+        if self.fmt.valid(packet):
+            return False
+        self.CorruptDropped += 1
+        typeNum, seqnum, length = decode_header(packet)
+        self.log.record(DRP, typeNum if typeNum in DataType else DATA, seqnum, max(length, 0))
+        return True
+
+    def send_delayed_ack(self):
+        """Delayed ACK timer callback: ACK the in-order segments received since the last ACK."""
+        if self.unacked:
+            self.AcksCoalesced += self.unacked - 1
+            self.unacked = 0
+            self.log.record(SND, ACK, self.ExpectedSeqNum, 0)
+            self.transmit(self.ack(self.ExpectedSeqNum))
+
+    def advertised(self):
+        """
+        Receive window: max_win less the data held in memory, the out-of-order segments
+        waiting for a gap to fill and the in-order data not yet written to the output.
+        The start of an incomplete compressed frame is not counted: only more data
+        completes it, so a frame larger than the window would close it for good.
+        """
+        backlog = self.buffer.buffered + (self.writefile.pendingBytes if self.writefile else 0)
+        return max(self.buffer.max_win - backlog, 0)
+
+    def ack(self, acknum, payload=b''):
+        """
+        Create an ACK, advertising the window if negotiated.
+
+        Args:
+            acknum: int
+            payload: bytes (SACK blocks)
+
+        Returns:
+            ACK packet (Bytes)
+        """
+        if not self.window:
+            return self.fmt.create_packet(ACK, acknum, payload)
+        self.lastWindow = self.advertised()
+        return self.fmt.create_packet(ACK, acknum, payload, self.lastWindow)
+
+    def counters(self):
+        """Counters of this connection for a live metrics snapshot."""
+        return {"data_bytes_received": self.OriginalDataReceived, "segments_received": self.OriginalSegmentsReceived,
+                "dup_segments_received": self.DupDataReceived, "dup_acks_sent": self.DupAcksSent,
+                "corrupt_packets_dropped": self.CorruptDropped}
+
+    def flush(self):
+        """
+        Write the output collected during this wakeup (--writev). If that reopens a window
+        last advertised as too small for a segment, tell the sender straight away.
+        """
+        if self.writefile:
+            self.writefile.flush()
+            if self.checkpoint:
+                self.checkpoint.save(self.writefile.file)
+        if self.window and self.lastWindow is not None and self.lastWindow < self.fmt.mss <= self.advertised():
+            self.log.record(SND, ACK, self.ExpectedSeqNum, 0)
+            self.transmit(self.ack(self.ExpectedSeqNum))
+
+    def close(self, extra=""):
+        """
+        Write the final statistics (followed by extra) to the log and close the output and the log.
+
+        Args:
+            extra: str (more statistics lines)
+
+        Returns:
+
+        """
+        log = self.log
+        log.write(f"\nOriginal data received: {self.OriginalDataReceived}\n")
+        log.write(f"Original segments received: {self.OriginalSegmentsReceived}\n")
+        log.write(f"Dup data segments received: {self.DupDataReceived}\n")
+        log.write(f"Dup ack segments sent: {self.DupAcksSent}\n")
+        if self.ackEvery > 1:
+            log.write(f"Acks coalesced: {self.AcksCoalesced}\n")
+        log.write(extra)
+        if self.sink:
+            log.write(f"Streams received: {self.sink.completed}\n")
+        if self.resumed is not None:
+            log.write(f"Resumed at byte: {self.resumed}\n")
+        if self.writefile and self.writefile.decoder:
+            log.write(self.writefile.decoder.stats())
+        if self.fmt.checksum:
+            log.write(f"Corrupted packets dropped: {self.CorruptDropped}\n")
+            log.write(f"Data digest: {DIGEST_RESULTS[self.digestOk]}\n")
+            if self.digestOk is False:
+                print(f"{self.txtfilename}: the data received does not match the digest sent with the FIN", file=sys.stderr)
+
+        if self.writefile:
+            self.writefile.flush()
+            if self.checkpoint and self.finTime is not None:
+                self.checkpoint.remove()    #complete, nothing left to resume
+            elif self.checkpoint:
+                self.checkpoint.save(self.writefile.file, force=True)
+            self.writefile.close()
+        if self.sink:
+            self.sink.close()
+        log.close()
+        self.timers.cancel(self.finTimer)
+        if self.ackTimer:
+            self.timers.cancel(self.ackTimer)
+
+
+def receive_file(recvport, sendport, txtfilename, max_win, options, logname="Receiver_log.txt", log_start=None):
+    """
+    Run one transfer: receive from the sender on sendport into txtfilename and write the log.
 
-    #Initialisations of Varibales and Threads
-    buffer = []
-    SeqList = []
-    alive = True
-    start_time = 0
-    ExpectedSeqNum = 0
-    OriginalDataReceived = 0
-    OriginalSegmentsReceived = 0
-    DupDataReceived = 0
-    DupAcksSent = 0
+    Args:
+        recvport, sendport, txtfilename, max_win: parsed arguments
+        options: dict (parsed options)
+        logname: str
+        log_start: int (time.monotonic_ns() shared by the flows of a parallel transfer)
 
+    Returns:
+        (bytes received, ns of the SYN, ns of the FIN), times from time.monotonic_ns()
+    """
     control = Control()
-    control.timer = threading.Timer(2, timer_thread, args=(control,))
+    control.timer = control.timers.timer(timer_thread, control)
 
-    #Parsing arguments
-    recvport = parse_port(sys.argv[1])
-    sendport = parse_port(sys.argv[2])
-    txtfilename = sys.argv[3]
-    max_win = parse_max_win(sys.argv[4])
     control.sock = setup_socket(sendport, recvport)
-
-    #Opening Files
-    writefile = open(txtfilename, "w")
-    log = open("Receiver_log.txt", "w")
+    control.io = BatchSocket(control.sock, options["batch"])
+    control.io.enable_gro()
+    selector = selectors.DefaultSelector()
+    selector.register(control.sock, selectors.EVENT_READ)
+
+    #The output is opened on the SYN: txtfilename is a directory if the sender sends streams
+    connection = Connection(txtfilename, EventLog(logname, options["log_level"], start=log_start), Reassembly(max_win),
+                            control.timers, control.timer, options["writev"] and hasattr(os, "writev"))
+    if options["resume"]:
+        connection.checkpoint = Checkpoint(txtfilename)
+    setup_acks(connection, options, control.io.send)
+    metrics = None
+    if options["metrics"]:
+        metrics = Metrics("receiver", options["metrics"], options["metrics_interval"], control.timers,
+                          lambda: (connection.counters(), {"buffered_bytes": connection.buffer.buffered}))
+    profile = cProfile.Profile() if options["profile"] else None
 
     while control.alive:
-        try:
-            received_packet = control.sock.recv(BUF_SIZE)
-        except socket.timeout:
+        timeout = control.timers.timeout()
+        if not selector.select(timeout):
+            control.timers.run()
+            control.io.flush()
             continue
+        woke = time.perf_counter()
+        if profile:
+            profile.enable()
+
+        #Every datagram queued on the socket is handled in this wakeup, the ACKs are flushed together
+        packets = control.io.recv_batch()
+        for received_packet in packets:
+            if not control.alive:
+                break
+
+            #Decode received packet from sender, unless its checksum fails
+            if connection.corrupted(received_packet):
+                continue
+            packet = connection.handle(*decode_packet(received_packet), decode_fin(received_packet))
+            if packet is not None:
+                control.io.send(packet)
+
+        connection.flush()
+        control.timers.run()
+        control.io.flush()
+        if profile:
+            profile.disable()
+        if metrics:
+            metrics.observe("wakeup_us", (time.perf_counter() - woke) * 1e6)
+            metrics.observe("packets_per_wakeup", len(packets))
+            metrics.observe("buffered_bytes", connection.buffer.buffered)
+
+    if metrics:
+        metrics.close()
+    if profile:
+        profile.dump_stats(options["profile"])
+    extra = ""
+    if options["timer_stats"]:
+        extra += control.timers.stats()
+    if control.io.batch:
+        extra += control.io.stats()
+    connection.close(extra)
+    selector.close()
+    control.sock.close()
+    return connection.OriginalDataReceived, connection.synTime, connection.finTime
+
+def serve(recvport, txtfilename, max_win, options):
+    """
+    Server mode: receive from any number of senders on recvport in a single event loop,
+    until interrupted. Packets are demultiplexed by the sender's address, and a SYN with a
+    new ISN from a known address starts a new association. Each connection writes to
+    txtfilename.<host>-<port>-<ISN> and logs to Receiver_log.<host>-<port>-<ISN>.txt, and is
+    closed at the end of its FIN wait or after options["idle"] seconds without packets.
+    The logs of all connections are written by a single background thread.
 
-        #Decode received packet from sender
-        typeNum, seqnum, data = decode_packet(received_packet)
-        SeqList.append(seqnum)
-
-        if typeNum == SYN:
-            start_time = time.time()
-            log.write(f"rcv 0.00 SYN {seqnum} 0\n")
-            packet = create_packet(ACK, seqnum + 1, '')
-
-            #Next Packet we receive should have the ExpectedSeqNum of:
-            ExpectedSeqNum = (seqnum + 1) % MAX_SEQ
-            log.write(f"snd {round((time.time() - start_time)*1000,2)} ACK {seqnum + 1} 0\n")
+    Args:
+        recvport, txtfilename, max_win: parsed arguments
+        options: dict (parsed options)
 
-        elif typeNum == DATA:
-            log.write(f"rcv {round((time.time() - start_time)*1000,2)} DATA {seqnum} {len(data)}\n")
+    Returns:
 
-            if seqnum != ExpectedSeqNum:
-                if received_packet not in buffer:
-                    buffer.append(received_packet)
+    """
+    timers = TimerQueue()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((localhost, recvport))
+    sock.setblocking(False)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SERVER_RCVBUF)
+    io = BatchSocket(sock, options["batch"])
+    io.enable_gro()
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    writev = options["writev"] and hasattr(os, "writev")
+    writer = LogWriter(reopen=True)
+    connections = {}    #sender address -> Connection
+    closed = {"connections_closed": 0}  #Counters of the connections already closed, for the metrics
+
+    def finish(connection):
+        if connections.get(connection.peer) is connection:
+            del connections[connection.peer]
+        timers.cancel(connection.idleTimer)
+        connection.close()
+        closed["connections_closed"] += 1
+        for name, value in connection.counters().items():
+            closed[name] = closed.get(name, 0) + value
+
+    def values():
+        counters = dict(closed)
+        for connection in connections.values():
+            for name, value in connection.counters().items():
+                counters[name] = counters.get(name, 0) + value
+        return counters, {"connections_open": len(connections),
+                          "buffered_bytes": sum(connection.buffer.buffered for connection in connections.values())}
+
+    metrics = None
+    if options["metrics"]:
+        metrics = Metrics("receiver", options["metrics"], options["metrics_interval"], timers, values)
+    profile = cProfile.Profile() if options["profile"] else None
 
-                packet = create_packet(ACK, ExpectedSeqNum, '') #send duplicate ACK
-                DupAcksSent += 1
-                log.write(f"snd {round((time.time() - start_time)*1000,2)} ACK {ExpectedSeqNum} 0\n")
-            else:
-                #got the expected seq num, put into file, check buffer and add to file, send next ack
-                OriginalDataReceived += len(data)
-                OriginalSegmentsReceived += 1
-                packet = create_packet(ACK, seqnum + len(data), '')
-                ExpectedSeqNum = (seqnum + len(data)) % MAX_SEQ
-                writefile.write(data)
-
-                while buffer: #while buffer is NOT emtpy, write in order buffered packets to file.
-                    next_packet = buffer.pop(0)
-                    BufftypeNum, Buffseqnum, Buffdata = decode_packet(next_packet)
-                    if (Buffseqnum == ExpectedSeqNum):
-                        OriginalDataReceived += len(Buffdata)
-                        OriginalSegmentsReceived += 1
-                        ExpectedSeqNum = (Buffseqnum + len(Buffdata)) % MAX_SEQ #update ExpectedSeqNum
-                        packet = create_packet(ACK, Buffseqnum + len(data), '') #update ack packet to send
-                        writefile.write(Buffdata)
+    try:
+        while True:
+            selector.select(timers.timeout())
+            woke = time.perf_counter()
+            if profile:
+                profile.enable()
+
+            active = {}
+            packets = io.recv_batch_from()
+            for received_packet, address in packets:
+                typeNum, seqnum, data = decode_packet(received_packet)
+                connection = connections.get(address)
+                if connection is not None and connection.corrupted(received_packet):
+                    continue    #before anything else, a damaged header could pass for a new SYN
+                if typeNum == SYN and connection is not None and connection.ISN != seqnum:
+                    finish(connection)  #the sender started a new association
+                    connection = None
+
+                if connection is None and typeNum != SYN:
+                    flags = HEADER.unpack_from(received_packet)[0]
+                    fmt = PacketFormat(bool(flags & FLAG_SEQ32), checksum=bool(flags & FLAG_CHECKSUM))
+                    if typeNum == FIN:
+                        #FIN retransmitted after the connection was closed (our ACK was lost): ACK it again
+                        io.send(fmt.create_packet(ACK, seqnum + 1), address=address)
+                    elif typeNum == ACK:
+                        pass    #confirmation of a FIN ACK arriving after the linger ended
                     else:
-                        break
+                        #Data of a connection closed as idle (or never opened), stop the sender
+                        io.send(fmt.create_packet(RST, seqnum), address=address)
+                    continue
+
+                if connection is None:
+                    name = f"{address[0]}-{address[1]}-{seqnum}"
+                    log = EventLog(f"Receiver_log.{name}.txt", options["log_level"], SERVER_LOG_CAPACITY, writer=writer)
+                    connection = Connection(f"{txtfilename}.{name}", log, Reassembly(max_win), timers, writev=writev, peer=address)
+                    connection.finTimer = timers.timer(finish, connection)
+                    connection.idleTimer = timers.timer(finish, connection)
+                    setup_acks(connection, options, lambda packet, address=address: io.send(packet, address=address))
+                    connections[address] = connection
+
+                timers.arm(connection.idleTimer, options["idle"])
+                packet = connection.handle(typeNum, seqnum, data, decode_fin(received_packet))
+                if packet is not None:
+                    io.send(packet, address=address)
+                active[address] = connection
+
+            for connection in active.values():
+                connection.flush()
+            timers.run()
+            io.flush()
+            if profile:
+                profile.disable()
+            if metrics:
+                metrics.observe("wakeup_us", (time.perf_counter() - woke) * 1e6)
+                metrics.observe("packets_per_wakeup", len(packets))
+    except KeyboardInterrupt:
+        if profile:
+            profile.disable()
+
+    for connection in list(connections.values()):
+        finish(connection)
+    writer.close()
+    if metrics:
+        metrics.close()
+    if profile:
+        profile.dump_stats(options["profile"])
+    selector.close()
+    sock.close()
+
+def flow_options(options, flow):
+    """
+    Options of one flow of a parallel transfer: its own metrics target and profile.
 
-                log.write(f"snd {round((time.time() - start_time)*1000,2)} ACK {seqnum + len(data)} 0\n")
-        elif typeNum == FIN:
-            if not control.timerOn:
-                control.timerOn = True
-                control.sock.settimeout(2) #MSL *2 = 2
-                control.timer.start()
+    Args:
+        options: dict (parsed options)
+        flow: int
 
-            log.write(f"rcv {round((time.time() - start_time)*1000,2)} FIN {seqnum} 0\n")
-            packet = create_packet(ACK, seqnum + 1, '')
-            ExpectedSeqNum = (seqnum + 1) % MAX_SEQ
-            log.write(f"snd {round((time.time() - start_time)*1000,2)} ACK {seqnum + 1} 0\n")
+    Returns:
+        dict
+    """
+    options = dict(options)
+    for name in ("metrics", "profile"):
+        if options[name]:
+            options[name] += f".{flow}"
+    return options
+
+def receive_parallel(recvport, sendport, txtfilename, max_win, options):
+    """
+    Receive a file sent with --parallel=N: one flow per process, in a pool, on consecutive
+    ports starting at recvport. Each flow writes its byte range at its offset in the output
+    file. The logs of the flows are merged into Receiver_log.txt with a throughput report.
 
-        control.sock.send(packet)
+    Args:
+        recvport, sendport, txtfilename, max_win: parsed arguments
+        options: dict (parsed options)
 
-counter = Counter(SeqList)
-for count in counter.values():
-    if count > 1:
-        DupDataReceived += count - 1
+    Returns:
 
-time.sleep(0.1)
-log.write(f"\nOriginal data received: {OriginalDataReceived}\n")
-log.write(f"Original segments received: {OriginalSegmentsReceived}\n")
-log.write(f"Dup data segments received: {DupDataReceived}\n")
-log.write(f"Dup ack segments sent: {DupAcksSent}\n")
+    """
+    flows = options["parallel"]
+    open(txtfilename, "wb").close() #the flows write into it without truncating
+    log_start = time.monotonic_ns()
+    jobs = [(recvport + i, sendport + i, txtfilename, max_win, flow_options(options, i), f"Receiver_log.{i}.txt", log_start)
+            for i in range(flows)]
 
-writefile.close()
-control.timer.cancel()
-sys.exit(0)
+    with multiprocessing.Pool(flows) as pool:
+        results = pool.starmap(receive_file, jobs)
+    merge_logs([job[5] for job in jobs], "Receiver_log.txt", parallel_report(results))
 
 
+if __name__ == "__main__":
+    #Parsing arguments
+    recvport = parse_port(sys.argv[1])
+    sendport = parse_port(sys.argv[2])
+    txtfilename = sys.argv[3]
+    max_win = parse_max_win(sys.argv[4])
+    options = parse_options(sys.argv[5:], OPTIONS)
+    if options["log_level"] not in LEVELS:
+        sys.exit(f"Invalid log-level option, must be one of {', '.join(LEVELS)}: {options['log_level']}")
+    if options["delayed_ack"] < 1:
+        sys.exit(f"Invalid delayed-ack option, must be at least 1: {options['delayed_ack']}")
+    if options["ack_delay"] <= 0:
+        sys.exit(f"Invalid ack-delay option, must be greater than 0: {options['ack_delay']}")
+    if options["metrics_interval"] <= 0:
+        sys.exit(f"Invalid metrics-interval option, must be greater than 0: {options['metrics_interval']}")
+    if options["linger"] < 0:
+        sys.exit(f"Invalid linger option, must be greater than or equal to 0: {options['linger']}")
+
+    if options["server"]:
+        if options["parallel"] > 1:
+            sys.exit("Invalid options, --server cannot be combined with --parallel")
+        if options["resume"]:
+            sys.exit("Invalid options, --server cannot be combined with --resume")
+        serve(recvport, txtfilename, max_win, options)
+    elif options["parallel"] > 1:
+        if options["resume"]:
+            sys.exit("Invalid options, --parallel cannot be combined with --resume")
+        parse_port(recvport + options["parallel"] - 1)
+        parse_port(sendport + options["parallel"] - 1)
+        receive_parallel(recvport, sendport, txtfilename, max_win, options)
+    else:
+        receive_file(recvport, sendport, txtfilename, max_win, options)
+    sys.exit(0)
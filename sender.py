@@ -1,29 +1,62 @@
 import socket
 import sys
-import threading
+import os
+import multiprocessing
+import selectors
 import random
 import time
-import struct
-from dataclasses import dataclass
-from collections import Counter
-
-#Defintiions
-localhost = "127.0.0.1"
-BUF_SIZE = 1004 #Max data segment can be
-MAX_SEQ = ((2**16))
-
-DataType = {
-    0: "DATA",
-    1: "ACK",
-    2: "SYN",
-    3: "FIN"
+import mmap
+import cProfile
+import hashlib
+from dataclasses import dataclass, field
+from collections import deque
+
+from stp import (localhost, MSS, MAX_SEQ, MAX_MSS, MAX_MSS16, DIGEST_SIZE, DataType, DATA, ACK, SYN, FIN, RST, OPT_SACK, OPT_SEQ32, OPT_MSS, OPT_STREAMS, OPT_OFFSET, OPT_RWND, OPT_RESUME, OPT_COMPRESS, OPT_CHECKSUM, OPT_CLOSE,
+                 LEGACY, PacketFormat, decode_header, decode_packet, decode_window, encode_options, decode_options, parse_options)
+from timers import Timer, TimerQueue
+from batchio import BatchSocket
+from eventlog import EventLog, LEVELS, SND, RCV, DRP, merge_logs, parallel_report
+from streams import StreamSource
+import congestion
+from congestion import FixedWindow, Pacer
+from channel import Channel, parse_channel
+from metrics import Metrics
+from checkpoint import file_digest
+from compression import CODECS, Compressor
+
+RTT_ALPHA = 1/8     #Gain of the smoothed RTT estimator
+RTT_BETA = 1/4      #Gain of the RTT variation estimator
+MAX_RTO = 60        #Upper bound of the adaptive (backed off) RTO, in seconds
+
+OPTIONS = {
+    "adaptive_rto": False,  #--adaptive-rto: estimate RTO from RTT samples, rto argument is the initial value
+    "min_rto": 10,          #--min-rto=ms: floor of the adaptive RTO
+    "timer_stats": False,   #--timer-stats: append timer churn counters to the log
+    "cc": "none",           #--cc=none|reno|cubic: congestion control algorithm
+    "sack": False,          #--sack: ask the receiver for selective acknowledgements
+    "seq32": False,         #--seq32: ask for 32-bit sequence numbers (windows beyond 32 KiB)
+    "mss": MSS,             #--mss=bytes: ask for a larger max segment payload
+    "batch": False,         #--batch: batch socket syscalls (GSO/GRO where available), log packets per syscall
+    "mmap": False,          #--mmap: memory-map the file, segments are slices of the map instead of copies
+    "log_level": "all",     #--log-level=all|drops|stats: packet events kept in the log
+    "streams": 0,           #--streams=N: send txtfilename (a file or a directory) as one stream per file, N at a time
+    "parallel": 1,          #--parallel=N: split the file over N flows in N processes, on N consecutive port pairs
+    "seed": -1,             #--seed=N: seed the loss simulation (and the channels below) for reproducible runs
+    "channel": "",          #--channel=spec: emulate the forward channel (see channel.py), flp is its default loss
+    "reverse_channel": "",  #--reverse-channel=spec: emulate the reverse channel, rlp is its default loss
+    "metrics": "",          #--metrics=path|unix:path: publish live metrics snapshots to a file or a UNIX socket
+    "metrics_interval": 1.0,#--metrics-interval=seconds: time between snapshots
+    "profile": "",          #--profile=path: cProfile the send and ACK paths, stats dumped to path
+    "pace": False,          #--pace: space new segments at a rate derived from cwnd/srtt
+    "pace_rate": 0.0,       #--pace-rate=Mbit/s: cap of the pacing rate (pacing at this rate without --pace)
+    "rwnd": True,           #--rwnd=0: do not ask the receiver to advertise its window (flow control)
+    "fast_close": True,     #--fast-close=0: send the FIN only once all data is ACKed, and leave without confirming its ACK
+    "checksum": False,      #--checksum: checksum every packet and send a digest of the data with the FIN
+    "compress": "none",     #--compress=none|zlib|lzma: compress the data, if the receiver supports it
+    "compress_level": 6,    #--compress-level=0-9: compression level
+    "resume": False,        #--resume: send only the part of the file the receiver's checkpoint lacks (receiver --resume)
 }
 
-DATA = 0
-ACK = 1
-SYN = 2
-FIN = 3
-
 @dataclass
 class Control:
     """Control block: parameters for the sender program."""
@@ -32,14 +65,53 @@ class Control:
     recvport: int                       # Port number of the receiver
     txtfilename: str                    #name of file being sent
     max_win: int                        #max_window size
-    rto: int                            #retransmission time out
+    rto: float                          #retransmission time out (current value, in seconds)
     flp: int                            #forward loss probability
     rlp: int                            #reverse loss proability
     socket: socket.socket               # Socket for sending/receiving messages
     start_time: float                   #Initial start_time for timestamps
-    timer: threading.Timer = None       #timer thread
+    io: BatchSocket = None              #Batched sends/receives on socket
+    forward: Channel = None             #Emulated channel to the receiver (loss, delay, ...)
+    reverse: Channel = None             #Emulated channel from the receiver
+    adaptive_rto: bool = False          #Estimate the RTO from measured RTTs instead of using a fixed value
+    min_rto: float = 0.01               #Lower bound of the adaptive RTO (seconds)
+    srtt: float = None                  #Smoothed RTT (seconds), None until the first sample
+    rttvar: float = None                #RTT variation (seconds)
+    last_retransmit: float = 0.0        #monotonic time of the latest retransmission
+    timers: TimerQueue = field(default_factory=TimerQueue) #All timers of the sender, serviced by the event loop
+    rto_timer: Timer = None             #Retransmission timer
+    timer_stats: bool = False           #Append the timer churn counters to the log
+    metrics: Metrics = None             #Live metrics (None = off)
+    profile: cProfile.Profile = None    #Profiler switched on around each wakeup (None = off)
     dupACK = 0                          #Counter for duplicate ACKs
-    dataSent: int = 0                   #Counter to keep track of data sent within window
+    cc: FixedWindow = None              #Congestion control algorithm, decides the window
+    flow_control: bool = True           #Ask for the receiver's advertised window
+    rwnd: int = None                    #Window advertised by the receiver (None = not advertised)
+    persist_timer: Timer = None         #Zero window probe timer
+    persist: float = None               #Current zero window probe interval (seconds), backed off
+    probe: bool = False                 #Send one segment whatever the windows (zero window probe)
+    pacer: Pacer = None                 #Spaces new segments (None = not paced)
+    pace_timer: Timer = None            #Wakes the event loop when the pacer has tokens again
+    recover: int = None                 #Seq of the newest segment outstanding when fast recovery started (None = not recovering)
+    loss_recover: int = None            #Seq of the newest segment outstanding when the RTO last expired (None = repaired)
+    epoch: int = 0                      #Loss recovery episode, a hole is resent at most once per episode
+    hole_scan: int = None               #Seq where the next search for holes to resend starts
+    sack: bool = False                  #Selective acknowledgements (requested, then as negotiated on the SYN)
+    seq32: bool = False                 #32-bit sequence numbers requested
+    mss: int = MSS                      #Max segment payload requested
+    streams: bool = False               #One stream per file (requested, then as negotiated on the SYN)
+    offset: int = None                  #File offset of the data sent, for one flow of a parallel transfer
+    resume: bool = False                #Resume after the receiver's checkpoint (requested)
+    resumed: int = None                 #File offset the transfer resumed at (None = not resumed)
+    txtfile: object = None              #File being sent, seeked to the resume offset
+    compressor: Compressor = None       #Compresses the file (requested, then None unless accepted on the SYN)
+    checksum: bool = False              #Packet checksums and data digest requested
+    digest: object = None               #SHA-256 of the data sent, for the FIN (checksums negotiated)
+    fmt: PacketFormat = LEGACY          #Packet format negotiated on the SYN
+    GlobalSeqNum: int = 0               #Sequence number of the next new segment
+    totalDataSent: int = 0              #Original data bytes read from the file and sent
+    totalSegmentsSent: int = 0          #Original data segments sent
+    eof: bool = False                   #Flag set once the whole file has been read
     SynAcked: bool = False              #Flag indicating connection successful SYN and ACK (2 way handshake)
     ISN: int = 0                        #Initial Sequence Number
     totalDataAcked: int = 0             #Variables for the log
@@ -47,14 +119,169 @@ class Control:
     totalAcksDropped: int = 0           # " "
     totalRetransmitted: int = 0         # " "
     totalDupAcks:int = 0                # " "
-    finACK: int = 0                     #Expected ACK for the Fin Packet sent
+    totalAcksReceived: int = 0          # " "
+    totalWindowProbes: int = 0          # " "
+    totalCorruptAcks: int = 0           # " "
+    lastAck: int = None                 #Highest ACK number received, ACKs not above it are duplicates
+    finACK: int = None                  #Expected ACK for the Fin Packet sent
+    fast_close: bool = True             #FIN carried by the last segment, its ACK confirmed (requested, then as negotiated on the SYN)
+    lookahead: bytes = None             #Data read one segment ahead to find the last segment (fast close)
     terminate: bool = False             #terminate flag for the program
-    AckList = []                        #List of all the Acks received.
     is_alive: bool = True               # Flag to signal the sender program to terminate
 
+@dataclass(slots=True)
+class Segment:
+    """A sent but unACKed segment, header fields cached so the ACK path never re-parses packets."""
+    typeNum: int                        #DATA, SYN or FIN
+    seq: int                            #Sequence number of the segment
+    length: int                         #Sequence space consumed by the segment
+    header: bytes                       #Encoded header and payload, kept for retransmission and
+    payload: bytes                      #sent as two buffers so they are never concatenated (memoryview with --mmap)
+    sent_at: float = 0.0                #monotonic time of the first transmission
+    sacked: bool = False                #Receiver reported it holds this segment
+    epoch: int = 0                      #Recovery episode in which the segment was last resent
+    fin: bool = False                   #DATA segment carrying the FIN (its length counts the FIN's sequence number)
+
+class MappedFile:
+    """
+    Read-only memory map of the file being sent, or of its byte range [offset, offset + length).
+    read() returns memoryview slices of the map, so segment payloads (and their
+    retransmissions) never copy the file data.
+    """
+
+    def __init__(self, file, offset=0, length=None):
+        self.file = file
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)[offset:None if length is None else offset + length]
+        self.offset = 0         #Position of the next read
+
+    def read(self, size):
+        """
+        Return the next size bytes of the file (fewer at the end, empty at EOF).
+
+        Args:
+            size: int
+
+        Returns:
+            memoryview
+        """
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def seek(self, offset):
+        """Continue reading at offset."""
+        self.offset = offset
+
+    def close(self):
+        """Unmap and close the file. The map stays alive while segments still reference it."""
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+class FileRange:
+    """Reads limited to the byte range [offset, offset + length) of a file."""
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size):
+        data = self.file.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
 @dataclass
 class Packet_list:
-    sent = []
+    """Send window: unACKed segments in sequence order, indexed by sequence number."""
+    sent: deque = field(default_factory=deque)
+    by_seq: dict = field(default_factory=dict)
+    inflight: int = 0                   #Sequence space sent but not yet ACKed
+    max_seq: int = MAX_SEQ              #Size of the sequence space
+    sack_high: int = None               #End of the highest SACKed range (None = nothing SACKed)
+    sack_marked: dict = field(default_factory=dict) #SACK block start -> seq up to which it was marked
+
+    def append(self, segment):
+        """Add a newly sent segment to the end of the window."""
+        self.sent.append(segment)
+        self.by_seq[segment.seq] = segment
+        self.inflight += segment.length
+
+    def advance(self, acknum):
+        """
+        Release every segment fully covered by the cumulative ACK acknum. Runs in time
+        proportional to the number of segments freed.
+
+        Args:
+            acknum: int
+
+        Returns:
+            freed: int (segments released)
+            freedBytes: int (sequence space released)
+            segment: Segment (the newest segment released, None if nothing was)
+        """
+        acked = (acknum - self.sent[0].seq) % self.max_seq
+        if acked == 0 or acked > self.inflight:
+            return 0, 0, None
+
+        freed = 0
+        freedBytes = 0
+        segment = None
+        while self.sent and self.sent[0].length <= acked:
+            segment = self.sent.popleft()
+            del self.by_seq[segment.seq]
+            self.sack_marked.pop(segment.seq, None)
+            acked -= segment.length
+            freed += 1
+            freedBytes += segment.length
+        self.inflight -= freedBytes
+        if self.sack_high is not None and (not self.sent or not 0 < self.offset(self.sack_high) <= self.inflight):
+            self.sack_high = None
+        return freed, freedBytes, segment
+
+    def offset(self, seqnum):
+        """Distance of seqnum from the oldest unACKed segment, modulo the sequence space."""
+        return (seqnum - self.sent[0].seq) % self.max_seq
+
+    def mark_sacked(self, blocks):
+        """
+        Flag the segments covered by the SACK blocks of an ACK. Ranges already marked by
+        earlier ACKs are not walked again.
+
+        Args:
+            blocks: list of (start, end) sequence numbers, end exclusive
+
+        Returns:
+            bool (True if any segment was newly SACKed)
+        """
+        newly = False
+        for start, end in blocks:
+            if not self.sent:
+                break
+            end_offset = self.offset(end)
+            if not 0 < self.offset(start) < end_offset <= self.inflight:
+                continue    #stale or bogus block
+
+            seqnum = self.sack_marked.get(start, start)
+            segment = self.by_seq.get(seqnum)
+            while segment is not None and self.offset(segment.seq) + segment.length <= end_offset:
+                if not segment.sacked:
+                    segment.sacked = True
+                    newly = True
+                seqnum = (segment.seq + segment.length) % self.max_seq
+                segment = self.by_seq.get(seqnum)
+            self.sack_marked[start] = seqnum
+
+            if self.sack_high is None or end_offset > self.offset(self.sack_high):
+                self.sack_high = end
+        return newly
 
 
 def parse_port(port_str, min_port=49152, max_port=65535):
@@ -156,322 +383,927 @@ def setup_socket(sendport, recvport):
 
     return sock
 
-def create_packet(typeNum, seqnum, data):
+def handle_ack(control, log, p_list, received_packet):
+    """
+    Process a single ACK packet received from the receiver. Slides the window on a new ACK,
+    counts duplicate ACKs and performs a fast retransmit on the third duplicate.
+
+    Args:
+        control: class
+        log: file
+        p_list: class(Packet_list)
+        received_packet: packet in Bytes
+
+    Returns:
+
+    """
+    #Decode information of the received packet
+    typeNum, acknum, length = decode_header(received_packet)
+    if not control.fmt.valid(received_packet):
+        log.record(DRP, typeNum if typeNum in DataType else ACK, acknum, 0)
+        control.totalCorruptAcks += 1
+        return
+    log.record(RCV, typeNum, acknum, 0)
+
+    if typeNum == RST:
+        print(f"recv: connection reset by {control.host}:{control.recvport}, shutting down...", file=sys.stderr)
+        control.is_alive = False
+        stop_timer(control)
+        return
+
+    #An ACK older than the newest one seen was reordered: a duplicate, with a stale window
+    max_seq = control.fmt.max_seq
+    current = control.lastAck is None or (acknum - control.lastAck) % max_seq < max_seq // 2
+    window_update = False
+    if current and control.rwnd is not None:
+        window = decode_window(received_packet)
+        if window is not None:
+            #Only a larger window is an update; the window shrinks as out-of-order data piles up at the receiver
+            window_update = window > control.rwnd
+            control.rwnd = window
+
+    if not p_list.sent:
+        # All data has been sent and acknowledged, nothing left to slide.
+        return
+    control.totalAcksReceived += 1
+    if current and acknum != control.lastAck:
+        control.lastAck = acknum
+    elif not window_update:
+        control.totalDupAcks += 1   #counted as fast retransmit sees them
+
+    if not control.SynAcked:
+        #Only the ACK for the SYN (legacy header, options in the payload) completes the handshake
+        if acknum == (control.ISN + 1) % MAX_SEQ:
+            syn = p_list.sent[0]
+            sample = rtt_sample(control, syn)
+            if (control.adaptive_rto or control.pacer) and sample is not None:
+                update_rto(control, sample)
+            p_list.advance(acknum)
+            control.totalDataAcked += syn.length
+            stop_timer(control)
+            establish(control, p_list, decode_options(decode_packet(received_packet)[2]))
+        return
+
+    #Determine if ACK recieved is for FIN
+    if control.finACK is not None and acknum == control.finACK:
+        #With fast close it may also cover the last data segments
+        freed, freedBytes, newest = p_list.advance(acknum)
+        control.totalDataAcked += freedBytes - 1    #the FIN takes a sequence number but carries no data
+        control.terminate = True
+        stop_timer(control)
+        if control.fast_close:
+            #Confirm the ACK, the receiver closes at once instead of lingering for a lost ACK
+            confirm = Segment(ACK, control.finACK, 0, control.fmt.create_header(ACK, control.finACK), b'')
+            delays = simulate_packet_loss_flp(confirm, control, log)
+            if delays:
+                log.record(SND, ACK, control.finACK, 0)
+            transmit(control, confirm, delays)
+            if any(delays):
+                #The channel delays the confirmation: leave once its last copy is sent from the timer queue
+                control.timers.arm(control.timers.timer(confirm_sent, control), max(delays))
+                return
+        control.is_alive = False
+        return
+
+    newly_sacked = False
+    if control.sack and length:
+        newly_sacked = p_list.mark_sacked(control.fmt.unpack_sack(decode_packet(received_packet)[2]))
+
+    if acknum == p_list.sent[0].seq:
+        if window_update:
+            return  #the receiver opened its window, not a sign of loss
+        #If received packet has ACK(k) that matches previous ACK(k-1).
+        control.dupACK += 1
+        if control.recover is not None:
+            control.cc.on_dup_ack()
+            if newly_sacked:
+                retransmit_holes(control, log, p_list)
+        elif control.loss_recover is not None:
+            #Holes left by an RTO are resent on ACKs, not by a new fast retransmit
+            if newly_sacked:
+                retransmit_holes(control, log, p_list)
+        elif control.dupACK == 3:
+            #Fast Retransmit, then stay in fast recovery until everything outstanding now is ACKed
+            control.recover = p_list.sent[-1].seq
+            control.epoch += 1
+            control.hole_scan = None
+            control.cc.on_fast_retransmit(p_list.inflight)
+            retransmit_holes(control, log, p_list)
+        return
+
+    #New (possibly cumulative) ACK - remove every segment it covers and move window.
+    freed, freedBytes, newest = p_list.advance(acknum)
+    if not freed:
+        return
+    sample = rtt_sample(control, newest) if control.adaptive_rto or control.pacer or control.metrics else None
+    if sample is not None:
+        if control.adaptive_rto or control.pacer:
+            update_rto(control, sample)
+        if control.metrics:
+            control.metrics.observe("rtt_ms", sample * 1000)
+    control.totalDataAcked += freedBytes
+    control.dupACK = 0
+    if control.metrics:
+        control.metrics.observe("inflight_bytes", p_list.inflight)
+        control.metrics.observe("cwnd_bytes", control.cc.cwnd)
+
+    if control.recover is None:
+        control.cc.on_ack(freedBytes, control.srtt)
+        if control.loss_recover in p_list.by_seq:
+            #Partial ACK after an RTO: the burst lost the next hole as well, resend it
+            #at once (the window keeps growing by slow start) instead of on another RTO
+            retransmit_holes(control, log, p_list)
+        else:
+            control.loss_recover = None
+    elif control.recover in p_list.by_seq:
+        #Partial ACK: the next hole is lost as well, resend it without waiting for dup ACKs
+        control.cc.on_partial_ack(freedBytes)
+        retransmit_holes(control, log, p_list)
+    else:
+        control.recover = None
+        control.cc.on_recovery_exit()
+
+    if p_list.sent:
+        reset_timer(control)
+    else:
+        stop_timer(control)
+
+
+def syn_options(control):
     """
-    create packet in necessary format to send through socket.
+    Options offered to the receiver in the SYN payload.
 
     Args:
-        typeNum: int
-        seqnum: int
-        data: str
+        control: class
+
+    Returns:
+        dict mapping option name to value
+    """
+    offer = {}
+    if control.sack:
+        offer[OPT_SACK] = ''
+    if control.seq32:
+        offer[OPT_SEQ32] = ''
+    if control.mss != MSS:
+        offer[OPT_MSS] = str(control.mss)
+    if control.streams:
+        offer[OPT_STREAMS] = ''
+    if control.offset is not None:
+        offer[OPT_OFFSET] = str(control.offset)
+    if control.flow_control:
+        offer[OPT_RWND] = ''
+    if control.resume:
+        offer[OPT_RESUME] = ''
+    if control.compressor:
+        offer[OPT_COMPRESS] = control.compressor.codec
+    if control.checksum:
+        offer[OPT_CHECKSUM] = ''
+    if control.fast_close:
+        offer[OPT_CLOSE] = str(max(round(control.rto * 1000), 1))  #the receiver lingers for a few RTOs
+    return offer
+
+def establish(control, p_list, accepted):
+    """
+    Complete the handshake: apply the options the receiver accepted and switch to the
+    negotiated packet format for the rest of the connection.
+
+    Args:
+        control: class
+        p_list: class(Packet_list)
+        accepted: dict (options echoed in the ACK for the SYN)
 
     Returns:
-        packet (Bytes)
+
     """
-    # Ensure typeNum and seqnum are within the valid range
-    typeNum = min(max(typeNum, 0), 4)
-    seqnum = seqnum % MAX_SEQ
+    control.SynAcked = True
+    control.sack = control.sack and OPT_SACK in accepted
+    control.fast_close = control.fast_close and OPT_CLOSE in accepted
+    if control.streams and OPT_STREAMS not in accepted:
+        #The receiver would write the stream headers into a single file, send nothing
+        print(f"receiver {control.host}:{control.recvport} does not support streams, closing...", file=sys.stderr)
+        control.eof = True
+    if control.offset is not None and OPT_OFFSET not in accepted:
+        print(f"receiver {control.host}:{control.recvport} does not support parallel transfers, closing...", file=sys.stderr)
+        control.eof = True
+    if control.resume and OPT_RESUME in accepted:
+        resume(control, accepted[OPT_RESUME])
+    if control.compressor and accepted.get(OPT_COMPRESS) != control.compressor.codec:
+        control.compressor.kind = None  #the receiver would write the frames as they are, send the file itself
+        control.compressor = None
+
+    seq32 = control.seq32 and OPT_SEQ32 in accepted
+    mss = MSS
+    if OPT_MSS in accepted:
+        try:
+            mss = min(max(int(accepted[OPT_MSS]), 1), control.mss, MAX_MSS if seq32 else MAX_MSS16)
+        except ValueError:
+            pass
 
-    # Pack the data into bytes
-    packet_data = struct.pack("!HH", typeNum, seqnum) + data.encode('utf-8')
+    if control.flow_control and OPT_RWND in accepted:
+        try:
+            control.rwnd = max(int(accepted[OPT_RWND]), 0)
+        except ValueError:
+            pass
+        control.persist = control.rto
+
+    control.fmt = PacketFormat(seq32, mss, control.checksum and OPT_CHECKSUM in accepted)
+    if control.fmt.checksum:
+        control.digest = hashlib.sha256()
+    p_list.max_seq = control.fmt.max_seq
+    control.GlobalSeqNum = (control.ISN + 1) % control.fmt.max_seq
+    #The congestion window bounds the data in flight (with the advertised window), keep it
+    #within half the sequence space so sequence numbers never repeat in flight
+    control.cc = congestion.create(control.cc.name, mss, min(control.max_win, control.fmt.max_win))
+
+def resume(control, checkpoint):
+    """
+    Continue after the receiver's checkpoint, if it holds a prefix of the file being sent.
+    Otherwise send nothing: the receiver kept its output up to the checkpoint, and drops
+    the checkpoint once this connection closes, so the next run sends the whole file.
 
-    return packet_data
+    Args:
+        control: class
+        checkpoint: str (offset:digest, the value of the resume option)
+
+    Returns:
+
+    """
+    offset, sep, digest = checkpoint.partition(":")
+    try:
+        offset, digest = int(offset), bytes.fromhex(digest)
+        matches = offset >= 0 and file_digest(control.txtfilename, offset) == digest
+    except ValueError:
+        matches = False
+    if not matches:
+        print(f"checkpoint of receiver {control.host}:{control.recvport} does not match {control.txtfilename}, closing "
+              f"(run again to send the whole file)...", file=sys.stderr)
+        control.eof = True
+        return
+    control.resumed = offset
+    control.txtfile.seek(offset)
+
+def retransmit(control, log, segment):
+    """
+    Resend a segment, unless the forward loss simulation drops it.
+
+    Args:
+        control: class
+        log: file
+        segment: class(Segment)
+
+    Returns:
 
-def decode_packet(packet_data):
     """
-    decode the given packet from bytes to necessary information
+    segment.epoch = control.epoch
+    control.last_retransmit = time.monotonic()
+    log.record(SND, segment.typeNum, segment.seq, segment.length - segment.fin if segment.typeNum == DATA else 0)
+    if segment.fin:
+        log.record(SND, FIN, (segment.seq + segment.length - 1) % control.fmt.max_seq, 0)
+    control.totalRetransmitted += 1
+    if control.pacer:
+        control.pacer.consume(segment.length)
+
+    transmit(control, segment, simulate_packet_loss_flp(segment, control, log))
+
+def retransmit_oldest(control, log, p_list):
+    """
+    Resend the oldest unACKed packet.
 
     Args:
-        packet_data: packet in Bytes
+        control: class
+        log: file
+        p_list: class(Packet_list)
 
     Returns:
-        typeNum: int
-        acknum: int
-        data: str
+
     """
+    retransmit(control, log, p_list.sent[0])
 
-    # Unpack the first two bytes as unsigned short integers (2 bytes each)
-    typeNum, acknum = struct.unpack("!HH", packet_data[:4])
+def retransmit_holes(control, log, p_list):
+    """
+    Resend the segments the receiver is missing during fast recovery. Without SACK
+    information only the oldest unACKed segment is known to be missing; with it, every
+    segment below the highest SACKed range that was not SACKed is a hole. Each hole is
+    resent at most once per recovery episode.
 
-    # Extract the data from the remaining bytes
-    data = packet_data[4:].decode('utf-8')
-    return typeNum, acknum, data
+    Args:
+        control: class
+        log: file
+        p_list: class(Packet_list)
 
+    Returns:
 
-def listen_thread(control, log, p_list):
     """
-    Entry point for the receiver program. Acts as the main function for the listen thread
-    ACK packets will be sent here from the receiver.
+    if p_list.sack_high is None:
+        if p_list.sent[0].epoch != control.epoch:
+            retransmit_oldest(control, log, p_list)
+        return
+
+    #Holes before hole_scan were handled by an earlier call in this episode
+    seqnum = control.hole_scan if control.hole_scan in p_list.by_seq else p_list.sent[0].seq
+    high = p_list.offset(p_list.sack_high)
+    segment = p_list.by_seq.get(seqnum)
+    while segment is not None and p_list.offset(segment.seq) < high:
+        if not segment.sacked and segment.epoch != control.epoch:
+            retransmit(control, log, segment)
+        seqnum = (segment.seq + segment.length) % p_list.max_seq
+        segment = p_list.by_seq.get(seqnum)
+    control.hole_scan = seqnum
+
+
+def receive_acks(control, log, p_list):
+    """
+    Drain every ACK currently queued on the (non-blocking) socket, a batch of datagrams
+    per receive call when batching.
 
     Args:
         control: class
         log: file
-        p_list: class(list)
+        p_list: class(Packet_list)
 
     Returns:
 
     """
     while control.is_alive:
         try:
-            received_packet = control.socket.recv(BUF_SIZE)
-        except BlockingIOError:
-            continue    # No data available to read
+            packets = control.io.recv_batch()
         except ConnectionRefusedError:
-            print(f"recv: connection refused by {control.host}:{control.sendport}, shutting down...", file=sys.stderr)
+            print(f"recv: connection refused by {control.host}:{control.recvport}, shutting down...", file=sys.stderr)
             control.is_alive = False
-            break
+            return
+        if not packets:
+            return    # No data available to read
 
-        #Simulate packet loss of ACK:
-        if simulate_packet_loss_rlp(received_packet, control, log):
-            continue
+        for received_packet in packets:
+            if not control.is_alive:
+                break
+            #Simulate the reverse channel: loss, damage, and delay by re-delivering a copy later
+            for delay in simulate_packet_loss_rlp(received_packet, control, log):
+                packet = control.reverse.damage(received_packet)[0] if control.reverse.corrupt else received_packet
+                if delay:
+                    control.timers.arm(control.timers.timer(handle_ack, control, log, p_list, bytes(packet)), delay)
+                else:
+                    handle_ack(control, log, p_list, packet)
 
-        #Get information of Oldest UnACKed packet for further processing
-        try:
-            OldestTypeNum, OldestSeq, OldestData = decode_packet(p_list.sent[0])
-        except:
-            # In this case, all data has been sent. FIN has been sent and waiting for ACK back from receiver.
-            typeNum, acknum, data = decode_packet(received_packet)
-            log.write(f"rcv {round((time.time() - control.start_time)*1000,2)} ACK {acknum} 0\n")
-            continue
 
+def timer_expired(control, p_list, log):
+    """
+    Called by the event loop when the RTO expires.
+    This function will attempt to retransmit the oldest unACKed packet and restart the timer.
 
-        #Decode information of the received packet
-        typeNum, acknum, data = decode_packet(received_packet)
-        log.write(f"rcv {round((time.time() - control.start_time)*1000,2)} ACK {acknum} 0\n")
-        control.AckList.append(acknum)
+    Args:
+        control: class
+        log: file
+        p_list: class(Packet_list)
 
-        #Determine if ACK recieved is for SYN or FIN
-        if acknum == (control.ISN + 1):
-            control.SynAcked = True
-        elif acknum == control.finACK:
-            control.terminate = True
-            control.is_alive = False
-            control.timer.cancel()
-            break
+    Returns:
 
-        #If the received packet has the ACK that we expected to recieve. Update oldest UnACKed packet and move window.
-        if (acknum == (OldestSeq + len(OldestData))%MAX_SEQ):
-            control.dataSent = control.dataSent - 1000
-            control.totalDataAcked += len(OldestData)
-            p_list.sent.pop(0)
-            control.timer.cancel()
-            control.dupACK = 0
-            reset_timer(control,p_list,log)
-        elif acknum == OldestSeq:
-            #If received packet has ACK(k) that matches previous ACK(k-1).
-            control.dupACK += 1
-        elif acknum > (OldestSeq + len(OldestData))%MAX_SEQ:
-            #Cumulative ACK - If recieved ACK is greater than expected ACK, remove oldest until fully updated.
-            while len(p_list.sent) > 1:
-                prev_packet = p_list.sent[0]
-                prevtypeNum, prevseqnum, prevdata = decode_packet(prev_packet)
-                if prevseqnum == acknum:
-                    break
-                elif prevseqnum < acknum:
-                    p_list.sent.pop(0)
-
-                control.totalDataAcked += len(prevdata)
-
-        #Fast Retransmit:
-        if control.dupACK == 3:
-            log.write(f"snd {round((time.time() - start_time)*1000,2)} {DataType[OldestTypeNum]} {OldestSeq} {len(OldestData)}\n")
-            control.totalRetransmitted += 1
-            control.dupACK = 0
-            if simulate_packet_loss_flp(p_list.sent[0], control, log):
-                continue
-            control.socket.send(p_list.sent[0])
-
-
-def timer_thread(control, p_list, log):
-    """
-    Function for the timer thread. This function will be called when the RTO expires.
-    This function will attempt to retransmit the oldest unACKed packet. If the p_list.sent
-    is empty, all the text data has been sent.
+    """
+    if not p_list.sent:
+        stop_timer(control)
+        return
+
+    control.cc.on_timeout(p_list.inflight)
+    control.recover = None
+    control.loss_recover = p_list.sent[-1].seq
+    control.hole_scan = None
+    control.epoch += 1
+    control.dupACK = 0
+    retransmit_oldest(control, log, p_list)
+    if control.adaptive_rto:
+        #Exponential backoff, kept until a valid RTT sample arrives
+        control.rto = min(control.rto * 2, MAX_RTO)
+    reset_timer(control)
+
+def window_probe(control):
+    """
+    Called by the event loop when the zero window probe timer expires: the next call to
+    send_segments sends one segment whatever the advertised window. Its ACK carries the
+    current window; while that stays zero the probes are backed off like the RTO.
 
     Args:
         control: class
-        log: file
-        p_list: class(list)
 
     Returns:
 
     """
-    try:
-        OldestTypeNum, OldestSeq, OldestData = decode_packet(p_list.sent[0])
-        log.write(f"snd {round((time.time() - start_time)*1000,2)} {DataType[OldestTypeNum]} {OldestSeq} {len(OldestData)}\n")
-        control.totalRetransmitted += 1
+    control.probe = True
+    control.totalWindowProbes += 1
+    control.persist = min(control.persist * 2, MAX_RTO)
 
-        if not simulate_packet_loss_flp(p_list.sent[0], control, log):
-            control.socket.send(p_list.sent[0])
+def pace_expired():
+    """
+    Called by the event loop when the pacer has tokens for the next segment. Nothing to
+    do here: send_segments runs after the timers on every wakeup.
+    """
 
-    except:
-        if control.terminate:
-            return
+def confirm_sent(control):
+    """
+    Called by the event loop once the last delayed copy of the confirmation of the FIN ACK
+    has been sent: the sender is done.
+
+    Args:
+        control: class
 
-    reset_timer(control, p_list,log)
+    Returns:
+
+    """
+    control.is_alive = False
 
-def reset_timer(control,p_list,log):
+def reset_timer(control):
     """
-    Function to restart the timer thread every time RTO expires.
+    (Re)arm the retransmission timer so that it expires one RTO from now.
 
     Args:
         control: class
-        log: file
-        p_list: class(list)
 
     Returns:
 
     """
-    # Create a new timer with the specified duration
-    timer = threading.Timer(control.rto, timer_thread, args=(control,p_list,log))
-    timer.start()
-    # Store the timer reference in the control object
-    control.timer = timer
+    control.timers.arm(control.rto_timer, control.rto)
 
-def simulate_packet_loss_flp(packet, control, log):
+def rtt_sample(control, segment):
     """
-    Determines whether the forward packet should be dropped
+    RTT measured by the ACK that released a segment, under Karn's rule extended to the
+    whole window: only segments first sent after the latest retransmission give a sample.
+    The ACK of a resent segment may answer either copy, and a segment sent before a resend
+    may have waited in the receiver's buffer for the hole to be filled, its ACK held back
+    by the whole loss recovery.
 
     Args:
         control: class
-        log: file
-        p_list: class(list)
+        segment: class(Segment) (the newest segment the ACK released)
 
     Returns:
-        bool
+        float (seconds), None if the ACK gives no valid sample
     """
-    #random.random() generates number between 0.0 and 1.0
-    typeNum, seqnum, data = decode_packet(packet)
-    if random.random() < control.flp:
-        log.write(f"drp {round((time.time() - control.start_time)*1000,2)} {DataType[typeNum]} {seqnum} {len(data)}\n")
-        control.totalSegmentsDropped += 1
-        return True
-    else:
-        return False
+    if segment.sent_at <= control.last_retransmit:
+        return None
+    return time.monotonic() - segment.sent_at
 
-def simulate_packet_loss_rlp(packet, control, log):
+def update_rto(control, sample):
     """
-    Determines whether the reverse packet should be dropped
+    Feed an RTT sample into the smoothed RTT / RTT variation estimators (RFC 6298) and,
+    with the adaptive RTO, recompute the RTO from them.
 
     Args:
         control: class
-        log: file
-        p_list: class(list)
+        sample: float (measured RTT in seconds)
 
     Returns:
-        bool
+
     """
-    #random.random() generates number between 0.0 and 1.0
-    typeNum, acknum, data = decode_packet(packet)
-    if random.random() < control.rlp:
-        log.write(f"drp {round((time.time() - control.start_time)*1000,2)} {DataType[typeNum]} {acknum} {len(data)}\n")
-        control.totalAcksDropped += 1
-        return True
+    if control.srtt is None:
+        control.srtt = sample
+        control.rttvar = sample / 2
     else:
-        return False
+        control.rttvar = (1 - RTT_BETA) * control.rttvar + RTT_BETA * abs(control.srtt - sample)
+        control.srtt = (1 - RTT_ALPHA) * control.srtt + RTT_ALPHA * sample
 
+    if control.adaptive_rto:
+        control.rto = min(max(control.srtt + 4 * control.rttvar, control.min_rto), MAX_RTO)
 
-if __name__ == "__main__":
-    #Parse arguments
-    sendport = parse_port(sys.argv[1])
-    recvport = parse_port(sys.argv[2])
-    txtfilename = sys.argv[3]
-    max_win = parse_max_win(sys.argv[4])
-    rto = parse_rto(sys.argv[5])/1000
-    flp = parse_lp(sys.argv[6])
-    rlp = parse_lp(sys.argv[7])
+def stop_timer(control):
+    """
+    Stop the retransmission timer.
 
-    #Open files
-    log = open("Sender_log.txt", "w")
-    txtfile = open(txtfilename, "r")
+    Args:
+        control: class
 
-    #Initialisation of Variables and Threads
-    List = []
-    totalDataSent = 0
-    totalSegmentsSent = 0
-    totalRetransmitted = 0
+    Returns:
 
-    start_time = time.time()
-    sock = setup_socket(sendport, recvport)
-    control = Control(localhost, sendport, recvport, txtfilename, max_win, rto, flp, rlp, sock, start_time)
-    p_list = Packet_list() #used to keep track of oldest packets.
+    """
+    control.timers.cancel(control.rto_timer)
+
+def send_segments(control, log, p_list, txtfile):
+    """
+    Send new segments while the window is open. Once the file is exhausted and all
+    data has been ACKed, the FIN is sent.
+
+    Args:
+        control: class
+        log: file
+        p_list: class(Packet_list)
+        txtfile: file
+
+    Returns:
+
+    """
+    mss = control.fmt.mss
+    pacer = control.pacer
+    if pacer:
+        pacer.update(control.cc, control.srtt)
+    window = control.cc.window() if control.rwnd is None else min(control.cc.window(), control.rwnd)
+    if control.rwnd is not None and control.rwnd >= mss and control.persist_timer.armed():
+        #The window reopened
+        control.timers.cancel(control.persist_timer)
+        control.persist = control.rto
+    while control.SynAcked and not control.eof and (p_list.inflight + mss <= window or control.probe):
+        control.probe = False
+        if pacer:
+            #Out of tokens: the pace timer wakes the event loop when the next segment is due
+            wait = pacer.delay(mss)
+            if wait:
+                if not control.pace_timer.armed():
+                    control.timers.arm(control.pace_timer, wait)
+                break
+
+        if control.lookahead is None:
+            txt_data = txtfile.read(mss) #read up to MSS bytes from the file
+        else:
+            txt_data, control.lookahead = control.lookahead, None
+        if not txt_data:
+            control.eof = True
+            break
+
+        #With fast close the last segment carries the FIN (and the digest after its data, if it fits)
+        fin = False
+        if control.fast_close:
+            control.lookahead = txtfile.read(mss)
+            fin = not control.lookahead and (not control.digest or len(txt_data) + DIGEST_SIZE <= mss)
+
+        #Create packet to send Data
+        if control.digest:
+            control.digest.update(txt_data)
+        payload = bytes(txt_data) + control.digest.digest() if fin and control.digest else txt_data
+        segment = Segment(DATA, control.GlobalSeqNum, len(txt_data) + fin, control.fmt.create_header(DATA, control.GlobalSeqNum, payload, fin=fin),
+                          payload, time.monotonic(), fin=fin)
+        control.totalDataSent = control.totalDataSent + len(txt_data)
+        control.totalSegmentsSent = control.totalSegmentsSent + 1
+        if pacer:
+            pacer.consume(len(txt_data))
+        p_list.append(segment)
+        if not control.rto_timer.armed():
+            reset_timer(control)
+
+        seqnum = control.GlobalSeqNum
+        control.GlobalSeqNum = (control.GlobalSeqNum + segment.length) % control.fmt.max_seq
+        if fin:
+            control.finACK = control.GlobalSeqNum   #the final expected ACK number, for the data and the FIN
+            control.eof = True
+
+        #Simulate packet loss:
+        delays = simulate_packet_loss_flp(segment, control, log)
+        if not delays:
+            continue
+
+        #Log and Send
+        log.record(SND, DATA, seqnum, len(txt_data))
+        if fin:
+            log.record(SND, FIN, (seqnum + len(txt_data)) % control.fmt.max_seq, 0)
+        transmit(control, segment, delays)
+
+    if (control.rwnd is not None and control.rwnd < mss and control.SynAcked and not control.eof and not p_list.sent
+            and not control.persist_timer.armed()):
+        #Zero window and nothing in flight to bring an ACK that reopens it: probe it later
+        control.timers.arm(control.persist_timer, control.persist)
+
+    if control.eof and control.finACK is None and (not p_list.sent or control.fast_close):
+        #Every segment has been ACKed (or, with fast close, sent without room for the FIN): close the connection.
+        control.finACK = (control.GlobalSeqNum + 1)%control.fmt.max_seq #the final expected ACK number for FIN.
+        payload = control.digest.digest() if control.digest else b' '  #the receiver checks the data against the digest
+        fin = Segment(FIN, control.GlobalSeqNum, 1, control.fmt.create_header(FIN, control.GlobalSeqNum, payload), payload, time.monotonic())
+        p_list.append(fin)
+        log.record(SND, FIN, control.GlobalSeqNum, 0)
+        if not control.rto_timer.armed():
+            reset_timer(control)
+        transmit(control, fin, simulate_packet_loss_flp(fin, control, log))
+
+def run_sender(control, log, p_list, txtfile):
+    """
+    Event loop of the sender. The process blocks in the selector until either an ACK
+    arrives or the earliest timer in control.timers expires; window openings caused by
+    ACKs trigger new sends, so no time is spent spinning while waiting on the window.
+    Everything queued during one wakeup is flushed to the socket at its end.
+
+    Args:
+        control: class
+        log: file
+        p_list: class(Packet_list)
+        txtfile: file
 
-    listen = threading.Thread(target=listen_thread, args=(control,log,p_list))
-    listen.start() #start listening
+    Returns:
 
-    reset_timer(control, p_list, log) #start initial timer
+    """
+    control.socket.setblocking(False)
+    control.io.enable_gro()
+    selector = selectors.DefaultSelector()
+    selector.register(control.socket, selectors.EVENT_READ)
+    control.rto_timer = control.timers.timer(timer_expired, control, p_list, log)
+    control.pace_timer = control.timers.timer(pace_expired)
+    control.persist_timer = control.timers.timer(window_probe, control)
 
-    #
     #Generate ISN (Initial Seq Number)
-    ISN = random.randint(0, MAX_SEQ - 1)
-    control.ISN = ISN
-    GlobalSeqNum = (ISN + 1) % MAX_SEQ
+    control.ISN = random.randint(0, MAX_SEQ - 1)
 
     #Send Initial SYN to establish 2 way handshake
-    send_packet = create_packet(SYN, ISN, ' ')
-    p_list.sent.append(send_packet)
-    control.dataSent = 1000
-    log.write(f"snd 0.00 SYN {ISN} 0\n")
-    sock.send(send_packet)
-
+    syn = Segment(SYN, control.ISN, 1, LEGACY.create_header(SYN, control.ISN), encode_options(syn_options(control)), time.monotonic())
+    p_list.append(syn)
+    log.record(SND, SYN, control.ISN, 0, at=0)
+    reset_timer(control) #start initial timer
+    control.io.send(syn.header, syn.payload)
+    control.io.flush()
+
+    profile = control.profile
     while control.is_alive:
-        if control.dataSent < control.max_win and control.SynAcked:
-            control.dataSent = control.dataSent + 1000
-            txt_data = txtfile.read(1000) #read up to 1000 bytes from text file
-
-            if not txt_data:
-                #No more Data to send
-                while (totalDataSent != control.totalDataAcked - 1):
-                    #Waiting to receive ACKS for all previously sent segments before sending FIN
-                    continue
-
-                control.finACK = (GlobalSeqNum + 1)%MAX_SEQ #the final expected ACK number for FIN.
-                fin_packet = create_packet(FIN, GlobalSeqNum, ' ')
-                p_list.sent.append(fin_packet)
-                log.write(f"snd {round((time.time() - start_time)*1000,2)} FIN {GlobalSeqNum} 0\n")
-                sock.send(fin_packet)
-                while not control.terminate:
-                    #wait til ACK is recieved for FIN
-                    continue
-                break
+        ready = selector.select(control.timers.timeout())
+        woke = time.perf_counter()
+        if profile:
+            profile.enable()
+
+        if ready:
+            receive_acks(control, log, p_list)
+
+        if control.is_alive:
+            control.timers.run()
+
+        if control.is_alive:
+            send_segments(control, log, p_list, txtfile)
+
+        control.io.flush()
+        if profile:
+            profile.disable()
+        if control.metrics:
+            control.metrics.observe("wakeup_us", (time.perf_counter() - woke) * 1e6)
+
+    selector.close()
+
+def simulate_packet_loss_flp(segment, control, log):
+    """
+    Pass the forward packet through the emulated forward channel, logging it if dropped.
+
+    Args:
+        segment: class(Segment)
+        control: class
+        log: file
+
+    Returns:
+        tuple of delays in seconds, one per copy delivered (empty if dropped)
+    """
+    delays = control.forward.transmit(len(segment.header) + len(segment.payload))
+    if not delays:
+        log.record(DRP, segment.typeNum, segment.seq, segment.length - segment.fin if segment.typeNum == DATA else len(segment.payload))
+        if segment.fin:
+            log.record(DRP, FIN, (segment.seq + segment.length - 1) % control.fmt.max_seq, 0)
+        control.totalSegmentsDropped += 1
+    return delays
+
+def simulate_packet_loss_rlp(packet, control, log):
+    """
+    Pass the reverse packet through the emulated reverse channel, logging it if dropped.
+
+    Args:
+        packet: packet in Bytes
+        control: class
+        log: file
 
-            #Create packet to send Data
-            send_packet = create_packet(DATA, GlobalSeqNum, txt_data)
-            totalDataSent = totalDataSent + len(txt_data)
-            totalSegmentsSent = totalSegmentsSent + 1
+    Returns:
+        tuple of delays in seconds, one per copy delivered (empty if dropped)
+    """
+    delays = control.reverse.transmit(len(packet))
+    if not delays:
+        typeNum, acknum, length = decode_header(packet)
+        log.record(DRP, typeNum, acknum, length)
+        control.totalAcksDropped += 1
+    return delays
+
+def transmit(control, segment, delays):
+    """
+    Send a segment once per delay returned by the forward channel, later ones from the
+    timer queue. A channel set to corrupt packets may damage each copy.
 
-            if send_packet not in p_list.sent:
-                p_list.sent.append(send_packet)
+    Args:
+        control: class
+        segment: class(Segment)
+        delays: tuple of delays in seconds
 
-            #Simulate packet loss:
-            if simulate_packet_loss_flp(send_packet, control, log):
-                GlobalSeqNum =  (GlobalSeqNum + len(txt_data)) % MAX_SEQ
-                continue
+    Returns:
 
-            #Log and Send
-            log.write(f"snd {round((time.time() - start_time)*1000,2)} DATA {GlobalSeqNum} {len(txt_data)}\n")
-            GlobalSeqNum =  (GlobalSeqNum + len(txt_data)) % MAX_SEQ
-            sock.send(send_packet)
+    """
+    for delay in delays:
+        packet = (segment.header, segment.payload)
+        if control.forward.corrupt:
+            packet = control.forward.damage(*packet)
+        if delay:
+            control.timers.arm(control.timers.timer(control.io.send, *packet), delay)
+        else:
+            control.io.send(*packet)
 
 
+def sender_metrics(control, p_list):
+    """
+    Counters and gauges of the sender for a live metrics snapshot.
 
-    counter = Counter(control.AckList)
-    for count in counter.values():
-        if count > 1:
-            control.totalDupAcks += count - 1
+    Args:
+        control: class
+        p_list: class(Packet_list)
 
-    time.sleep(0.1)
-    log.write(f"\nOriginal data sent: {totalDataSent}\n")
+    Returns:
+        (counters dict, gauges dict)
+    """
+    counters = {"data_bytes_sent": control.totalDataSent, "data_bytes_acked": max(control.totalDataAcked - 1, 0),
+                "segments_sent": control.totalSegmentsSent, "retransmitted": control.totalRetransmitted,
+                "acks_received": control.totalAcksReceived, "dup_acks": control.totalDupAcks,
+                "data_dropped": control.totalSegmentsDropped, "acks_dropped": control.totalAcksDropped}
+    gauges = {"cwnd": control.cc.cwnd, "ssthresh": control.cc.ssthresh, "inflight": p_list.inflight,
+              "rto_ms": control.rto * 1000, "srtt_ms": control.srtt * 1000 if control.srtt is not None else None,
+              "recovering": control.recover is not None,
+              "pace_rate": control.pacer.rate if control.pacer else None, "rwnd": control.rwnd}
+    return counters, gauges
+
+def send_file(sendport, recvport, txtfilename, max_win, rto, flp, rlp, options, logname="Sender_log.txt", offset=0, length=None, log_start=None):
+    """
+    Run one transfer: send txtfilename, or only its byte range [offset, offset + length)
+    as one flow of a parallel transfer, to the receiver on recvport and write the log.
+
+    Args:
+        sendport, recvport, txtfilename, max_win, rto, flp, rlp: parsed arguments
+        options: dict (parsed options)
+        logname: str
+        offset: int
+        length: int (None = to the end of the file)
+        log_start: int (time.monotonic_ns() shared by the flows of a parallel transfer)
+
+    Returns:
+        (bytes acked, ns of the SYN, ns the FIN was ACKed), times from time.monotonic_ns()
+    """
+    #Open files
+    log = EventLog(logname, options["log_level"], start=log_start)
+    if options["streams"]:
+        txtfile = StreamSource(txtfilename, options["streams"], min(options["mss"], max_win))
+    else:
+        txtfile = open(txtfilename, "rb")
+        if options["mmap"]:
+            try:
+                txtfile = MappedFile(txtfile, offset, length)
+            except ValueError:
+                pass    #empty files cannot be mapped, read them normally
+        if length is not None and not isinstance(txtfile, MappedFile):
+            txtfile = FileRange(txtfile, offset, length)
+
+    start_time = time.time()
+    sock = setup_socket(sendport, recvport)
+    control = Control(localhost, sendport, recvport, txtfilename, max_win, rto, flp, rlp, sock, start_time)
+    control.io = BatchSocket(sock, options["batch"])
+    seed = options["seed"] if options["seed"] >= 0 else None
+    control.forward = parse_channel(options["channel"], flp, None if seed is None else f"{seed}/forward")
+    control.reverse = parse_channel(options["reverse_channel"], rlp, None if seed is None else f"{seed}/reverse")
+    control.adaptive_rto = options["adaptive_rto"]
+    control.min_rto = options["min_rto"] / 1000
+    control.timer_stats = options["timer_stats"]
+    control.cc = congestion.create(options["cc"], MSS, max_win)
+    control.sack = options["sack"]
+    control.seq32 = options["seq32"]
+    control.mss = min(options["mss"], max_win)
+    control.streams = options["streams"] > 0
+    control.flow_control = options["rwnd"]
+    control.fast_close = options["fast_close"]
+    control.offset = offset if length is not None else None
+    control.resume = options["resume"]
+    control.checksum = options["checksum"]
+    control.txtfile = txtfile
+    if options["compress"] != "none":
+        txtfile = control.compressor = Compressor(txtfile, options["compress"], options["compress_level"])
+    p_list = Packet_list() #send window, used to keep track of oldest packets.
+    if options["metrics"]:
+        control.metrics = Metrics("sender", options["metrics"], options["metrics_interval"], control.timers,
+                                  lambda: sender_metrics(control, p_list))
+    if options["profile"]:
+        control.profile = cProfile.Profile()
+    if options["pace"] or options["pace_rate"]:
+        control.pacer = Pacer(options["pace"], options["pace_rate"] * 1e6 / 8)
+
+    started = time.monotonic_ns()
+    run_sender(control, log, p_list, txtfile)
+    finished = time.monotonic_ns()
+
+    if control.metrics:
+        control.metrics.close()
+    if control.profile:
+        control.profile.dump_stats(options["profile"])
+
+    log.write(f"\nOriginal data sent: {control.totalDataSent}\n")
     log.write(f"Original data acked: {control.totalDataAcked - 1}\n")
-    log.write(f"Original segments sent: {totalSegmentsSent}\n")
+    log.write(f"Original segments sent: {control.totalSegmentsSent}\n")
     log.write(f"Retransmitted segments: {control.totalRetransmitted}\n")
     log.write(f"Dup acks received: {control.totalDupAcks}\n")
     log.write(f"Data segments dropped: {control.totalSegmentsDropped}\n")
     log.write(f"Ack segments dropped: {control.totalAcksDropped}\n")
-
-    control.timer.cancel()
-    listen.join()
+    if control.timer_stats:
+        log.write(control.timers.stats())
+    if control.io.batch:
+        log.write(control.io.stats())
+    if control.streams:
+        log.write(f"Streams sent: {txtfile.nextStream}\n")
+        log.write(f"Stream file data sent: {txtfile.fileBytes}\n")
+    if control.resumed is not None:
+        log.write(f"Resumed at byte: {control.resumed}\n")
+    if control.compressor:
+        log.write(control.compressor.stats())
+    if control.fmt.checksum:
+        log.write(f"Corrupted acks dropped: {control.totalCorruptAcks}\n")
+    if control.totalWindowProbes:
+        log.write(f"Zero window probes: {control.totalWindowProbes}\n")
+    if control.pacer:
+        log.write(control.pacer.stats())
+    if options["channel"]:
+        log.write(control.forward.stats("Forward"))
+    if options["reverse_channel"]:
+        log.write(control.reverse.stats("Reverse"))
+
+    txtfile.close()
     log.close()
     control.socket.close()
+    return control.totalDataAcked - 1, started, finished
+
+def flow_options(options, flow):
+    """
+    Options of one flow of a parallel transfer: its own seed, metrics target and profile.
+
+    Args:
+        options: dict (parsed options)
+        flow: int
+
+    Returns:
+        dict
+    """
+    options = dict(options)
+    if options["seed"] >= 0:
+        options["seed"] += flow
+    for name in ("metrics", "profile"):
+        if options[name]:
+            options[name] += f".{flow}"
+    return options
+
+def send_parallel(sendport, recvport, txtfilename, max_win, rto, flp, rlp, options):
+    """
+    Split the file into options["parallel"] byte ranges and send each one as a separate
+    flow, in a pool of processes, from consecutive ports starting at sendport to
+    consecutive ports starting at recvport. The logs of the flows are merged into
+    Sender_log.txt with a throughput report.
 
+    Args:
+        sendport, recvport, txtfilename, max_win, rto, flp, rlp: parsed arguments
+        options: dict (parsed options)
 
+    Returns:
+
+    """
+    flows = options["parallel"]
+    size = os.path.getsize(txtfilename)
+    stripe = -(-size // flows)
+    log_start = time.monotonic_ns()
+    jobs = [(sendport + i, recvport + i, txtfilename, max_win, rto, flp, rlp, flow_options(options, i), f"Sender_log.{i}.txt",
+             min(i * stripe, size), max(min(stripe, size - i * stripe), 0), log_start) for i in range(flows)]
+
+    with multiprocessing.Pool(flows, initializer=random.seed) as pool:
+        results = pool.starmap(send_file, jobs)
+    merge_logs([job[8] for job in jobs], "Sender_log.txt", parallel_report(results))
+
+
+if __name__ == "__main__":
+    #Parse arguments
+    sendport = parse_port(sys.argv[1])
+    recvport = parse_port(sys.argv[2])
+    txtfilename = sys.argv[3]
+    max_win = parse_max_win(sys.argv[4])
+    rto = parse_rto(sys.argv[5])/1000
+    flp = parse_lp(sys.argv[6])
+    rlp = parse_lp(sys.argv[7])
+    options = parse_options(sys.argv[8:], OPTIONS)
+
+    if options["log_level"] not in LEVELS:
+        sys.exit(f"Invalid log-level option, must be one of {', '.join(LEVELS)}: {options['log_level']}")
+    if options["cc"] not in congestion.ALGORITHMS:
+        sys.exit(f"Invalid cc option, must be one of {', '.join(congestion.ALGORITHMS)}: {options['cc']}")
+    if not (1 <= options["mss"] <= MAX_MSS):
+        sys.exit(f"Invalid mss option, must be between 1 and {MAX_MSS}: {options['mss']}")
+
+    if options["pace_rate"] < 0:
+        sys.exit(f"Invalid pace-rate option, must be greater than or equal to 0: {options['pace_rate']}")
+    if options["metrics_interval"] <= 0:
+        sys.exit(f"Invalid metrics-interval option, must be greater than 0: {options['metrics_interval']}")
+
+    if options["compress"] != "none" and options["compress"] not in CODECS:
+        sys.exit(f"Invalid compress option, must be one of none, {', '.join(CODECS)}: {options['compress']}")
+    if not (0 <= options["compress_level"] <= 9):
+        sys.exit(f"Invalid compress-level option, must be between 0 and 9: {options['compress_level']}")
+    if options["streams"] and options["resume"]:
+        sys.exit("Invalid options, --streams cannot be combined with --resume")
+    if options["streams"] and options["compress"] != "none":
+        sys.exit("Invalid options, --streams cannot be combined with --compress")
+
+    #Validate the channel specs before anything is sent
+    parse_channel(options["channel"])
+    parse_channel(options["reverse_channel"])
+
+    if options["parallel"] > 1:
+        if options["streams"]:
+            sys.exit("Invalid options, --parallel cannot be combined with --streams")
+        if options["resume"]:
+            sys.exit("Invalid options, --parallel cannot be combined with --resume")
+        parse_port(sendport + options["parallel"] - 1)
+        parse_port(recvport + options["parallel"] - 1)
+        send_parallel(sendport, recvport, txtfilename, max_win, rto, flp, rlp, options)
+    else:
+        send_file(sendport, recvport, txtfilename, max_win, rto, flp, rlp, options)
@@ -0,0 +1,358 @@
+"""
+Definitions shared by sender.py and receiver.py: segment types and the packet format.
+
+Every packet starts with a fixed 4 byte header, two unsigned shorts in network order
+(type, sequence/ACK number), followed by the raw payload bytes. Payloads are never
+encoded or decoded, so any file (text or binary) can be transferred. When 32-bit
+sequence numbers are negotiated the header grows to 6 bytes (unsigned short type with
+FLAG_SEQ32 set, unsigned int sequence/ACK number). When the receiver advertises its
+window, ACKs set FLAG_WINDOW and carry the window (WINDOW_FIELD) right after the header.
+When checksums are negotiated, every packet after the handshake sets FLAG_CHECKSUM and
+carries a CRC-32 (CHECKSUM_FIELD) next, computed over the rest of the packet; the FIN then
+carries the SHA-256 digest of all the data of the connection instead of a single space.
+With fast close, the last data segment sets FLAG_FIN instead of being followed by a FIN
+packet, and carries the digest (if any) after its data.
+
+Optional features are negotiated on the SYN: the sender lists the options it wants in
+the SYN payload and the receiver answers with the ones it accepted in the payload of the
+ACK for the SYN. Options only take effect when both sides agree, so either program
+keeps interoperating with a peer that does not know them.
+"""
+import struct
+import sys
+import zlib
+
+localhost = "127.0.0.1"
+MSS = 1000 #Max payload a data segment can carry
+MAX_SEQ = ((2**16))
+
+DataType = {
+    0: "DATA",
+    1: "ACK",
+    2: "SYN",
+    3: "FIN",
+    4: "RST"
+}
+
+DATA = 0
+ACK = 1
+SYN = 2
+FIN = 3
+RST = 4 #Receiver has no connection for the packet (server mode), the sender gives up
+
+HEADER = struct.Struct("!HH") #preallocated header packer: type, seqnum
+HEADER_SIZE = HEADER.size
+BUF_SIZE = HEADER_SIZE + MSS #Max data segment can be
+
+#Header variant with 32-bit sequence numbers, flagged in the type field
+SEQ32_HEADER = struct.Struct("!HI")
+FLAG_SEQ32 = 0x100
+TYPE_MASK = 0xff
+MAX_SEQ32 = ((2**32))
+#Advertised window of the receiver, after the header of an ACK flagged in the type field
+WINDOW_FIELD = struct.Struct("!I")
+FLAG_WINDOW = 0x200
+#CRC-32 of the packet, after the header and the window if any, flagged in the type field
+CHECKSUM_FIELD = struct.Struct("!I")
+FLAG_CHECKSUM = 0x400
+#The last data segment carries the FIN (fast close), the FIN takes the sequence number after its data
+FLAG_FIN = 0x800
+DIGEST_SIZE = 32 #SHA-256 of the data, carried by the FIN when checksums are negotiated
+MAX_UDP_PAYLOAD = 65507 #Largest UDP datagram payload over IPv4 (and loopback)
+MAX_MSS = MAX_UDP_PAYLOAD - SEQ32_HEADER.size - CHECKSUM_FIELD.size
+MAX_MSS16 = MAX_SEQ // 8 #Largest MSS with 16-bit sequence numbers: a window (half the sequence space) holds 4 segments
+
+#Options negotiated in the SYN payload
+OPT_SACK = "sack"           #Receiver reports buffered out-of-order ranges in the ACK payload
+OPT_SEQ32 = "seq32"         #32-bit sequence numbers after the handshake
+OPT_MSS = "mss"             #Max payload of a data segment (value: bytes)
+OPT_STREAMS = "streams"     #Data segments carry a stream header, one stream per file (see streams.py)
+OPT_OFFSET = "offset"       #The data belongs at this file offset (value: bytes), one flow of a parallel transfer
+OPT_RWND = "rwnd"           #ACKs advertise the receiver's window (value in the SYN ACK: the initial window)
+OPT_CHECKSUM = "checksum"   #Packets carry a checksum, the FIN a digest of the data
+OPT_CLOSE = "close"         #Fast close: the last data segment carries the FIN, the sender confirms its ACK (value in the SYN: the sender's RTO in ms)
+OPT_COMPRESS = "compress"   #The data is a stream of compressed frames (value: codec, see compression.py)
+OPT_RESUME = "resume"       #Send only what the receiver's checkpoint lacks (value in the SYN ACK: offset:digest, see checkpoint.py)
+
+SACK_BLOCK = struct.Struct("!HH") #start, end (exclusive) of a received range
+SACK32_BLOCK = struct.Struct("!II")
+MAX_SACK_BLOCKS = 8
+
+STREAM_HEADER = struct.Struct("!BIQ") #kind, stream id, file offset (STREAM_DATA) or file size (STREAM_OPEN)
+STREAM_DATA = 0                       #followed by file data
+STREAM_OPEN = 1                       #followed by the file name (UTF-8)
+
+FRAME_HEADER = struct.Struct("!BI") #codec (FRAME_RAW for uncompressed data), body length, of a compressed frame
+
+class PacketFormat:
+    """
+    Packet layout of one connection, as negotiated on the SYN: the header variant,
+    the size of the sequence space and the MSS. SYNs and their ACKs always use the
+    legacy 4 byte header (LEGACY), so they can be exchanged before anything is agreed.
+    """
+
+    def __init__(self, seq32=False, mss=MSS, checksum=False):
+        self.seq32 = seq32
+        self.mss = mss
+        self.checksum = checksum
+        self.header = SEQ32_HEADER if seq32 else HEADER
+        self.header_size = self.header.size + (CHECKSUM_FIELD.size if checksum else 0)
+        self.flag = (FLAG_SEQ32 if seq32 else 0) | (FLAG_CHECKSUM if checksum else 0)
+        self.max_seq = MAX_SEQ32 if seq32 else MAX_SEQ
+        self.max_win = self.max_seq // 2 #Largest window: the sequence numbers in flight and those just ACKed never collide
+        self.sack_block = SACK32_BLOCK if seq32 else SACK_BLOCK
+        self.buf_size = self.header_size + mss #Max data segment can be
+
+    def create_packet(self, typeNum, seqnum, data=b'', window=None, fin=False):
+        """
+        create packet in necessary format to send through socket.
+
+        Args:
+            typeNum: int
+            seqnum: int
+            data: bytes-like payload
+            window: int (advertised window carried by an ACK, None for none)
+            fin: bool (a DATA segment carrying the FIN)
+
+        Returns:
+            packet (Bytes)
+        """
+        return self.create_header(typeNum, seqnum, data, window, fin) + data
+
+    def create_header(self, typeNum, seqnum, payload=b'', window=None, fin=False):
+        """
+        create only the header of a packet (with its window and checksum fields), for sending
+        it with the payload as a separate buffer.
+
+        Args:
+            typeNum: int
+            seqnum: int
+            payload: bytes-like (covered by the checksum)
+            window: int (advertised window carried by an ACK, None for none)
+            fin: bool (a DATA segment carrying the FIN)
+
+        Returns:
+            header (Bytes)
+        """
+        # Ensure typeNum and seqnum are within the valid range
+        typeNum = min(max(typeNum, 0), 4) | self.flag
+        if fin:
+            typeNum |= FLAG_FIN
+
+        if window is None:
+            header = self.header.pack(typeNum, seqnum % self.max_seq)
+        else:
+            header = self.header.pack(typeNum | FLAG_WINDOW, seqnum % self.max_seq) + WINDOW_FIELD.pack(window)
+        if self.checksum:
+            header += CHECKSUM_FIELD.pack(zlib.crc32(payload, zlib.crc32(header)))
+        return header
+
+    def valid(self, packet_data):
+        """
+        Check the checksum of a received packet. Once checksums are negotiated, a packet
+        without one is only accepted as a SYN (always sent with the legacy header).
+
+        Args:
+            packet_data: packet in Bytes
+
+        Returns:
+            bool (always True if checksums were not negotiated)
+        """
+        if not self.checksum:
+            return True
+        typeNum, seqnum = HEADER.unpack_from(packet_data)
+        if not typeNum & FLAG_CHECKSUM:
+            return typeNum == SYN
+        size = SEQ32_HEADER.size if typeNum & FLAG_SEQ32 else HEADER_SIZE
+        if typeNum & FLAG_WINDOW:
+            size += WINDOW_FIELD.size
+        if len(packet_data) < size + CHECKSUM_FIELD.size:
+            return False
+        view = memoryview(packet_data)
+        return CHECKSUM_FIELD.unpack_from(view, size)[0] == zlib.crc32(view[size + CHECKSUM_FIELD.size:], zlib.crc32(view[:size]))
+
+    def pack_sack(self, blocks):
+        """
+        Encode SACK blocks as the payload of an ACK.
+
+        Args:
+            blocks: list of (start, end) sequence numbers, end exclusive
+
+        Returns:
+            payload (Bytes)
+        """
+        return b''.join(self.sack_block.pack(start % self.max_seq, end % self.max_seq) for start, end in blocks)
+
+    def unpack_sack(self, payload):
+        """
+        decode the SACK blocks carried in the payload of an ACK
+
+        Args:
+            payload: bytes-like
+
+        Returns:
+            list of (start, end) sequence numbers, end exclusive
+        """
+        size = self.sack_block.size
+        return list(self.sack_block.iter_unpack(payload[:len(payload) - len(payload) % size]))
+
+LEGACY = PacketFormat()
+
+def create_packet(typeNum, seqnum, data=b''):
+    """
+    create packet with the legacy 4 byte header (used for the handshake).
+
+    Args:
+        typeNum: int
+        seqnum: int
+        data: bytes-like payload
+
+    Returns:
+        packet (Bytes)
+    """
+    return LEGACY.create_packet(typeNum, seqnum, data)
+
+def decode_header(packet_data):
+    """
+    Parse only the header of the given packet, the payload is left untouched.
+    Either header variant is recognised from the flag in the type field.
+
+    Args:
+        packet_data: packet in Bytes
+
+    Returns:
+        typeNum: int
+        seqnum: int
+        length: int (payload length)
+    """
+    typeNum, seqnum = HEADER.unpack_from(packet_data)
+    size = HEADER_SIZE
+    if typeNum & FLAG_SEQ32:
+        typeNum, seqnum = SEQ32_HEADER.unpack_from(packet_data)
+        size = SEQ32_HEADER.size
+    if typeNum & FLAG_WINDOW:
+        size += WINDOW_FIELD.size
+    if typeNum & FLAG_CHECKSUM:
+        size += CHECKSUM_FIELD.size
+    return typeNum & TYPE_MASK, seqnum, len(packet_data) - size
+
+def decode_packet(packet_data):
+    """
+    decode the given packet from bytes to necessary information
+
+    Args:
+        packet_data: packet in Bytes
+
+    Returns:
+        typeNum: int
+        seqnum: int
+        data: memoryview of the payload (no copy)
+    """
+    typeNum, seqnum = HEADER.unpack_from(packet_data)
+    size = HEADER_SIZE
+    if typeNum & FLAG_SEQ32:
+        typeNum, seqnum = SEQ32_HEADER.unpack_from(packet_data)
+        size = SEQ32_HEADER.size
+    if typeNum & FLAG_WINDOW:
+        size += WINDOW_FIELD.size
+    if typeNum & FLAG_CHECKSUM:
+        size += CHECKSUM_FIELD.size
+    return typeNum & TYPE_MASK, seqnum, memoryview(packet_data)[size:]
+
+def decode_window(packet_data):
+    """
+    decode the window advertised in an ACK
+
+    Args:
+        packet_data: packet in Bytes
+
+    Returns:
+        int (bytes), None if the packet carries no window
+    """
+    typeNum, seqnum = HEADER.unpack_from(packet_data)
+    if not typeNum & FLAG_WINDOW:
+        return None
+    return WINDOW_FIELD.unpack_from(packet_data, SEQ32_HEADER.size if typeNum & FLAG_SEQ32 else HEADER_SIZE)[0]
+
+def decode_fin(packet_data):
+    """
+    Check whether a DATA segment carries the FIN.
+
+    Args:
+        packet_data: packet in Bytes
+
+    Returns:
+        bool
+    """
+    return bool(HEADER.unpack_from(packet_data)[0] & FLAG_FIN)
+
+def encode_options(options):
+    """
+    Encode the connection options offered in a SYN (or accepted in its ACK) as the payload.
+    Options are plain ASCII ("sack,mss=1400") so receivers that ignore the SYN payload
+    keep working; with no options the legacy single space payload is used.
+
+    Args:
+        options: dict mapping option name to value ('' for on/off options)
+
+    Returns:
+        payload (Bytes)
+    """
+    if not options:
+        return b' '
+    return ",".join(f"{name}={value}" if value != '' else name for name, value in options.items()).encode('ascii')
+
+def decode_options(payload):
+    """
+    decode the options carried in a SYN or SYN ACK payload
+
+    Args:
+        payload: bytes-like
+
+    Returns:
+        dict mapping option name to value ('' for on/off options)
+    """
+    options = {}
+    for item in bytes(payload).decode('ascii', errors='ignore').split(","):
+        name, sep, value = item.strip().partition("=")
+        if name:
+            options[name] = value
+    return options
+
+def parse_options(args, defaults):
+    """
+    Parse the optional arguments following the positional ones. Options take the form
+    --name=value, or just --name for on/off flags. The type of each option is taken from
+    its default value.
+
+    Args:
+        args: list of strings from argv
+        defaults: dict mapping option name (with underscores) to its default value
+
+    Returns:
+        dict of option name -> value
+    """
+    options = dict(defaults)
+    for arg in args:
+        if not arg.startswith("--"):
+            sys.exit(f"Invalid option, must start with --: {arg}")
+
+        name, sep, value = arg[2:].partition("=")
+        name = name.replace("-", "_")
+        if name not in defaults:
+            sys.exit(f"Unknown option: {arg}")
+
+        default = defaults[name]
+        if isinstance(default, bool):
+            if sep and value not in ("0", "1"):
+                sys.exit(f"Invalid option value, must be 0 or 1: {arg}")
+            options[name] = (value != "0")
+            continue
+        if not sep:
+            sys.exit(f"Missing option value: {arg}")
+        try:
+            options[name] = value if default is None or isinstance(default, str) else type(default)(value)
+        except ValueError:
+            sys.exit(f"Invalid option value, must be numerical: {arg}")
+
+    return options
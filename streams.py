@@ -0,0 +1,137 @@
+"""
+Multi-stream transfers: many files over one STP association.
+
+The association keeps a single sequence space, so the send window, ACKs, retransmission
+and congestion control work exactly as for one file. Each file is a stream with its own
+id and its own sequence space (the byte offset within the file); every data segment of
+the association starts with a stream header (STREAM_HEADER) naming the stream and the
+offset of the bytes it carries. A stream begins with a STREAM_OPEN segment carrying the
+file size and name.
+
+The receiver writes every newly received segment straight to its file at its offset, so
+a gap in one stream (or in the association) never holds back the others, and closes
+each file as soon as all of its bytes have arrived.
+"""
+import os
+import sys
+from collections import deque
+
+from stp import STREAM_HEADER, STREAM_DATA, STREAM_OPEN
+
+
+class StreamSource:
+    """
+    Sender side: the files to send, served to the sender as a single sequence of segment
+    payloads through read(), interleaving up to `concurrency` open streams round-robin.
+    """
+
+    def __init__(self, path, concurrency, mss):
+        if os.path.isdir(path):
+            names = sorted(os.path.relpath(os.path.join(root, name), path)
+                           for root, dirs, files in os.walk(path) for name in files)
+            self.files = deque((os.path.join(path, name), name) for name in names)
+        else:
+            self.files = deque([(path, os.path.basename(path))])
+        for filename, name in self.files:
+            if STREAM_HEADER.size + len(name.encode('utf-8')) >= mss:
+                sys.exit(f"Invalid file name, too long for the mss: {name}")
+
+        self.concurrency = concurrency
+        self.active = deque()       #[stream id, file, offset] of the open streams
+        self.nextStream = 0         #Id of the next stream opened
+        self.fileBytes = 0          #File data bytes read, for the stats
+
+    def read(self, size):
+        """
+        Return the payload of the next segment, at most size bytes: the opening of the
+        next file while fewer than concurrency streams are open, otherwise the next chunk
+        of the oldest open stream.
+
+        Args:
+            size: int
+
+        Returns:
+            payload (Bytes), empty once every file has been sent
+        """
+        if self.files and len(self.active) < self.concurrency:
+            filename, name = self.files.popleft()
+            stream = self.nextStream
+            self.nextStream += 1
+            file = open(filename, "rb")
+            self.active.append([stream, file, 0])
+            return STREAM_HEADER.pack(STREAM_OPEN, stream, os.fstat(file.fileno()).st_size) + name.encode('utf-8')
+
+        while self.active:
+            entry = self.active.popleft()
+            stream, file, offset = entry
+            data = file.read(size - STREAM_HEADER.size)
+            if not data:
+                file.close()
+                return self.read(size)
+            entry[2] += len(data)
+            self.active.append(entry)
+            self.fileBytes += len(data)
+            return STREAM_HEADER.pack(STREAM_DATA, stream, offset) + data
+        return b''
+
+    def close(self):
+        for stream, file, offset in self.active:
+            file.close()
+        self.active.clear()
+
+
+class StreamSink:
+    """Receiver side: writes each stream to its own file below directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.streams = {}           #stream id -> [fd, size (None until opened), bytes received]
+        self.completed = 0          #Streams fully received, for the stats
+
+    def _path(self, name):
+        """Path of a file received as name, kept inside directory."""
+        name = os.path.normpath(name)
+        if os.path.isabs(name) or name.startswith(os.pardir):
+            name = os.path.basename(name)
+        return os.path.join(self.directory, name)
+
+    def deliver(self, payload):
+        """
+        Handle the payload of a data segment received for the first time, in any order.
+
+        Args:
+            payload: bytes-like (stream header and data)
+
+        Returns:
+
+        """
+        kind, stream, value = STREAM_HEADER.unpack_from(payload)
+        data = memoryview(payload)[STREAM_HEADER.size:]
+        temp = os.path.join(self.directory, f".stream-{stream}")
+
+        entry = self.streams.get(stream)
+        if entry is None:
+            #Data may overtake the opening of its stream, collect it under a temporary name
+            entry = self.streams[stream] = [os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), None, 0]
+
+        if kind == STREAM_OPEN:
+            path = self._path(bytes(data).decode('utf-8', errors='replace'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp, path)
+            os.ftruncate(entry[0], value)
+            entry[1] = value
+        else:
+            os.pwrite(entry[0], data, value)
+            entry[2] += len(data)
+
+        if entry[1] is not None and entry[2] >= entry[1]:
+            os.close(entry[0])
+            del self.streams[stream]
+            self.completed += 1
+
+    def close(self):
+        """Close the files of streams that were not completed."""
+        for fd, size, received in self.streams.values():
+            os.close(fd)
+        self.streams.clear()
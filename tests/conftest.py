@@ -0,0 +1,5 @@
+import os
+import sys
+
+#The programs are flat scripts at the top of the repository, import them from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,68 @@
+import pytest
+
+from channel import Channel, parse_channel, NOW, LOST
+
+
+def decisions(channel, count=2000, size=1000):
+    return [channel.transmit(size, now=i * 0.001) for i in range(count)]
+
+
+def test_same_seed_same_decisions():
+    spec = "loss=0.1,ge=0.01/0.3/0.9,delay=20,jitter=5,reorder=0.05,duplicate=0.02"
+    first = decisions(parse_channel(spec, seed="7/forward"))
+    assert first == decisions(parse_channel(spec, seed="7/forward"))
+    assert first != decisions(parse_channel(spec, seed="7/reverse"))
+
+def test_seed_in_the_spec_wins():
+    assert decisions(parse_channel("seed=3,loss=0.2", seed=1)) == decisions(parse_channel("loss=0.2", seed=3))
+
+def test_iid_loss_matches_its_probability():
+    channel = parse_channel("", 0.25, seed=1)
+    outcomes = decisions(channel, 20000)
+    assert set(outcomes) == {NOW, LOST}
+    assert channel.lost == outcomes.count(LOST)
+    assert 0.23 < channel.lost / 20000 < 0.27
+
+def test_gilbert_elliott_losses_come_in_bursts():
+    channel = parse_channel("ge=0.02/0.2", seed=5)
+    lost = [delays == LOST for delays in decisions(channel, 20000)]
+    runs = [1]
+    for previous, current in zip(lost, lost[1:]):
+        if current and previous:
+            runs[-1] += 1
+        elif current:
+            runs.append(1)
+    assert sum(runs) / len(runs) > 3    #mean burst length 1/R = 5 packets
+
+def test_delay_and_jitter_bound_the_delivery_time():
+    channel = parse_channel("delay=20,jitter=5", seed=2)
+    delays = [delay for copies in decisions(channel) for delay in copies]
+    assert all(0.015 <= delay <= 0.025 for delay in delays)
+    assert len(set(delays)) > 100
+
+def test_duplicates_and_reordering_are_counted():
+    channel = parse_channel("delay=10,duplicate=0.1,reorder=0.1", seed=4)
+    outcomes = decisions(channel)
+    assert channel.duplicated == sum(len(copies) == 2 for copies in outcomes) > 0
+    assert channel.reordered == sum(delay == 0.0 for copies in outcomes for delay in copies) > 0
+
+def test_rate_limit_serialises_packets_and_tail_drops():
+    channel = Channel(rate=8, queue=5000)      #1 MB/s: 1 ms per 1000 byte packet
+    outcomes = [channel.transmit(1000, now=0.0) for i in range(10)]
+    assert [list(copies) for copies in outcomes[:6]] == [[pytest.approx(0.001 * (i + 1))] for i in range(6)]
+    assert outcomes[6:] == [LOST] * 4
+    assert channel.queueDrops == 4
+
+def test_damage_flips_one_bit():
+    channel = Channel(corrupt=1.0, seed=9)
+    packet = bytes(range(200))
+    damaged, = channel.damage(packet[:50], packet[50:])
+    assert len(damaged) == len(packet)
+    assert sum(bin(a ^ b).count("1") for a, b in zip(packet, damaged)) == 1
+    assert channel.corrupted == 1
+    assert Channel(corrupt=0.0).damage(b'ab', b'cd') == (b'ab', b'cd')
+
+@pytest.mark.parametrize("spec", ["loss=2", "bogus=1", "delay", "delay=x", "ge=0.1", "ge=0.1/2"])
+def test_invalid_specs_are_rejected(spec):
+    with pytest.raises(SystemExit):
+        parse_channel(spec)
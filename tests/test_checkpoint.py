@@ -0,0 +1,101 @@
+import hashlib
+import json
+import random
+
+import pytest
+
+import checkpoint
+from checkpoint import Checkpoint, PrefixDigest, file_digest
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(checkpoint, "BLOCK", 16)
+
+def chained(data, block=16):
+    """Digest of the complete blocks of data, computed the long way."""
+    digest = b''
+    for start in range(0, len(data) - len(data) % block, block):
+        digest = hashlib.sha256(digest + data[start:start + block]).digest()
+    return digest
+
+
+def test_digest_is_chained_over_complete_blocks():
+    data = random.Random(1).randbytes(100)
+    prefix = PrefixDigest()
+    prefix.update(data)
+    assert prefix.offset == 96
+    assert prefix.partial == 4
+    assert prefix.digest == chained(data)
+
+def test_digest_does_not_depend_on_how_the_data_is_split():
+    data = random.Random(2).randbytes(200)
+    rng = random.Random(3)
+    prefix = PrefixDigest()
+    start = 0
+    while start < len(data):
+        size = rng.randrange(0, 40)
+        prefix.update(data[start:start + size])
+        start += size
+    assert (prefix.offset, prefix.digest) == (192, chained(data))
+
+def test_digest_resumes_from_a_saved_state():
+    data = random.Random(4).randbytes(160)
+    first = PrefixDigest()
+    first.update(data[:70])
+    resumed = PrefixDigest(first.offset, first.digest)
+    resumed.update(data[first.offset:])
+    assert (resumed.offset, resumed.digest) == (160, chained(data))
+
+def test_file_digest(tmp_path):
+    data = random.Random(5).randbytes(50)
+    (tmp_path / "f").write_bytes(data)
+    assert file_digest(str(tmp_path / "f"), 48) == chained(data)
+    assert file_digest(str(tmp_path / "f"), 0) == b''
+    assert file_digest(str(tmp_path / "f"), 64) is None    #shorter than the prefix
+
+def test_checkpoint_round_trip(tmp_path):
+    data = random.Random(6).randbytes(40)
+    output = tmp_path / "out"
+    output.write_bytes(data)
+    saved = Checkpoint(str(output))
+    saved.prefix.update(data)
+    with open(output, "ab") as file:
+        saved.save(file, force=True)
+    assert json.loads((tmp_path / "out.ckpt").read_text()) == {"offset": 32, "sha256": chained(data).hex()}
+
+    loaded = Checkpoint(str(output))
+    assert loaded.load() == 32
+    assert loaded.value() == f"32:{chained(data).hex()}"
+    assert (loaded.prefix.offset, loaded.prefix.digest) == (32, chained(data))
+
+    loaded.remove()
+    assert not (tmp_path / "out.ckpt").exists()
+    loaded.remove()     #already gone
+
+def test_save_waits_for_the_interval_and_new_data(tmp_path):
+    output = tmp_path / "out"
+    output.write_bytes(b'')
+    ckpt = Checkpoint(str(output))
+    with open(output, "ab") as file:
+        ckpt.save(file, force=True)
+        assert not (tmp_path / "out.ckpt").exists()   #nothing to save yet
+        ckpt.prefix.update(bytes(16))
+        ckpt.save(file)
+        assert not (tmp_path / "out.ckpt").exists()   #saved less than SAVE_INTERVAL ago
+        ckpt.savedAt -= checkpoint.SAVE_INTERVAL
+        ckpt.save(file)
+    assert ckpt.saved == 16
+    assert (tmp_path / "out.ckpt").exists()
+
+@pytest.mark.parametrize("state", ['not json', '{"offset": 16}', '{"offset": 10, "sha256": ""}',
+                                   '{"offset": 48, "sha256": ""}', '{"offset": 16, "sha256": "zz"}', '[]'])
+def test_invalid_checkpoints_restart_from_the_beginning(tmp_path, state):
+    (tmp_path / "out").write_bytes(bytes(32))
+    (tmp_path / "out.ckpt").write_text(state)
+    ckpt = Checkpoint(str(tmp_path / "out"))
+    assert ckpt.load() == 0
+    assert ckpt.value() == "0:"
+
+def test_missing_checkpoint(tmp_path):
+    assert Checkpoint(str(tmp_path / "out")).load() == 0
@@ -0,0 +1,85 @@
+import io
+import random
+
+import pytest
+
+import compression
+from compression import Compressor, Decompressor, FRAME_RAW, MAX_SKIP
+from stp import FRAME_HEADER
+
+
+def read_all(compressor, size):
+    chunks = []
+    while True:
+        chunk = compressor.read(size)
+        if not chunk:
+            return chunks
+        assert len(chunk) <= size
+        chunks.append(chunk)
+
+def round_trip(data, codec, size=1000, level=6):
+    compressor = Compressor(io.BytesIO(data), codec, level)
+    decompressor = Decompressor(codec)
+    output = b''.join(block for chunk in read_all(compressor, size) for block in decompressor.feed(chunk))
+    return compressor, decompressor, output
+
+def frame_kinds(stream):
+    kinds = []
+    start = 0
+    while start < len(stream):
+        kind, length = FRAME_HEADER.unpack_from(stream, start)
+        kinds.append(kind)
+        start += FRAME_HEADER.size + length
+    return kinds
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_round_trip(codec):
+    data = b''.join(f"line {i} of some text\n".encode() for i in range(20000))
+    compressor, decompressor, output = round_trip(data, codec)
+    assert output == data
+    assert compressor.rawBytes == decompressor.rawBytes == len(data)
+    assert compressor.compressedBytes < len(data) // 5
+    assert compressor.bypassed == 0
+    assert not decompressor.buffer
+
+def test_frames_decode_as_soon_as_they_are_complete():
+    data = bytes(3 * compression.BLOCK)
+    stream = Compressor(io.BytesIO(data), "zlib", 6).read(1 << 30)
+    decompressor = Decompressor("zlib")
+    blocks = [decompressor.feed(stream[i:i + 1]) for i in range(len(stream))]
+    assert [len(block) for found in blocks for block in found] == [compression.BLOCK] * 3
+    assert sum(1 for found in blocks if found) == 3
+
+def test_incompressible_blocks_are_sent_raw_with_backoff():
+    data = random.Random(1).randbytes(40 * compression.BLOCK)
+    compressor = Compressor(io.BytesIO(data), "zlib", 6)
+    stream = b''.join(read_all(compressor, 1400))
+    assert frame_kinds(stream) == [FRAME_RAW] * 40
+    assert compressor.bypassed == 40
+    assert compressor.backoff == 32     #tried on blocks 1, 3, 6, 11, 20 and 37 only
+    decompressor = Decompressor("zlib")
+    assert b''.join(decompressor.feed(stream)) == data
+
+def test_backoff_is_capped_and_reset_by_a_compressible_block(monkeypatch):
+    #Tried on blocks 1, 3, 6, 11, 20, 37, 70, 135, 200, 265 and 330
+    data = random.Random(2).randbytes(329 * 64) + bytes(64)
+    monkeypatch.setattr(compression, "BLOCK", 64)
+    compressor = Compressor(io.BytesIO(data), "zlib", 6)
+    for block in range(329):
+        assert compressor.next_frame()
+    assert (compressor.backoff, compressor.skip, compressor.bypassed) == (MAX_SKIP, 0, 329)
+    assert compressor.next_frame()
+    assert FRAME_HEADER.unpack_from(compressor.frame)[0] == compression.FRAME_ZLIB
+    assert compressor.backoff == 0
+
+def test_declined_compression_passes_the_file_through():
+    data = random.Random(3).randbytes(5000)
+    compressor = Compressor(io.BytesIO(data), "zlib", 6)
+    compressor.kind = None  #as when the receiver declines the option
+    assert b''.join(read_all(compressor, 1000)) == data
+    assert compressor.compressedBytes == 0
+
+def test_unknown_frame_codec_is_rejected():
+    with pytest.raises(ValueError):
+        Decompressor("zlib").feed(FRAME_HEADER.pack(9, 1) + b'x')
@@ -0,0 +1,49 @@
+import threading
+
+from eventlog import EventLog, LogWriter, SND, RCV, DRP
+from stp import DATA, ACK
+
+
+def test_events_and_statistics_are_written_in_order(tmp_path):
+    log = EventLog(str(tmp_path / "log.txt"), capacity=8)
+    for seqnum in range(20):    #more than the ring holds
+        log.record(SND, DATA, seqnum, 1000)
+    log.write("\nStats: 1\n")
+    log.close()
+    lines = (tmp_path / "log.txt").read_text().splitlines()
+    assert [line.split()[3] for line in lines[:20]] == [str(seqnum) for seqnum in range(20)]
+    assert lines[-1] == "Stats: 1"
+
+def test_level_filters_events(tmp_path):
+    log = EventLog(str(tmp_path / "log.txt"), "drops")
+    log.record(SND, DATA, 1, 1000)
+    log.record(DRP, DATA, 2, 1000)
+    log.record(RCV, ACK, 3, 0)
+    log.close()
+    assert [line.split()[0] for line in (tmp_path / "log.txt").read_text().splitlines()] == ["drp"]
+
+def test_shared_writer_serves_many_logs_with_one_thread(tmp_path):
+    threads = threading.active_count()
+    writer = LogWriter(reopen=True)
+    logs = [EventLog(str(tmp_path / f"log.{i}.txt"), capacity=16, writer=writer) for i in range(50)]
+    assert threading.active_count() == threads + 1
+    for i, log in enumerate(logs):
+        for seqnum in range(i):
+            log.record(RCV, DATA, seqnum, 100)
+    for i, log in enumerate(logs):
+        log.write(f"\nEvents: {i}\n")
+        log.close()
+        assert log.file is None     #files are only open while being written
+    writer.close()
+    assert threading.active_count() == threads
+
+    for i in range(50):
+        lines = (tmp_path / f"log.{i}.txt").read_text().splitlines()
+        assert len(lines) == i + 2
+        assert lines[-1] == f"Events: {i}"
+
+def test_log_without_events_is_still_created(tmp_path):
+    writer = LogWriter(reopen=True)
+    EventLog(str(tmp_path / "empty.txt"), writer=writer).close()
+    writer.close()
+    assert (tmp_path / "empty.txt").read_text() == ""
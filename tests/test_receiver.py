@@ -0,0 +1,201 @@
+import hashlib
+import io
+import random
+import time
+
+from compression import Compressor, Decompressor
+from eventlog import EventLog
+from receiver import Connection, OutputFile, Reassembly, accept_options
+from stp import MAX_SEQ, MAX_MSS, MAX_MSS16, DATA, SYN, create_packet, decode_packet, decode_fin, encode_options
+from timers import TimerQueue
+
+
+def test_drain_delivers_contiguous_segments_in_order():
+    buffer = Reassembly(10000)
+    assert buffer.insert(0, 2000, b'c' * 1000)
+    assert buffer.insert(0, 1000, b'b' * 1000)
+    assert buffer.insert(0, 4000, b'e' * 1000)
+    assert buffer.buffered == 3000
+
+    #The segment at 0 arrived in order and was written, 1000 is next
+    expected, delivered = buffer.drain(1000)
+    assert expected == 3000
+    assert delivered == [b'b' * 1000, b'c' * 1000]
+    assert buffer.buffered == 1000
+    assert list(buffer.segments) == [4000]
+
+def test_drain_without_the_next_segment_delivers_nothing():
+    buffer = Reassembly(10000)
+    buffer.insert(0, 2000, b'x' * 1000)
+    assert buffer.drain(1000) == (1000, [])
+    assert buffer.buffered == 1000
+
+def test_insert_rejects_duplicates_and_the_expected_segment():
+    buffer = Reassembly(10000)
+    assert buffer.insert(0, 1000, b'x' * 1000)
+    assert not buffer.insert(0, 1000, b'x' * 1000)
+    assert not buffer.insert(0, 0, b'x' * 1000)
+    assert buffer.buffered == 1000
+
+def test_insert_rejects_data_outside_the_window():
+    buffer = Reassembly(3000)
+    assert buffer.insert(0, 2000, b'x' * 1000)
+    assert not buffer.insert(0, 2500, b'x' * 1000)     #ends past the window
+    assert not buffer.insert(0, MAX_SEQ - 1000, b'x' * 1000)   #behind the expected seq num
+    assert buffer.buffered == 1000
+
+def test_insert_accepts_data_up_to_the_edge_of_the_window():
+    buffer = Reassembly(2500)
+    assert buffer.insert(0, 500, b'x' * 1000)
+    assert buffer.insert(0, 1500, b'x' * 1000)
+    assert buffer.buffered == 2000
+
+def test_sequence_numbers_wrap():
+    buffer = Reassembly(10000)
+    start = MAX_SEQ - 1500
+    assert buffer.insert(start, MAX_SEQ - 500, b'a' * 1000)
+    assert buffer.insert(start, 500, b'b' * 1000)
+    expected, delivered = buffer.drain((start + 1000) % MAX_SEQ)
+    assert expected == 1500
+    assert delivered == [b'a' * 1000, b'b' * 1000]
+    assert buffer.buffered == 0
+
+def test_larger_sequence_space():
+    buffer = Reassembly(10000, max_seq=2**32)
+    assert buffer.insert(2**32 - 1000, 2**32 - 500, b'x' * 1000)
+    assert buffer.drain(2**32 - 500) == (500, [b'x' * 1000])
+
+def test_blocks_merge_contiguous_segments():
+    buffer = Reassembly(20000)
+    for seqnum in (3000, 1000, 6000, 2000, 5000):
+        buffer.insert(0, seqnum, b'x' * 1000)
+    assert buffer.blocks(8) == [(1000, 4000), (5000, 7000)]
+    buffer.insert(0, 4000, b'x' * 1000)     #fills the gap between the two ranges
+    assert buffer.blocks(8) == [(1000, 7000)]
+
+def test_blocks_are_limited_to_the_lowest_ranges():
+    buffer = Reassembly(20000)
+    for seqnum in (9000, 1000, 5000, 3000, 7000):
+        buffer.insert(0, seqnum, b'x' * 1000)
+    assert buffer.blocks(3) == [(1000, 2000), (3000, 4000), (5000, 6000)]
+
+def test_blocks_follow_the_delivery_of_the_first_range():
+    buffer = Reassembly(20000)
+    for seqnum in (1000, 2000, 4000):
+        buffer.insert(0, seqnum, b'x' * 1000)
+    expected, delivered = buffer.drain(1000)
+    assert expected == 3000
+    assert buffer.blocks(8) == [(4000, 5000)]
+    assert buffer.drain(5000)[1] == [] and buffer.blocks(8) == [(4000, 5000)]
+
+def test_blocks_wrap_with_the_sequence_space():
+    buffer = Reassembly(20000)
+    start = MAX_SEQ - 3000
+    for seqnum in (MAX_SEQ - 1000, 0, MAX_SEQ - 2000, 2000):
+        buffer.insert(start, seqnum, b'x' * 1000)
+    assert buffer.blocks(8) == [(MAX_SEQ - 2000, 1000), (2000, 3000)]
+
+def test_blocks_match_the_buffered_segments():
+    #Ranges maintained incrementally must always equal those recomputed from the segments
+    rng = random.Random(7)
+    buffer = Reassembly(200 * 100, max_seq=2**16)
+    expected = 2**16 - 5000
+    for step in range(3000):
+        seqnum = (expected + 100 * rng.randrange(200)) % buffer.max_seq
+        if seqnum == expected:
+            expected, delivered = buffer.drain((expected + 100) % buffer.max_seq)
+        else:
+            buffer.insert(expected, seqnum, b'x' * 100)
+        offsets = sorted((seq - expected) % buffer.max_seq for seq in buffer.segments)
+        ranges = []
+        for offset in offsets:
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1][1] = offset + 100
+            else:
+                ranges.append([offset, offset + 100])
+        assert buffer.blocks(len(ranges)) == [((expected + a) % buffer.max_seq, (expected + b) % buffer.max_seq) for a, b in ranges]
+
+def test_16_bit_sequence_numbers_cap_the_window_and_the_mss():
+    accepted = accept_options({"rwnd": "", "mss": "60000"}, 100000)
+    assert int(accepted["rwnd"]) == MAX_SEQ // 2
+    assert int(accepted["mss"]) == MAX_MSS16
+
+def test_32_bit_sequence_numbers_allow_large_windows():
+    accepted = accept_options({"seq32": "", "rwnd": "", "mss": "60000"}, 100000)
+    assert int(accepted["rwnd"]) == 100000
+    assert int(accepted["mss"]) == 60000
+    assert int(accept_options({"seq32": "", "mss": "99999"}, 100000)["mss"]) == MAX_MSS
+
+def test_duplicate_syn_leaves_the_transfer_alone(tmp_path):
+    timers = TimerQueue()
+    log = EventLog(str(tmp_path / "log.txt"))
+    connection = Connection(str(tmp_path / "out"), log, Reassembly(10000), timers, timers.timer(lambda: None))
+    syn = decode_packet(create_packet(SYN, 99, encode_options({"sack": ""})))
+    synAck = connection.handle(*syn)
+    assert decode_packet(connection.handle(DATA, 100, b'a' * 1000))[1] == 1100
+    time.sleep(0.01)
+    assert connection.handle(*syn) == synAck    #a copy the channel delayed
+    assert connection.ExpectedSeqNum == 1100
+    assert decode_packet(connection.handle(DATA, 1100, b'b' * 1000))[1] == 2100
+    assert connection.DupDataReceived == 1
+    connection.writefile.close()
+    log.close()
+    assert (tmp_path / "out").read_bytes() == b'a' * 1000 + b'b' * 1000
+
+    events = [line.split() for line in (tmp_path / "log.txt").read_text().splitlines()]
+    syns = [float(event[1]) for event in events if event[2] == "SYN"]
+    assert syns[0] == 0 and syns[1] >= 10     #the duplicate keeps the log clock
+
+def test_window_shrinks_with_the_data_held(tmp_path):
+    log = EventLog(str(tmp_path / "log.txt"), "stats")
+    connection = Connection(str(tmp_path / "out"), log, Reassembly(10000), TimerQueue(), window=True)
+    connection.writefile = OutputFile(open(tmp_path / "out", "wb", buffering=0), vectored=True)
+    assert connection.advertised() == 10000
+    connection.buffer.insert(0, 1000, b'x' * 3000)     #out of order
+    assert connection.advertised() == 7000
+    connection.writefile.write(b'y' * 1000)             #in order, not written yet
+    assert connection.advertised() == 6000
+    connection.writefile.flush()
+    assert connection.advertised() == 7000
+    connection.buffer.insert(0, 4000, b'z' * 6000)     #up to the edge of the window
+    assert connection.advertised() == 1000
+    connection.writefile.write(b'y' * 2000)
+    assert connection.advertised() == 0
+    connection.writefile.close()
+    log.close()
+
+def test_incomplete_compressed_frame_leaves_the_window_open(tmp_path):
+    log = EventLog(str(tmp_path / "log.txt"), "stats")
+    connection = Connection(str(tmp_path / "out"), log, Reassembly(10000), TimerQueue(), window=True)
+    connection.writefile = OutputFile(open(tmp_path / "out", "wb"))
+    connection.writefile.decoder = Decompressor("zlib")
+    frames = Compressor(io.BytesIO(random.Random(1).randbytes(50000)), "zlib", 6).read(20000)
+    connection.writefile.write(frames)  #a frame larger than the window, only more data completes it
+    assert connection.advertised() == 10000
+    connection.writefile.close()
+    log.close()
+
+def test_fin_carried_by_the_last_segment(tmp_path):
+    timers = TimerQueue()
+    log = EventLog(str(tmp_path / "log.txt"))
+    connection = Connection(str(tmp_path / "out"), log, Reassembly(10000), timers, timers.timer(lambda: None))
+    connection.handle(*decode_packet(create_packet(SYN, 99, encode_options({"close": "200", "checksum": ""}))))
+    data = random.Random(7).randbytes(250)
+
+    def deliver(seqnum, payload, fin=False):
+        packet = connection.fmt.create_packet(DATA, seqnum, payload, fin=fin)
+        assert decode_fin(packet) == fin
+        return decode_packet(connection.handle(*decode_packet(packet), decode_fin(packet)))[1]
+
+    #The last segment overtakes the first one, its FIN waits for the data before it
+    assert deliver(200, data[100:] + hashlib.sha256(data).digest(), fin=True) == 100
+    assert connection.finTime is None
+    assert deliver(100, data[:100]) == 351     #the data and the FIN after it
+    assert connection.finTime is not None
+    assert connection.digestOk
+    assert deliver(200, data[100:] + hashlib.sha256(data).digest(), fin=True) == 351  #resent: ACKed again
+    connection.close()
+    assert (tmp_path / "out").read_bytes() == data
+    events = [line.split()[2:] for line in (tmp_path / "log.txt").read_text().splitlines() if line.startswith("rcv")]
+    assert events[1:] == [["DATA", "200", "150"], ["FIN", "350", "0"], ["DATA", "100", "100"],
+                          ["DATA", "200", "150"], ["FIN", "350", "0"]]
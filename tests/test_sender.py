@@ -0,0 +1,70 @@
+from sender import Packet_list, Segment
+from stp import DATA, MAX_SEQ
+
+
+def window(start, count, size=1000, max_seq=MAX_SEQ):
+    """Send window holding count segments of size bytes from start."""
+    p_list = Packet_list(max_seq=max_seq)
+    for i in range(count):
+        p_list.append(Segment(DATA, (start + i * size) % max_seq, size, b'', b''))
+    return p_list
+
+
+def test_advance_releases_the_segments_covered():
+    p_list = window(0, 5)
+    freed, freedBytes, newest = p_list.advance(2000)
+    assert (freed, freedBytes, newest.seq) == (2, 2000, 1000)
+    assert p_list.inflight == 3000
+    assert p_list.sent[0].seq == 2000
+    assert 0 not in p_list.by_seq and 1000 not in p_list.by_seq
+
+def test_advance_ignores_acks_outside_the_window():
+    p_list = window(0, 5)
+    assert p_list.advance(0) == (0, 0, None)
+    assert p_list.advance(6000) == (0, 0, None)
+    assert p_list.advance(MAX_SEQ - 1000) == (0, 0, None)
+    assert p_list.inflight == 5000
+
+def test_advance_within_a_segment_releases_nothing():
+    p_list = window(0, 2)
+    assert p_list.advance(500) == (0, 0, None)
+
+def test_mark_sacked_flags_the_segments_in_the_blocks():
+    p_list = window(0, 6)
+    assert p_list.mark_sacked([(2000, 4000), (5000, 6000)])
+    assert [segment.sacked for segment in p_list.sent] == [False, False, True, True, False, True]
+    assert p_list.sack_high == 6000
+
+def test_mark_sacked_reports_only_new_information():
+    p_list = window(0, 6)
+    assert p_list.mark_sacked([(2000, 3000)])
+    assert not p_list.mark_sacked([(2000, 3000)])
+    assert p_list.mark_sacked([(2000, 4000)])   #the block grew
+    assert p_list.sack_marked[2000] == 4000      #marked up to there, not walked again
+
+def test_mark_sacked_ignores_stale_and_bogus_blocks():
+    p_list = window(1000, 4)
+    assert not p_list.mark_sacked([(0, 1000)])          #already ACKed
+    assert not p_list.mark_sacked([(1000, 2000)])       #starts at the cumulative ACK
+    assert not p_list.mark_sacked([(3000, 9000)])       #beyond what was sent
+    assert not p_list.mark_sacked([(3000, 2000)])
+    assert p_list.sack_high is None
+    assert not any(segment.sacked for segment in p_list.sent)
+
+def test_sack_high_is_dropped_once_acked():
+    p_list = window(0, 5)
+    p_list.mark_sacked([(2000, 3000)])
+    p_list.advance(2000)
+    assert p_list.sack_high == 3000
+    p_list.advance(3000)
+    assert p_list.sack_high is None
+    assert 2000 not in p_list.sack_marked
+
+def test_sack_across_the_wrap_of_the_sequence_space():
+    p_list = window(MAX_SEQ - 2000, 4)
+    assert p_list.mark_sacked([(MAX_SEQ - 1000, 1000)])
+    assert [segment.sacked for segment in p_list.sent] == [False, True, True, False]
+    assert p_list.sack_high == 1000
+    freed, freedBytes, newest = p_list.advance(1000)
+    assert (freed, newest.seq) == (3, 0)
+    assert p_list.sack_high is None
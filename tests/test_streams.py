@@ -0,0 +1,79 @@
+import os
+import random
+
+from stp import STREAM_HEADER, STREAM_DATA, STREAM_OPEN
+from streams import StreamSource, StreamSink
+
+
+def make_tree(root, files):
+    for name, data in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+
+def read_all(source, mss):
+    payloads = []
+    while True:
+        payload = source.read(mss)
+        if not payload:
+            return payloads
+        payloads.append(payload)
+
+
+def test_streams_round_trip_in_any_order(tmp_path):
+    rng = random.Random(3)
+    files = {"a.txt": rng.randbytes(5000), "sub/b.bin": rng.randbytes(123), "sub/deeper/c": b'', "d": rng.randbytes(999)}
+    make_tree(tmp_path / "in", files)
+
+    source = StreamSource(str(tmp_path / "in"), 2, 500)
+    payloads = read_all(source, 500)
+    assert all(len(payload) <= 500 for payload in payloads)
+    assert source.nextStream == len(files)
+    assert source.fileBytes == sum(len(data) for data in files.values())
+
+    rng.shuffle(payloads)   #data may overtake the opening of its stream
+    sink = StreamSink(str(tmp_path / "out"))
+    for payload in payloads:
+        sink.deliver(payload)
+    sink.close()
+
+    assert sink.completed == len(files)
+    for name, data in files.items():
+        assert (tmp_path / "out" / name).read_bytes() == data
+    assert not [name for name in os.listdir(tmp_path / "out") if name.startswith(".stream-")]
+
+def test_source_interleaves_up_to_concurrency_streams(tmp_path):
+    make_tree(tmp_path, {"a": b'a' * 1000, "b": b'b' * 1000, "c": b'c' * 1000})
+    source = StreamSource(str(tmp_path), 2, 100 + STREAM_HEADER.size)
+    headers = [STREAM_HEADER.unpack_from(payload) for payload in read_all(source, 100 + STREAM_HEADER.size)]
+    assert [kind for kind, stream, value in headers[:2]] == [STREAM_OPEN, STREAM_OPEN]
+    assert [stream for kind, stream, value in headers[2:6]] == [0, 1, 0, 1]
+    #The third file opens only once one of the first two is done
+    opened = [i for i, (kind, stream, value) in enumerate(headers) if kind == STREAM_OPEN]
+    assert opened[2] > max(i for i, (kind, stream, value) in enumerate(headers) if stream == 0)
+
+def test_source_offsets_follow_each_file(tmp_path):
+    make_tree(tmp_path, {"a": bytes(range(256)) * 10})
+    source = StreamSource(str(tmp_path / "a"), 1, 300)
+    payloads = read_all(source, 300)
+    assert STREAM_HEADER.unpack_from(payloads[0]) == (STREAM_OPEN, 0, 2560)
+    offsets = [STREAM_HEADER.unpack_from(payload)[2] for payload in payloads[1:]]
+    assert offsets == list(range(0, 2560, 300 - STREAM_HEADER.size))
+    assert all(STREAM_HEADER.unpack_from(payload)[0] == STREAM_DATA for payload in payloads[1:])
+
+def test_sink_keeps_files_inside_its_directory(tmp_path):
+    sink = StreamSink(str(tmp_path / "out"))
+    sink.deliver(STREAM_HEADER.pack(STREAM_OPEN, 0, 2) + b'../../escape')
+    sink.deliver(STREAM_HEADER.pack(STREAM_DATA, 0, 0) + b'ok')
+    sink.close()
+    assert (tmp_path / "out" / "escape").read_bytes() == b'ok'
+    assert not (tmp_path / "escape").exists()
+
+def test_sink_closes_incomplete_streams(tmp_path):
+    sink = StreamSink(str(tmp_path))
+    sink.deliver(STREAM_HEADER.pack(STREAM_OPEN, 0, 10) + b'f')
+    sink.deliver(STREAM_HEADER.pack(STREAM_DATA, 0, 0) + b'12345')
+    sink.close()
+    assert sink.completed == 0
+    assert not sink.streams
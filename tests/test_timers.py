@@ -0,0 +1,105 @@
+import pytest
+
+import timers
+from timers import TimerQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock for the timer queue, advanced by the test."""
+    now = [1000.0]
+    monkeypatch.setattr(timers.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_no_timeout_without_armed_timers(clock):
+    queue = TimerQueue()
+    queue.timer(print)
+    assert queue.timeout() is None
+
+def test_timers_fire_in_deadline_order(clock):
+    queue = TimerQueue()
+    fired = []
+    late = queue.timer(fired.append, "late")
+    early = queue.timer(fired.append, "early")
+    queue.arm(late, 2)
+    queue.arm(early, 1)
+    assert queue.timeout() == 1
+
+    clock[0] += 0.5
+    queue.run()
+    assert fired == []
+    clock[0] += 2
+    queue.run()
+    assert fired == ["early", "late"]
+    assert not late.armed() and not early.armed()
+    assert queue.timeout() is None
+
+def test_rearm_later_postpones_without_a_heap_push(clock):
+    queue = TimerQueue()
+    fired = []
+    timer = queue.timer(fired.append, 1)
+    queue.arm(timer, 1)
+    queue.arm(timer, 3)
+    assert queue.pushed == 1
+    assert queue.rearmed == 1
+
+    clock[0] += 1
+    queue.run()
+    assert fired == []
+    assert queue.timeout() == 2     #the stale entry was pushed back to the new deadline
+    clock[0] += 2
+    queue.run()
+    assert fired == [1]
+
+def test_rearm_earlier_fires_at_the_new_deadline_once(clock):
+    queue = TimerQueue()
+    fired = []
+    timer = queue.timer(fired.append, 1)
+    queue.arm(timer, 3)
+    queue.arm(timer, 1)
+    clock[0] += 1
+    queue.run()
+    assert fired == [1]
+    clock[0] += 5
+    queue.run()
+    assert fired == [1]
+    assert not queue.heap
+
+def test_cancelled_timer_never_fires(clock):
+    queue = TimerQueue()
+    fired = []
+    timer = queue.timer(fired.append, 1)
+    queue.arm(timer, 1)
+    queue.cancel(timer)
+    assert not timer.armed()
+    assert queue.timeout() is None
+    clock[0] += 2
+    queue.run()
+    assert fired == []
+    assert queue.cancelled == 1
+
+def test_zero_delay_fires_on_the_next_run(clock):
+    queue = TimerQueue()
+    fired = []
+    queue.arm(queue.timer(fired.append, 1), 0)
+    assert queue.timeout() == 0
+    queue.run()
+    assert fired == [1]
+
+def test_callback_may_rearm_its_timer(clock):
+    queue = TimerQueue()
+    fired = []
+
+    def tick():
+        fired.append(clock[0])
+        if len(fired) < 3:
+            queue.arm(timer, 1)
+
+    timer = queue.timer(tick)
+    queue.arm(timer, 1)
+    for step in range(5):
+        clock[0] += 1
+        queue.run()
+    assert fired == [1001.0, 1002.0, 1003.0]
+    assert queue.fired == 3
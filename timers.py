@@ -0,0 +1,149 @@
+"""
+Timer facility shared by sender.py and receiver.py.
+
+All timers of a program live in one deadline heap that is serviced by that program's
+event loop, so arming a timer never creates a thread. Re-arming a timer to a later
+deadline (the common case: the RTO restarted on every ACK) and cancelling are O(1):
+only the handle is updated and the stale heap entry is skipped, or pushed again at its
+new deadline, when it reaches the top of the heap.
+"""
+import heapq
+import time
+from itertools import count
+
+
+class Timer:
+    """Handle of a single timer, reusable for any number of arm/cancel cycles."""
+    __slots__ = ("callback", "args", "deadline", "queued")
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.deadline = None    #monotonic time the timer should fire (None = not armed)
+        self.queued = None      #deadline of this timer's live heap entry (None = not in heap)
+
+    def armed(self):
+        """Return True if the timer is armed."""
+        return self.deadline is not None
+
+
+class TimerQueue:
+    """Deadline heap of Timer handles, driven by an event loop via timeout() and run()."""
+
+    def __init__(self):
+        self.heap = []
+        self.order = count()    #tie breaker so handles are never compared
+        self.armed = 0          #Counters showing timer churn
+        self.rearmed = 0        # " " (arm() calls served without touching the heap)
+        self.cancelled = 0      # " "
+        self.fired = 0          # " "
+        self.pushed = 0         # " " (heap insertions)
+
+    def timer(self, callback, *args):
+        """
+        Create a timer handle. The timer is not armed.
+
+        Args:
+            callback: function called when the timer fires
+            args: arguments passed to callback
+
+        Returns:
+            Timer
+        """
+        return Timer(callback, args)
+
+    def arm(self, timer, delay):
+        """
+        Arm (or re-arm) the timer to fire delay seconds from now.
+
+        Args:
+            timer: Timer
+            delay: float (seconds)
+
+        Returns:
+
+        """
+        deadline = time.monotonic() + delay
+        self.armed += 1
+        timer.deadline = deadline
+        if timer.queued is not None and timer.queued <= deadline:
+            #The heap entry fires no later than needed, it is pushed back lazily.
+            self.rearmed += 1
+            return
+
+        timer.queued = deadline
+        heapq.heappush(self.heap, (deadline, next(self.order), timer))
+        self.pushed += 1
+
+    def cancel(self, timer):
+        """
+        Disarm the timer. Its heap entry is discarded lazily.
+
+        Args:
+            timer: Timer
+
+        Returns:
+
+        """
+        if timer.deadline is not None:
+            timer.deadline = None
+            self.cancelled += 1
+
+    def _settle(self):
+        """Drop cancelled and stale entries from the top of the heap, pushing postponed ones back."""
+        heap = self.heap
+        while heap:
+            deadline, order, timer = heap[0]
+            if timer.queued != deadline:
+                heapq.heappop(heap)     #superseded by an earlier entry of the same timer
+            elif timer.deadline is None:
+                heapq.heappop(heap)
+                timer.queued = None
+            elif timer.deadline > deadline:
+                timer.queued = timer.deadline
+                heapq.heapreplace(heap, (timer.deadline, next(self.order), timer))
+                self.pushed += 1
+            else:
+                return
+
+    def timeout(self):
+        """
+        Time until the earliest armed timer fires, for use as a select/recv timeout.
+
+        Returns:
+            float (seconds, >= 0) or None if no timer is armed
+        """
+        self._settle()
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - time.monotonic())
+
+    def run(self):
+        """
+        Fire every timer whose deadline has passed.
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        self._settle()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, order, timer = heapq.heappop(self.heap)
+            timer.queued = None
+            timer.deadline = None
+            self.fired += 1
+            timer.callback(*timer.args)
+            self._settle()
+
+    def stats(self):
+        """
+        Return the churn counters as log lines.
+
+        Returns:
+            str
+        """
+        return (f"Timers armed: {self.armed}\n"
+                f"Timers re-armed in place: {self.rearmed}\n"
+                f"Timers cancelled: {self.cancelled}\n"
+                f"Timers fired: {self.fired}\n"
+                f"Timer heap pushes: {self.pushed}\n")